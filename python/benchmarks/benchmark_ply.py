@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+""" Compare the speed and file size of binary and ascii PLY output """
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import vsi.utils.mesh_utils as mesh_utils
+
+
+def benchmark_ply(num_points, num_faces):
+  """ write a random point cloud and mesh in both formats, and report the
+      time taken and size of each file
+
+      Parameters
+      ----------
+      num_points : int
+        The number of points (and mesh vertices)
+      num_faces : int
+        The number of triangles in the mesh
+
+      Returns
+      -------
+      list
+        (description, seconds, bytes) of each file written
+  """
+  rng = np.random.default_rng(0)
+  pts = rng.uniform(-1000, 1000, (num_points, 3))
+  normals = rng.normal(size=(num_points, 3))
+  colors = rng.integers(0, 256, (num_points, 3), dtype=np.uint8)
+  faces = rng.integers(0, num_points, (num_faces, 3))
+
+  results = []
+  with tempfile.TemporaryDirectory() as temp_dir:
+    filename = os.path.join(temp_dir, 'benchmark.ply')
+    for binary in (True, False):
+      fmt = 'binary' if binary else 'ascii'
+      start = time.time()
+      mesh_utils.save_point_cloud_ply(filename, pts, normals, colors, binary=binary)
+      results.append(('point cloud, ' + fmt, time.time() - start,
+                      os.path.getsize(filename)))
+      start = time.time()
+      mesh_utils.save_mesh_ply(filename, pts, faces, colors, binary=binary)
+      results.append(('mesh, ' + fmt, time.time() - start,
+                      os.path.getsize(filename)))
+  return results
+
+
+def main():
+  """ main """
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--num_points', type=int, default=1000000)
+  parser.add_argument('--num_faces', type=int, default=2000000)
+  args = parser.parse_args()
+
+  for description, seconds, num_bytes in benchmark_ply(args.num_points, args.num_faces):
+    print('%-20s %8.2f s %10.1f MB' % (description, seconds, num_bytes / 1e6))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,257 @@
+import unittest
+
+try:
+  import numpy as np
+  from vsi.utils import camera_utils, geometry_utils
+except ImportError:
+  np = None
+
+
+def make_camera(center, angles, image_size=(64, 48), focal_len=50.0):
+  K = camera_utils.construct_K(image_size, focal_len=focal_len)
+  R = geometry_utils.Euler_angles_to_matrix(*angles)
+  T = -np.dot(R, center)
+  return camera_utils.ProjectiveCamera(np.dot(K, np.hstack((R, T.reshape(3, 1)))))
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class CameraUtilsTest(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.default_rng(0)
+    self.camera = make_camera(np.array((0.5, -0.2, -10.0)), (0.05, -0.1, 0.2))
+
+  def test_project_points_array(self):
+    pts = self.rng.uniform(-3, 3, (100, 3))
+    expected = np.array(self.camera.project_points(pts))
+    np.testing.assert_allclose(self.camera.project_points_array(pts), expected)
+
+    pts_2d, visible = self.camera.project_points_array(
+        pts.astype(np.float32), image_shape=(48, 64), chunk_size=7)
+    self.assertEqual(pts_2d.dtype, np.float32)
+    np.testing.assert_allclose(pts_2d, expected, rtol=1e-4)
+    in_bounds = ((expected[:, 0] >= 0) & (expected[:, 0] < 64) &
+                 (expected[:, 1] >= 0) & (expected[:, 1] < 48))
+    np.testing.assert_array_equal(visible, in_bounds)
+
+    # points behind the camera are not visible
+    _, visible = self.camera.project_points_array(((0.5, -0.2, -20.0),),
+                                                  image_shape=(48, 64))
+    self.assertFalse(visible[0])
+
+  def test_project_vectors_array(self):
+    vecs = self.rng.uniform(-1, 1, (10, 3)) + (0, 0, 2)
+    np.testing.assert_allclose(self.camera.project_vectors_array(vecs),
+                               np.array(self.camera.project_vectors(vecs)))
+
+  def test_backproject_points_plane_array(self):
+    plane = np.array((0.1, -0.2, 1.0, -2.0))
+    pts_2d = self.rng.uniform(0, 64, (20, 2))
+    expected = np.array(self.camera.backproject_points_plane(pts_2d, plane))
+
+    pts_3d = self.camera.backproject_points_plane_array(pts_2d, plane)
+    np.testing.assert_allclose(pts_3d, expected)
+    np.testing.assert_allclose(np.dot(pts_3d, plane[0:3]) + plane[3], 0,
+                               atol=1e-9)
+    np.testing.assert_allclose(self.camera.project_points_array(pts_3d), pts_2d)
+    # a plane given as a column
+    np.testing.assert_allclose(
+        self.camera.backproject_points_plane_array(pts_2d, plane.reshape(4, 1)),
+        expected)
+
+    # one plane per point
+    planes = np.tile(plane, (20, 1))
+    planes[::2, 3] = -4.0
+    pts_3d = self.camera.backproject_points_plane_array(pts_2d, planes)
+    for pt_2d, pln, pt_3d in zip(pts_2d, planes, pts_3d):
+      np.testing.assert_allclose(
+          pt_3d, self.camera.backproject_point_plane(pt_2d, pln))
+
+  def test_triangulate_points(self):
+    cameras = [self.camera,
+               make_camera(np.array((2.0, 0.0, -10.0)), (0.0, -0.2, 0.0)),
+               make_camera(np.array((-1.0, 1.0, -9.0)), (0.1, 0.05, 0.0))]
+    pts = self.rng.uniform(-2, 2, (30, 3))
+    projections = np.stack([c.project_points_array(pts) for c in cameras],
+                           axis=1)
+    noisy = projections + self.rng.normal(0, 0.5, projections.shape)
+    noisy[3, 1] = np.nan
+    noisy[4, 0:2] = np.nan
+
+    result, errors = camera_utils.triangulate_points(cameras, noisy)
+    self.assertEqual(result.shape, (30, 3))
+    self.assertTrue(np.isnan(result[4]).all())
+    self.assertTrue(np.isnan(errors[4]))
+    for n in (0, 3, 17):
+      views = [m for m in range(3) if np.isfinite(noisy[n, m, 0])]
+      expected = camera_utils.triangulate_point(
+          [cameras[m] for m in views], [noisy[n, m] for m in views],
+          return_homogeneous=False)
+      np.testing.assert_allclose(result[n], expected)
+      reproj = np.array([cameras[m].project_point(expected) for m in views])
+      self.assertAlmostEqual(
+          errors[n], np.sqrt(((reproj - noisy[n, views])**2).sum(axis=1).mean()))
+
+    # exact projections are recovered by both methods
+    for method in ('DLT', 'midpoint'):
+      result, errors = camera_utils.triangulate_points(
+          np.array([c.P for c in cameras]), projections, method=method,
+          chunk_size=7)
+      np.testing.assert_allclose(result, pts, atol=1e-8)
+      np.testing.assert_allclose(errors, 0, atol=1e-8)
+
+  def test_viewing_ray_grid(self):
+    rays = camera_utils.viewing_ray_grid(self.camera, (48, 64))
+    self.assertEqual(rays.shape, (48, 64, 3))
+    self.assertEqual(rays.dtype, np.float32)
+    self.assertFalse(rays.flags.writeable)
+    self.assertIs(rays, camera_utils.viewing_ray_grid(self.camera, (48, 64)))
+    np.testing.assert_allclose(np.linalg.norm(rays, axis=2), 1, rtol=1e-6)
+
+    # points along each ray project back onto the pixel, in front of the camera
+    center = np.array((0.5, -0.2, -10.0))
+    for y, x in ((1, 1), (10, 50), (46, 62)):
+      pt = center + 5 * rays[y, x]
+      pt_2d, visible = self.camera.project_points_array((pt,),
+                                                        image_shape=(48, 64))
+      np.testing.assert_allclose(pt_2d[0], (x, y), atol=1e-4)
+      self.assertTrue(visible[0])
+
+    strided = camera_utils.viewing_ray_grid(self.camera, (48, 64), stride=5)
+    self.assertEqual(strided.shape, (10, 13, 3))
+    np.testing.assert_array_equal(strided, rays[::5, ::5])
+
+    camera_utils.viewing_ray_grid.cache_clear()
+    self.assertIsNot(rays, camera_utils.viewing_ray_grid(self.camera, (48, 64)))
+
+  def make_bundle(self):
+    centers = self.rng.uniform(-5, 5, (6, 3))
+    centers[:, 2] = -10
+    angles = self.rng.uniform(-0.1, 0.1, (6, 3))
+    cameras = [make_camera(c, a) for c, a in zip(centers, angles)]
+    return cameras, camera_utils.CameraBundle.from_cameras(cameras, (48, 64))
+
+  def test_camera_bundle(self):
+    cameras, bundle = self.make_bundle()
+    self.assertEqual(len(bundle), 6)
+    pts = self.rng.uniform(-3, 3, (50, 3))
+    pts[0] = (0, 0, -30)  # behind all the cameras
+
+    pts_2d = bundle.project(pts, chunk_size=40)
+    visible = bundle.visibility(pts, chunk_size=40)
+    self.assertEqual(pts_2d.shape, (6, 50, 2))
+    for camera, cam_2d, cam_vis in zip(cameras, pts_2d, visible):
+      expected, expected_vis = camera.project_points_array(
+          pts, image_shape=(48, 64))
+      np.testing.assert_allclose(cam_2d, expected)
+      np.testing.assert_array_equal(cam_vis, expected_vis)
+    self.assertFalse(visible[:, 0].any())
+    self.assertFalse(bundle.visibility(pts, max_distance=1).any())
+
+    for camera, centers in zip(bundle.to_cameras(), bundle.centers):
+      np.testing.assert_allclose(np.dot(camera.P, np.append(centers, 1)), 0,
+                                 atol=1e-9)
+    np.testing.assert_allclose(bundle.principal_rays[:, 2], 1, atol=0.02)
+
+    indices, distances = bundle.nearest_cameras(pts, k=2, chunk_size=12)
+    dists = np.linalg.norm(pts[:, np.newaxis] - bundle.centers, axis=2)
+    np.testing.assert_array_equal(indices, np.argsort(dists, axis=1)[:, 0:2])
+    np.testing.assert_allclose(distances, np.sort(dists, axis=1)[:, 0:2])
+
+  def test_camera_bundle_from_bundler_file(self):
+    import os
+    import tempfile
+    R = geometry_utils.Euler_angles_to_matrix(0.1, -0.05, 0.2)
+    T = np.array((0.3, -0.2, -8.0))
+    f = 40.0
+    fd, filename = tempfile.mkstemp(suffix='.out')
+    with os.fdopen(fd, 'w') as fid:
+      fid.write('# Bundle file v0.3\n1 0\n%f 0 0\n' % f)
+      for row in R:
+        fid.write('%f %f %f\n' % tuple(row))
+      fid.write('%f %f %f\n' % tuple(T))
+    try:
+      bundle = camera_utils.CameraBundle.from_bundler_file(filename, (48, 64))
+    finally:
+      os.remove(filename)
+
+    # bundler convention: p = R X + T, (u, v) = -f p.xy / p.z, y up
+    pt = np.array((0.2, 0.1, 0.5))
+    p = np.dot(R, pt) + T
+    expected = (32 - f * p[0] / p[2], 24 + f * p[1] / p[2])
+    np.testing.assert_allclose(bundle.project((pt,))[0, 0], expected,
+                               atol=1e-4)
+    self.assertTrue(bundle.visibility((pt,))[0, 0])
+
+  def test_camera_bundle_from_bad_nvm_file(self):
+    import contextlib
+    import io
+    import os
+    import tempfile
+    fd, filename = tempfile.mkstemp(suffix='.nvm')
+    with os.fdopen(fd, 'w') as fid:
+      fid.write('not an nvm file\n')
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        for bad_filename in (filename, filename + '.missing'):
+          with self.assertRaises(IOError):
+            camera_utils.CameraBundle.from_nvm_file(bad_filename)
+    finally:
+      os.remove(filename)
+
+  def test_camera_bundle_from_nvm_file(self):
+    import contextlib
+    import io
+    import os
+    import tempfile
+    R = geometry_utils.Euler_angles_to_matrix(0.1, -0.05, 0.2)
+    center = np.array((0.3, -0.2, -8.0))
+    f = 40.0
+    q = geometry_utils.matrix_to_quaternion(R)
+    fd, filename = tempfile.mkstemp(suffix='.nvm')
+    with os.fdopen(fd, 'w') as fid:
+      fid.write('NVM_V3\n\n1\n')
+      fid.write('img0.jpg %f %f %f %f %f %f %f %f 0 0\n' %
+                ((f,) + tuple(q) + tuple(center)))
+      fid.write('0\n')
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        bundle, img_fnames = camera_utils.CameraBundle.from_nvm_file(filename,
+                                                                     (48, 64))
+    finally:
+      os.remove(filename)
+    self.assertEqual(img_fnames, ['img0.jpg'])
+
+    # NVM convention: p = R (X - C), (u, v) = center + f p.xy / p.z
+    K = np.array(((f, 0, 32), (0, f, 24), (0, 0, 1)))
+    camera = camera_utils.ProjectiveCamera(
+        np.dot(K, np.hstack((R, -np.dot(R, center).reshape(3, 1)))))
+    pts = self.rng.uniform(-1, 1, (5, 3))
+    np.testing.assert_allclose(bundle.project(pts)[0],
+                               camera.project_points_array(pts), atol=1e-4)
+
+  def test_camera_bundle_from_KRT_files(self):
+    import os
+    import shutil
+    import tempfile
+    from vsi.utils import io_utils
+    K = camera_utils.construct_K((64, 48), focal_len=50.0)
+    cameras = []
+    filenames = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      for i in range(3):
+        R = geometry_utils.Euler_angles_to_matrix(*self.rng.uniform(-0.2, 0.2, 3))
+        T = -np.dot(R, self.rng.uniform(-1, 1, 3) + (0, 0, -10))
+        cameras.append(camera_utils.ProjectiveCamera(
+            np.dot(K, np.hstack((R, T.reshape(3, 1))))))
+        filenames.append(os.path.join(tmp_dir, 'camera%d.txt' % i))
+        io_utils.write_camera_KRT(K, R, T, filenames[-1])
+      bundle = camera_utils.CameraBundle.from_KRT_files(filenames)
+    finally:
+      shutil.rmtree(tmp_dir)
+    self.assertEqual(len(bundle), 3)
+    pts = self.rng.uniform(-1, 1, (5, 3))
+    for camera, projected in zip(cameras, bundle.project(pts)):
+      # the files store 6 decimal places
+      np.testing.assert_allclose(projected, camera.project_points_array(pts),
+                                 atol=1e-3)
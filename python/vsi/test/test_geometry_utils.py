@@ -0,0 +1,296 @@
+import unittest
+
+try:
+  import numpy as np
+  from vsi.utils import geometry_utils
+except ImportError:
+  np = None
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class GeometryUtilsTest(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.default_rng(0)
+
+  def test_fit_plane_3d_RANSAC(self):
+    normal = np.array((0.1, -0.2, 1.0))
+    normal /= np.linalg.norm(normal)
+    xy = self.rng.uniform(-10, 10, (3000, 2))
+    # z such that normal . p = 2
+    z = (2 - xy.dot(normal[0:2])) / normal[2]
+    points = np.column_stack((xy, z))
+    points += self.rng.normal(0, 0.02, points.shape)
+    outliers = self.rng.uniform(0, 3000, 1000).astype(int)
+    points[outliers] = self.rng.uniform(-10, 10, (1000, 3))
+
+    for kwargs in ({}, {'preemptive_size': 500, 'local_optimization': False}):
+      plane, inliers = geometry_utils.fit_plane_3d_RANSAC(
+          points, inlier_thresh=0.1, max_draws=1000, rng=1, **kwargs)
+      if plane[3] > 0:
+        plane = -plane
+      np.testing.assert_allclose(plane, np.append(normal, -2), atol=0.01)
+      dists = np.abs(np.dot(points, plane[0:3]) + plane[3])
+      self.assertGreater(inliers.sum(), 1900)
+      self.assertTrue((dists[inliers] < 0.15).all())
+
+    # the same seed gives the same result
+    result1 = geometry_utils.fit_plane_3d_RANSAC(points, 0.1, rng=5)
+    result2 = geometry_utils.fit_plane_3d_RANSAC(points, 0.1, rng=5)
+    np.testing.assert_array_equal(result1[1], result2[1])
+
+  def test_ransac_num_draws(self):
+    self.assertEqual(geometry_utils._ransac_num_draws(1.0, 3, 0.99), 0)
+    # (1 - 0.5^3)^k <= 0.01
+    self.assertEqual(geometry_utils._ransac_num_draws(0.5, 3, 0.99), 35)
+
+  def test_rasterize_plane_array(self):
+    plane = np.array((0.2, -0.3, 0.9, -1.5))
+    expected = list(geometry_utils.rasterize_plane((-2, -1, 0), (20, 15, 10),
+                                                   0.25, plane))
+    cells = geometry_utils.rasterize_plane_array((-2, -1, 0), (20, 15, 10),
+                                                 0.25, plane, chunk_size=40)
+    self.assertEqual(cells.dtype, np.int32)
+    self.assertGreater(len(expected), 0)
+    np.testing.assert_array_equal(cells, expected)
+
+  def test_voxelize_triangles(self):
+    vertices = self.rng.uniform(0.2, 3.8, (6, 3))
+    faces = ((0, 1, 2), (3, 4, 5), (0, 2, 4))
+    origin = np.zeros(3)
+    dims = (16, 16, 13)
+    occupancy = geometry_utils.voxelize_triangles(vertices, faces, origin,
+                                                  dims, 0.25, batch_size=100)
+    self.assertEqual(occupancy.shape, dims)
+
+    # every cell containing a point of a triangle is occupied
+    bary = self.rng.dirichlet((1, 1, 1), 2000)
+    expected = np.zeros(dims, bool)
+    for face in faces:
+      pts = bary.dot(vertices[list(face)])
+      cells = np.floor(pts / 0.25).astype(int)
+      # the grid is cut off in z
+      cells = cells[cells[:, 2] < dims[2]]
+      expected[tuple(cells.T)] = True
+    self.assertTrue(occupancy[expected].all())
+    # and every occupied cell is near a triangle plane
+    centers = (np.argwhere(occupancy) + 0.5) * 0.25
+    dists = []
+    for face in faces:
+      plane = geometry_utils.fit_plane_3_points(vertices[list(face)])
+      dists.append(np.abs(centers.dot(plane[0:3]) + plane[3]))
+    self.assertTrue((np.min(dists, axis=0) <= 0.125 * np.sqrt(3) + 1e-9).all())
+
+    packed = geometry_utils.voxelize_triangles(vertices, faces, origin, dims,
+                                               0.25, packed=True, batch_size=100)
+    np.testing.assert_array_equal(packed, np.packbits(occupancy, axis=-1))
+
+    # the boxes of large triangles are split into batches of a few cells
+    np.testing.assert_array_equal(
+        geometry_utils.voxelize_triangles(vertices, faces, origin, dims, 0.25),
+        occupancy)
+    np.testing.assert_array_equal(
+        geometry_utils.voxelize_triangles(vertices, faces, origin, dims, 0.25,
+                                          batch_size=7),
+        occupancy)
+
+  def test_rotation_batches(self):
+    qs = self.rng.normal(size=(200, 4))
+    # 180 degree rotations exercise every branch of matrix_to_quaternion
+    qs[0:4] = np.eye(4)
+    rots = geometry_utils.quaternion_to_matrix_batch(qs)
+    expected = [geometry_utils.quaternion_to_matrix(q.copy()) for q in qs]
+    np.testing.assert_array_equal(rots, expected)
+    np.testing.assert_array_equal(
+        geometry_utils.matrix_to_quaternion_batch(rots),
+        [geometry_utils.matrix_to_quaternion(rot) for rot in rots])
+
+    q2 = self.rng.normal(size=(200, 4))
+    np.testing.assert_array_equal(
+        geometry_utils.quaternion_multiply_batch(qs, q2),
+        [geometry_utils.compose_quaternions((a, b)) for a, b in zip(qs, q2)])
+
+    axes = self.rng.normal(size=(200, 3))
+    angles = self.rng.uniform(-np.pi, np.pi, (3, 200))
+    np.testing.assert_array_equal(
+        geometry_utils.axis_angle_to_matrix_batch(axes, angles[0]),
+        [geometry_utils.axis_angle_to_matrix(axis, theta)
+         for axis, theta in zip(axes, angles[0])])
+
+    for order in ('XYZ', 'XZY', 'YXZ', 'YZX', 'ZXY', 'ZYX'):
+      np.testing.assert_array_equal(
+          geometry_utils.Euler_angles_to_matrix_batch(*angles, order=order),
+          [geometry_utils.Euler_angles_to_matrix(*theta, order=order)
+           for theta in angles.T])
+      np.testing.assert_array_equal(
+          geometry_utils.matrix_to_Euler_angles_batch(rots, order=order),
+          np.transpose([geometry_utils.matrix_to_Euler_angles(rot, order=order)
+                        for rot in rots]))
+    with self.assertRaises(ValueError):
+      geometry_utils.Euler_angles_to_quaternion_batch(*angles, order='XXY')
+
+  def test_quaternion_slerp(self):
+    q0 = geometry_utils.axis_angle_to_quaternion_batch((0, 0, 1), 0.2)
+    q1 = geometry_utils.axis_angle_to_quaternion_batch((0, 0, 1), 1.0)
+    t = np.array((0, 0.25, 1))
+    expected = geometry_utils.axis_angle_to_quaternion_batch((0, 0, 1),
+                                                             0.2 + 0.8 * t)
+    np.testing.assert_allclose(geometry_utils.quaternion_slerp(q0, q1, t),
+                               expected, atol=1e-12)
+    # -q1 is the same rotation, and the shortest path is taken
+    np.testing.assert_allclose(geometry_utils.quaternion_slerp(q0, -q1, t),
+                               expected, atol=1e-12)
+    np.testing.assert_allclose(geometry_utils.quaternion_slerp(q0, q0, t),
+                               np.tile(q0, (3, 1)), atol=1e-12)
+
+  def make_boxes(self, num_boxes):
+    min_pts = self.rng.uniform(0, 100, (num_boxes, 2))
+    return geometry_utils.BoxArray.from_min_max(
+        min_pts, min_pts + self.rng.uniform(0, 8, (num_boxes, 2)))
+
+  def test_box_array(self):
+    boxes = self.make_boxes(50)
+    box_list = boxes.to_boxes()
+    self.assertIsInstance(box_list[0], geometry_utils.Box2D)
+    np.testing.assert_array_equal(boxes.area(), [b.area() for b in box_list])
+    np.testing.assert_array_equal(
+        geometry_utils.BoxArray.from_boxes(box_list).boxes, boxes.boxes)
+
+    other = self.make_boxes(50)
+    inter = boxes.intersection(other)
+    union = boxes.union(other)
+    for i, (b0, b1) in enumerate(zip(box_list, other.to_boxes())):
+      expected = geometry_utils.intersection(b0, b1)
+      np.testing.assert_array_equal(inter.boxes[i], (expected.min_pt, expected.max_pt))
+      self.assertEqual(inter.area()[i], expected.area())
+      expected = geometry_utils.union(b0, b1)
+      np.testing.assert_array_equal(union.boxes[i], (expected.min_pt, expected.max_pt))
+
+    inter_areas = boxes.intersection_areas(other, chunk_size=70)
+    iou = boxes.iou(other, chunk_size=70)
+    for i, j in ((0, 0), (3, 7), (10, 20)):
+      expected = geometry_utils.intersection(box_list[i], other[j]).area()
+      self.assertAlmostEqual(inter_areas[i, j], expected)
+    self.assertEqual(iou.shape, (50, 50))
+    np.testing.assert_allclose(np.diag(boxes.iou()), 1.0)
+    self.assertTrue(((iou >= 0) & (iou <= 1)).all())
+
+  def test_non_max_suppression(self):
+    boxes = geometry_utils.BoxArray((((0, 0), (10, 10)), ((1, 1), (11, 11)),
+                                     ((20, 20), (30, 30)), ((0, 0), (10, 5))))
+    keep = boxes.non_max_suppression((0.8, 0.9, 0.5, 0.7), iou_thresh=0.5)
+    # box 0 overlaps box 1 with IoU 81/119; box 3 overlaps box 1 by 36/164
+    np.testing.assert_array_equal(keep, (1, 3, 2))
+
+  def test_box_index(self):
+    boxes = self.make_boxes(3000)
+    index = geometry_utils.BoxIndex(boxes, node_capacity=8)
+    queries = self.make_boxes(40)
+    query_ids, box_ids = index.query_overlaps(queries, chunk_size=15)
+    found = set(zip(query_ids, box_ids))
+    self.assertEqual(len(found), len(query_ids))
+
+    expected = geometry_utils._boxes_overlap(queries.boxes[:, np.newaxis],
+                                             boxes.boxes[np.newaxis])
+    self.assertEqual(found, set(zip(*np.nonzero(expected))))
+    np.testing.assert_array_equal(index.query_window(queries[5]),
+                                  np.nonzero(expected[5])[0])
+
+  def test_non_max_suppression_random(self):
+    boxes = self.make_boxes(300)
+    scores = self.rng.random(300)
+    iou = boxes.iou()
+    expected = []
+    for i in np.argsort(-scores):
+      if all(iou[i, j] <= 0.2 for j in expected):
+        expected.append(i)
+    np.testing.assert_array_equal(boxes.non_max_suppression(scores, 0.2),
+                                  expected)
+
+  def random_affine(self):
+    H = np.eye(3)
+    H[0:2] = self.rng.normal(size=(2, 3)) + np.array(((1, 0, 0), (0, 1, 0)))
+    return H
+
+  def test_compute_2D_affine_xform_batch(self):
+    from_points = self.rng.uniform(-50, 50, (5, 20, 2))
+    to_points = np.empty_like(from_points)
+    for k in range(5):
+      H = self.random_affine()
+      to_points[k] = from_points[k].dot(H[0:2, 0:2].T) + H[0:2, 2]
+    to_points += self.rng.normal(0, 0.5, to_points.shape)
+    mask = self.rng.random((5, 20)) < 0.7
+
+    Hs = geometry_utils.compute_2D_affine_xform_batch(from_points, to_points)
+    Hs_masked = geometry_utils.compute_2D_affine_xform_batch(from_points,
+                                                             to_points, mask)
+    for k in range(5):
+      np.testing.assert_allclose(
+          Hs[k], geometry_utils.compute_2D_affine_xform(from_points[k], to_points[k]),
+          atol=1e-9)
+      np.testing.assert_allclose(
+          Hs_masked[k], geometry_utils.compute_2D_affine_xform(
+              from_points[k][mask[k]], to_points[k][mask[k]]), atol=1e-9)
+
+  def test_compute_2D_affine_xform_RANSAC(self):
+    H = self.random_affine()
+    from_points = self.rng.uniform(-50, 50, (400, 2))
+    to_points = from_points.dot(H[0:2, 0:2].T) + H[0:2, 2]
+    to_points += self.rng.normal(0, 0.1, to_points.shape)
+    outliers = self.rng.random(400) < 0.4
+    to_points[outliers] = self.rng.uniform(-100, 100, (outliers.sum(), 2))
+
+    for method in ('MSAC', 'RANSAC'):
+      H_est, inliers, residuals = geometry_utils.compute_2D_affine_xform_RANSAC(
+          from_points, to_points, inlier_thresh=0.5, method=method, rng=0)
+      np.testing.assert_allclose(H_est, H, atol=0.02)
+      self.assertTrue(inliers[~outliers].mean() > 0.95)
+      self.assertEqual(residuals.shape, (400,))
+      np.testing.assert_array_equal(inliers, residuals < 0.5)
+
+  def test_intersect_plane_rays(self):
+    plane = np.array((0.3, -0.2, 0.9, 1.5))
+    origins = self.rng.normal(size=(20, 3))
+    vectors = self.rng.normal(size=(20, 3))
+    points, dists = geometry_utils.intersect_plane_rays(plane, origins, vectors,
+                                                        return_distances=True)
+    for origin, vector, point in zip(origins, vectors, points):
+      np.testing.assert_allclose(
+          point, geometry_utils.intersect_plane_ray(plane, origin, vector))
+    np.testing.assert_allclose(points, origins + dists[:, np.newaxis] * vectors)
+
+  def test_traverse_voxels(self):
+    grid_origin = np.array((-1.0, 0.0, 2.0))
+    grid_dims = (8, 6, 5)
+    vox_len = 0.5
+    origins = self.rng.uniform(-3, 6, (60, 3))
+    targets = self.rng.uniform(0, 1, (60, 3)) * np.multiply(grid_dims, vox_len) + grid_origin
+    vectors = targets - origins
+    vectors[0] = (1, 0, 0)  # axis aligned, may miss
+    origins[1] = grid_origin + (0.1, 0.2, 0.3)  # starts inside
+    vectors[1] = (0.3, 0.5, -0.1)
+    offsets, voxels, entries, exits = geometry_utils.traverse_voxels(
+        origins, vectors, grid_origin, grid_dims, vox_len, chunk_size=17)
+    self.assertEqual(len(offsets), 61)
+    self.assertEqual(voxels.dtype, np.int32)
+    self.assertTrue((exits > entries).all())
+
+    for n in range(60):
+      visits = slice(offsets[n], offsets[n + 1])
+      # the visits are contiguous along the ray
+      np.testing.assert_allclose(entries[visits][1:], exits[visits][:-1])
+      # the midpoint of each visit lies in its voxel
+      mids = (entries[visits] + exits[visits]) / 2
+      pts = origins[n] + mids[:, np.newaxis] * vectors[n]
+      np.testing.assert_array_equal(
+          np.floor((pts - grid_origin) / vox_len).astype(int), voxels[visits])
+      # and every sampled point of the ray in the grid lies in a visited voxel
+      ts = np.linspace(0, 3, 3000)
+      pts = origins[n] + ts[:, np.newaxis] * vectors[n]
+      cells = np.floor((pts - grid_origin) / vox_len).astype(int)
+      cells = cells[((cells >= 0) & (cells < grid_dims)).all(axis=1)]
+      self.assertTrue(set(map(tuple, cells)) <= set(map(tuple, voxels[visits])))
+    self.assertGreater(offsets[2] - offsets[1], 0)
+
+    offsets, _, _, exits = geometry_utils.traverse_voxels(
+        origins, vectors, grid_origin, grid_dims, vox_len, max_distance=0.5)
+    self.assertTrue((exits <= 0.5).all())
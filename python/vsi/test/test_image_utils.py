@@ -0,0 +1,211 @@
+import unittest
+from unittest import mock
+
+try:
+  import numpy as np
+  import scipy.ndimage
+  from vsi.utils import image_utils
+except ImportError:
+  np = None
+
+
+@unittest.skipIf(np is None, "numpy/scipy/skimage not installed")
+class ImageUtilsTest(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.default_rng(0)
+    self.img = rng.random((20, 24)).astype(np.float32)
+    self.img[5, 7] = np.nan
+
+  def test_local_sum(self):
+    radius = 2
+    result = image_utils.local_sum(self.img, radius)
+    self.assertEqual(result.shape, self.img.shape)
+    self.assertTrue(np.isnan(result[:radius]).all())
+    self.assertTrue(np.isnan(result[:, -radius:]).all())
+    for y, x in ((2, 2), (5, 7), (17, 21)):
+      window = self.img[y-radius:y+radius+1, x-radius:x+radius+1]
+      self.assertAlmostEqual(result[y, x], np.nansum(window), places=4)
+
+  def test_local_entropy(self):
+    radius = 3
+    num_bins = 4
+    result = image_utils.local_entropy(self.img, radius, num_bins)
+    bins = image_utils.quantize_image(self.img, num_bins,
+                                      np.nanmin(self.img), np.nanmax(self.img))
+    for y, x in ((3, 3), (5, 7), (16, 20)):
+      window = bins[y-radius:y+radius+1, x-radius:x+radius+1]
+      counts = np.bincount(window[window >= 0], minlength=num_bins)
+      probs = counts[counts > 0] / counts.sum()
+      expected = counts.sum() * -(probs * np.log2(probs)).sum()
+      self.assertAlmostEqual(result[y, x], expected, places=3)
+    self.assertTrue(np.isnan(result[0:radius]).all())
+
+  def test_compute_scale_image(self):
+    scale = image_utils.compute_scale_image(np.nan_to_num(self.img),
+                                            entropy_thresh=30)
+    self.assertEqual(scale.dtype, np.uint8)
+    # with 8 bins, the level 0 window (3x3) holds at most 9*3 = 27 bits, so
+    # the first level that can pass the threshold is level 1 (5x5)
+    self.assertEqual(scale[10, 10], 1)
+
+  def test_compute_scale_image_ssd(self):
+    rng = np.random.default_rng(3)
+    img = scipy.ndimage.gaussian_filter(rng.random((48, 64)), 2.0)
+    scale = image_utils.compute_scale_image_ssd(img, thresh=0.002)
+    self.assertEqual(scale.shape, img.shape)
+    self.assertEqual(scale.dtype, np.uint8)
+    # a smooth image is predicted well from the first pyramid level
+    self.assertGreater(np.count_nonzero(scale), 0)
+
+  def test_mutual_information(self):
+    rng = np.random.default_rng(2)
+    img1 = rng.random((30, 40))
+    img2 = np.sqrt(img1) + 0.05 * rng.random((30, 40))
+    nbins = 6
+    mi = image_utils.mutual_information(img1, img2, 0.0, 1.0, nbins)
+
+    b1 = np.clip((img1 * nbins).astype(int), 0, nbins - 1)
+    b2 = np.clip((img2 * nbins).astype(int), 0, nbins - 1)
+    p01 = np.zeros((nbins, nbins))
+    np.add.at(p01, (b1.ravel(), b2.ravel()), 1)
+    p01 /= p01.sum()
+    ind = np.outer(p01.sum(axis=1), p01.sum(axis=0))
+    nz = p01 > 0
+    expected = (p01[nz] * np.log(p01[nz] / ind[nz])).sum() / np.log(nbins)
+    self.assertAlmostEqual(mi, expected)
+    # identical images have more information in common than noisy ones
+    self.assertGreater(
+        image_utils.mutual_information(img1, img1, 0.0, 1.0, nbins), mi)
+
+  def test_sliding_mutual_information(self):
+    rng = np.random.default_rng(3)
+    img1 = rng.random((25, 30))
+    img2 = img1 ** 2 + 0.1 * rng.random((25, 30))
+    img2[4, 6] = np.nan
+    radius = 3
+    nbins = 5
+    result = image_utils.sliding_mutual_information(img1, img2, radius, nbins,
+                                                    0.0, 1.1)
+    self.assertEqual(result.shape, img1.shape)
+    self.assertTrue(np.isnan(result[:, :radius]).all())
+    for y, x in ((3, 3), (5, 7), (12, 20), (21, 26)):
+      window = np.s_[y-radius:y+radius+1, x-radius:x+radius+1]
+      expected = image_utils.mutual_information(img1[window], img2[window],
+                                                0.0, 1.1, nbins)
+      self.assertAlmostEqual(result[y, x], expected, places=5)
+
+  def test_normalized_cross_correlation_batch(self):
+    rng = np.random.default_rng(4)
+    patches1 = rng.random((7, 5, 6, 3))
+    patches2 = patches1 + 0.3 * rng.random((7, 5, 6, 3))
+    patches2[2] = 0.5  # constant patch
+
+    expected = [image_utils.normalized_cross_correlation(p1, p2)
+                for p1, p2 in zip(patches1, patches2)]
+    scores = image_utils.normalized_cross_correlation_batch(
+        patches1, patches2, chunk_size=3)
+    np.testing.assert_allclose(scores, expected)
+    self.assertEqual(scores[2], 0)
+
+    scores = image_utils.normalized_cross_correlation_batch(
+        patches1, patches2, dtype=np.float32)
+    self.assertEqual(scores.dtype, np.float32)
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+    all_pairs = image_utils.normalized_cross_correlation_all_pairs(
+        patches1, patches2[:4], chunk_size=2)
+    self.assertEqual(all_pairs.shape, (7, 4))
+    for i, j in ((0, 0), (3, 1), (6, 3)):
+      self.assertAlmostEqual(
+          all_pairs[i, j],
+          image_utils.normalized_cross_correlation(patches1[i], patches2[j]))
+
+  def test_weighted_smooth_krylov(self):
+    rng = np.random.default_rng(5)
+    yy, xx = np.mgrid[:60, :80]
+    image = (np.sin(xx / 9.0) + 0.2 * rng.standard_normal((60, 80))
+             ).astype(np.float32)
+    weights = np.where(rng.random((60, 80)) < 0.1, 0.9, 0.01
+                       ).astype(np.float32)
+
+    with mock.patch('builtins.print'):
+      expected, expected_info = image_utils.weighted_smooth(
+          image, weights, pyramid_min_dim=20, convergence_thresh=1e-6,
+          max_its=20000, return_info=True)
+    result, info = image_utils.weighted_smooth(
+        image, weights, pyramid_min_dim=20, convergence_thresh=1e-6,
+        method='krylov', return_info=True)
+
+    self.assertEqual(result.dtype, np.float32)
+    self.assertEqual(len(info['iterations']), len(expected_info['iterations']))
+    self.assertLessEqual(info['residual'], 1e-6)
+    self.assertLess(2 * sum(info['iterations']),
+                    sum(expected_info['iterations']))
+    np.testing.assert_allclose(result, expected, atol=1e-3)
+
+  def test_sample_patch_projective_multi(self):
+    rng = np.random.default_rng(6)
+    image = rng.random((40, 50)) * 100.0
+    xforms = []
+    for k in range(4):
+      H = np.eye(3)
+      H[0, 0] = H[1, 1] = 0.8 + 0.1 * k
+      H[0:2, 2] = (3.0 + k, 5.0 - k)
+      H[2, 0:2] = (1e-4 * k, -2e-4)
+      xforms.append(H)
+    patch_shape = (20, 25)
+
+    patches = image_utils.sample_patch_projective_multi(image, xforms,
+                                                        patch_shape,
+                                                        max_chunk_pixels=1000)
+    self.assertEqual(patches.shape, (4, 20, 25))
+    self.assertEqual(patches.dtype, np.float32)
+    for H, patch in zip(xforms, patches):
+      expected = image_utils.sample_patch_projective(image, H, patch_shape)
+      np.testing.assert_allclose(patch, expected, rtol=1e-5, atol=1e-3)
+
+    # samples outside of the image, and multiple channels
+    xforms[0][0:2, 2] = (-10, 0)
+    rgb = np.stack((image, 2 * image, 3 * image), axis=-1)
+    patches = image_utils.sample_patch_projective_multi(rgb, xforms,
+                                                        patch_shape, order=0,
+                                                        dtype=np.float64)
+    self.assertEqual(patches.shape, (4, 20, 25, 3))
+    self.assertTrue(np.isnan(patches[0, :, 0]).all())
+    np.testing.assert_allclose(patches[1, ..., 2], 3 * patches[1, ..., 0])
+
+    # integer images are interpolated, not rounded to integers
+    shift = np.array(((1, 0, 0.5), (0, 1, 0), (0, 0, 1)), np.float64)
+    image_uint8 = np.arange(20, dtype=np.uint8).reshape(4, 5)
+    patch = image_utils.sample_patch_projective_multi(image_uint8, [shift],
+                                                      (4, 4))[0]
+    np.testing.assert_allclose(patch, image_uint8[:, :4] + 0.5)
+
+  def test_sample_points(self):
+    image = np.arange(30, dtype=np.float64).reshape(5, 6)
+    pts = np.array(((0, 0), (2.5, 1), (1.25, 3.5), (5, 4), (5.2, 0), (-1, 2)))
+    values = image_utils.sample_points(image, pts)
+    np.testing.assert_allclose(values[:4], (0, 8.5, 22.25, 29))
+    self.assertTrue(np.isnan(values[4:]).all())
+
+    nearest_pts = ((0.4, -0.4), (2.6, 1.2), (5.4, 4.4), (5.6, 0), (-0.6, 2))
+    values = image_utils.sample_points(image, nearest_pts, order=0, cval=-1)
+    np.testing.assert_array_equal(values, (0, 9, 29, -1, -1))
+
+    # away from the border, bicubic interpolation of a linear image is
+    # (nearly) exact
+    yy, xx = np.mgrid[:40, :40]
+    values = image_utils.sample_points(xx + 2.0 * yy, ((20.5, 18), (17.25, 21.5)),
+                                       order=3)
+    np.testing.assert_allclose(values, (56.5, 60.25), atol=1e-3)
+
+    rgb = np.stack((image, -image), axis=-1)
+    values = image_utils.sample_points(rgb, pts, dtype=np.float32)
+    self.assertEqual(values.shape, (6, 2))
+    self.assertEqual(values.dtype, np.float32)
+    np.testing.assert_allclose(values[:4, 1], (0, -8.5, -22.25, -29))
+
+    # integer images are interpolated, not rounded to integers
+    image_uint8 = np.array(((0, 10), (20, 30)), np.uint8)
+    values = image_utils.sample_points(image_uint8, ((0.25, 0.35), (1, 0.5)))
+    np.testing.assert_allclose(values, (9.5, 20))
@@ -0,0 +1,213 @@
+import contextlib
+import io
+import os
+import unittest
+import warnings
+
+try:
+  import numpy as np
+  from vsi.utils import mesh_utils, generate_scene_xml_from_ply
+except ImportError:
+  np = None
+
+from vsi.test.utils import TestCase
+
+
+def read_binary_body(filename):
+  with open(filename, 'rb') as fid:
+    header, body = fid.read().split(b'end_header\n', 1)
+  return header.decode('ascii').splitlines(), body
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class MeshUtilsTest(TestCase):
+  def setUp(self):
+    super().setUp()
+    self.rng = np.random.default_rng(0)
+    self.pts = self.rng.uniform(-10, 10, (50, 3))
+    self.normals = self.rng.normal(size=(50, 3))
+    self.colors = self.rng.integers(0, 256, (50, 3))
+
+  def test_save_point_cloud_ply_binary(self):
+    filename = os.path.join(self.temp_dir.name, 'cloud.ply')
+    mesh_utils.save_point_cloud_ply(filename, self.pts, self.normals, self.colors)
+    header, body = read_binary_body(filename)
+    self.assertEqual(header[1], 'format binary_little_endian 1.0')
+    self.assertIn('element vertex 50', header)
+    self.assertIn('property uint8 blue', header)
+
+    vertices = np.frombuffer(body, mesh_utils._vertex_dtype(True, True))
+    self.assertEqual(len(vertices), 50)
+    np.testing.assert_allclose(vertices['y'], self.pts[:, 1], rtol=1e-6)
+    np.testing.assert_allclose(vertices['nz'], self.normals[:, 2], rtol=1e-6)
+    np.testing.assert_array_equal(vertices['green'], self.colors[:, 1])
+
+  def test_save_point_cloud_ply_ascii(self):
+    filename = os.path.join(self.temp_dir.name, 'cloud.ply')
+    mesh_utils.save_point_cloud_ply(filename, self.pts, colors=self.colors,
+                                    binary=False)
+    with open(filename) as fid:
+      lines = fid.read().splitlines()
+    self.assertEqual(lines[1], 'format ascii 1.0')
+    body = lines[lines.index('end_header') + 1:]
+    self.assertEqual(len(body), 50)
+    np.testing.assert_allclose(np.array(body[3].split(), float)[0:3],
+                               self.pts[3], atol=1e-3)
+
+  def test_save_mesh_ply_binary(self):
+    filename = os.path.join(self.temp_dir.name, 'mesh.ply')
+    faces = [(0, 1, 2), (2, 3, 4, 5), (6, 7, 8)]
+    mesh_utils.save_mesh_ply(filename, self.pts, faces, self.colors)
+    header, body = read_binary_body(filename)
+    self.assertIn('element face 3', header)
+    self.assertIn('property list uchar int vertex_index', header)
+
+    vertex_dtype = mesh_utils._vertex_dtype(colors=True)
+    vertices = np.frombuffer(body, vertex_dtype, count=50)
+    np.testing.assert_allclose(vertices['x'], self.pts[:, 0], rtol=1e-6)
+    face_body = body[50 * vertex_dtype.itemsize:]
+    self.assertEqual(len(face_body), 3 * 1 + 10 * 4)
+    # the second face starts after 1 + 3 * 4 bytes
+    self.assertEqual(face_body[13], 4)
+    np.testing.assert_array_equal(np.frombuffer(face_body[14:30], '<i4'),
+                                  (2, 3, 4, 5))
+
+    # a regular face array gives the same bytes as a list
+    mesh_utils.save_mesh_ply(filename, self.pts, np.array(faces[0:1] + faces[2:]))
+    _, body = read_binary_body(filename)
+    np.testing.assert_array_equal(
+        np.frombuffer(body[50 * 12:], np.dtype([('n', 'u1'), ('v', '<i4', 3)]))['v'],
+        (faces[0], faces[2]))
+
+  def test_read_ply_binary(self):
+    filename = os.path.join(self.temp_dir.name, 'cloud.ply')
+    mesh_utils.save_point_cloud_ply(filename, self.pts, self.normals, self.colors)
+    elements = mesh_utils.read_ply(filename)
+    vertices = elements['vertex']
+    self.assertIsInstance(vertices, np.memmap)
+    self.assertEqual(len(elements['face']), 0)
+    np.testing.assert_allclose(vertices['z'], self.pts[:, 2], rtol=1e-6)
+    np.testing.assert_array_equal(vertices['red'], self.colors[:, 0])
+
+    xyz = mesh_utils.read_ply(filename, {'vertex': ('x', 'y', 'z')})['vertex']
+    self.assertEqual(xyz.dtype.names, ('x', 'y', 'z'))
+    np.testing.assert_array_equal(mesh_utils.get_ply_vertices(filename),
+                                  self.pts.T.astype(np.float32))
+
+  def test_read_ply_mesh(self):
+    triangles = self.rng.integers(0, 50, (20, 3))
+    ragged = [(0, 1, 2), (2, 3, 4, 5), (6, 7, 8)]
+    for binary in (True, False):
+      for faces in (triangles, ragged):
+        filename = os.path.join(self.temp_dir.name, 'mesh.ply')
+        mesh_utils.save_mesh_ply(filename, self.pts, faces, self.colors,
+                                 binary=binary)
+        elements = mesh_utils.read_ply(filename)
+        np.testing.assert_allclose(elements['vertex']['x'], self.pts[:, 0],
+                                   atol=1e-3)
+        np.testing.assert_array_equal(elements['vertex']['blue'],
+                                      self.colors[:, 2])
+        read_faces = elements['face']['vertex_index']
+        self.assertEqual(len(read_faces), len(faces))
+        for read_face, face in zip(read_faces, faces):
+          np.testing.assert_array_equal(read_face, face)
+
+  def test_get_mesh_vertices_obj(self):
+    filename = os.path.join(self.temp_dir.name, 'mesh.obj')
+    with open(filename, 'w') as fid:
+      fid.write('# comment\nv 1 2 3\nvn 0 0 1\nv 4 5 6 1\nf 1 2 1\n')
+    np.testing.assert_array_equal(mesh_utils.get_mesh_vertices(filename),
+                                  [[1, 4], [2, 5], [3, 6]])
+
+  def test_ply_stream_writer(self):
+    filename = os.path.join(self.temp_dir.name, 'stream.ply')
+    with mesh_utils.PlyStreamWriter(filename, normals=True, colors=True) as writer:
+      for start in range(0, 50, 20):
+        stop = start + 20
+        writer.write(self.pts[start:stop], self.normals[start:stop],
+                     self.colors[start:stop])
+      writer.write(np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3)))
+      with self.assertRaises(ValueError):
+        writer.write(self.pts, self.normals)
+      with self.assertRaises(AssertionError):
+        writer.write(self.pts, self.normals[:10], self.colors)
+    self.assertEqual(writer.num_points, 50)
+    pts32 = self.pts.astype(np.float32)
+    np.testing.assert_array_equal(writer.bbox_min, pts32.min(axis=0))
+    np.testing.assert_array_equal(writer.bbox_max, pts32.max(axis=0))
+
+    # the same vertices as writing everything at once
+    header, body = read_binary_body(filename)
+    self.assertIn('element vertex %020d' % 50, header)
+    single = os.path.join(self.temp_dir.name, 'single.ply')
+    mesh_utils.save_point_cloud_ply(single, self.pts, self.normals, self.colors)
+    self.assertEqual(body, read_binary_body(single)[1])
+    np.testing.assert_array_equal(mesh_utils.get_ply_vertices(filename), pts32.T)
+
+    # the running bounds give the same scene as reading the points back
+    xml_from_ply = os.path.join(self.temp_dir.name, 'scene_ply.xml')
+    xml_from_bbox = os.path.join(self.temp_dir.name, 'scene_bbox.xml')
+    args = ('.', (1, 1, 1), (10, 10, 10), ('boxm2_mog3_grey',), 1, 3, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+      generate_scene_xml_from_ply.generate_scene_xml_from_ply(
+          filename, xml_from_ply, *args)
+      generate_scene_xml_from_ply.generate_scene_xml_from_bbox(
+          writer.bbox_min, writer.bbox_max, xml_from_bbox, *args)
+    with open(xml_from_ply) as fid1, open(xml_from_bbox) as fid2:
+      self.assertEqual(fid1.read(), fid2.read())
+
+  def test_save_mesh_ply_no_faces(self):
+    filename = os.path.join(self.temp_dir.name, 'mesh.ply')
+    for faces in ([], np.zeros((0, 3), int)):
+      mesh_utils.save_mesh_ply(filename, self.pts, faces)
+      header, body = read_binary_body(filename)
+      self.assertIn('element face 0', header)
+      self.assertEqual(len(body), 50 * 12)
+
+  def test_read_ply_empty_ascii(self):
+    filename = os.path.join(self.temp_dir.name, 'cloud.ply')
+    mesh_utils.save_point_cloud_ply(filename, self.pts, binary=False)
+    with warnings.catch_warnings():
+      warnings.simplefilter('error')
+      elements = mesh_utils.read_ply(filename)
+    self.assertEqual(len(elements['vertex']), 50)
+    self.assertEqual(len(elements['face']), 0)
+
+  def test_read_ply_ragged_scan(self):
+    # many chunks, most starting in the middle of a record
+    faces = [tuple(self.rng.integers(0, 3, 3 + (i % 3 == 0))) for i in range(2000)]
+    filename = os.path.join(self.temp_dir.name, 'mesh.ply')
+    mesh_utils.save_mesh_ply(filename, self.pts, faces)
+    _, elements, offset = mesh_utils.read_ply_header(filename)
+    with open(filename, 'rb') as fid:
+      fid.seek(offset + 50 * 12)
+      buf = np.frombuffer(fid.read() + bytes(8), np.uint8)
+    for chunk_size in (1, 7, 100):
+      starts = mesh_utils._record_starts(buf, len(buf) - 8, 2000,
+                                         elements[1][2], '<', chunk_size)
+      np.testing.assert_array_equal(
+          np.diff(starts), [1 + 4 * len(face) for face in faces[:-1]])
+
+  def test_read_ply_elements(self):
+    ragged = [(0, 1, 2), (2, 3, 4, 5), (6, 7, 8)]
+    filename = os.path.join(self.temp_dir.name, 'mesh.ply')
+    for binary in (True, False):
+      mesh_utils.save_mesh_ply(filename, self.pts, ragged, binary=binary)
+      faces = mesh_utils.read_ply(filename, elements=('face',))
+      self.assertEqual(list(faces), ['face'])
+      np.testing.assert_array_equal(faces['face']['vertex_index'][1], ragged[1])
+      with self.assertRaises(ValueError):
+        mesh_utils.read_ply(filename, elements=('edge',))
+
+      # the faces are not read at all, so they may even be missing
+      _, elements, offset = mesh_utils.read_ply_header(filename)
+      with open(filename, 'rb') as fid:
+        body = fid.read()
+      vertex_size = 50 * 12 if binary else sum(
+          len(line) + 1 for line in body[offset:].split(b'\n')[0:50])
+      with open(filename, 'wb') as fid:
+        fid.write(body[0:offset + vertex_size])
+      np.testing.assert_allclose(mesh_utils.get_ply_vertices(filename),
+                                 self.pts.T, atol=1e-3)
+      with self.assertRaises(ValueError):
+        mesh_utils.read_ply(filename)
@@ -0,0 +1,133 @@
+import os
+import threading
+import unittest
+
+from vsi.test.utils import TestCase
+
+try:
+  import numpy as np
+  import pyopencl as cl
+  import scipy.ndimage
+  from vsi.utils import image_utils, ocl_utils, image_utils_ocl
+  ocl_platforms = cl.get_platforms()
+except Exception:
+  ocl_platforms = []
+
+
+KERNEL_SOURCE = '''
+__kernel void scale(__global float *x, float factor)
+{
+  int i = get_global_id(0);
+  x[i] *= factor;
+}
+'''
+
+
+@unittest.skipIf(not ocl_platforms, "No OpenCL platform (e.g. pocl) available")
+class OclUtilsTest(TestCase):
+  def setUp(self):
+    super().setUp()
+    self.ctx = ocl_utils.init_ocl()
+    ocl_utils.clear_caches()
+    self.addCleanup(ocl_utils.clear_caches)
+
+  def test_program_cache(self):
+    prg1 = ocl_utils.build_program(self.ctx, KERNEL_SOURCE)
+    prg2 = ocl_utils.build_program(self.ctx, KERNEL_SOURCE)
+    self.assertIs(prg1, prg2)
+    prg3 = ocl_utils.build_program(self.ctx, KERNEL_SOURCE, options=['-DFOO'])
+    self.assertIsNot(prg1, prg3)
+
+    self.assertIs(ocl_utils.get_kernel(prg1, 'scale'),
+                  ocl_utils.get_kernel(prg1, 'scale'))
+    self.assertIs(ocl_utils.get_command_queue(self.ctx),
+                  ocl_utils.get_command_queue(self.ctx))
+
+    # each thread sets arguments on its own kernel
+    kernels = []
+    thread = threading.Thread(
+        target=lambda: kernels.append(ocl_utils.get_kernel(prg1, 'scale')))
+    thread.start()
+    thread.join()
+    self.assertIsNot(kernels[0], ocl_utils.get_kernel(prg1, 'scale'))
+
+  def test_binary_cache(self):
+    cache_dir = os.path.join(self.temp_dir.name, 'cl_cache')
+    ocl_utils.build_program(self.ctx, KERNEL_SOURCE, cache_dir=cache_dir)
+    self.assertEqual(len(os.listdir(cache_dir)), len(self.ctx.devices))
+
+    # a "cold" process loads the binary instead of compiling
+    ocl_utils.clear_caches()
+    prg = ocl_utils.build_program(self.ctx, KERNEL_SOURCE, cache_dir=cache_dir)
+    queue = ocl_utils.get_command_queue(self.ctx)
+    x = np.arange(8, dtype=np.float32)
+    buf = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE | cl.mem_flags.COPY_HOST_PTR,
+                    hostbuf=x)
+    ocl_utils.get_kernel(prg, 'scale')(queue, x.shape, None, buf, np.float32(2))
+    result = np.empty_like(x)
+    cl.enqueue_copy(queue, result, buf)
+    np.testing.assert_array_equal(result, 2 * x)
+
+  def test_binary_cache_write_failure(self):
+    prg = ocl_utils.build_program(self.ctx, KERNEL_SOURCE)
+    cache_dir = os.path.join(self.temp_dir.name, 'cl_cache')
+    # the cached binary cannot replace a directory
+    filename = os.path.join(cache_dir, 'binary.bin')
+    os.makedirs(filename)
+    ocl_utils._save_program_binaries(prg, {self.ctx.devices[0]: filename})
+    self.assertEqual(os.listdir(cache_dir), ['binary.bin'])
+
+  def test_repeated_calls(self):
+    rng = np.random.default_rng(0)
+    img1 = rng.random((16, 20)).astype(np.float32)
+    img2 = rng.random((16, 20)).astype(np.float32)
+    ncc1 = image_utils_ocl.sliding_NCC(self.ctx, img1, img2, 2)
+    ncc2 = image_utils_ocl.sliding_NCC(self.ctx, img1, img2, 2)
+    np.testing.assert_array_equal(ncc1, ncc2)
+    self.assertEqual(len(ocl_utils._program_cache), 1)
+
+  def test_batch(self):
+    rng = np.random.default_rng(1)
+    pairs = [(rng.random((12, 15)), rng.random((12, 15))) for _ in range(5)]
+    # a change of image size part way through reallocates the buffers
+    pairs.append((rng.random((10, 9)), rng.random((10, 9))))
+
+    results = list(image_utils_ocl.sliding_NCC_batch(self.ctx, iter(pairs), 2))
+    self.assertEqual(len(results), len(pairs))
+    for (img1, img2), result in zip(pairs, results):
+      np.testing.assert_array_equal(
+          result, image_utils_ocl.sliding_NCC(self.ctx, img1, img2, 2))
+
+    results = image_utils_ocl.sliding_SSD_batch(self.ctx, pairs, 1,
+                                                num_buffers=3)
+    for (img1, img2), result in zip(pairs, results):
+      np.testing.assert_array_equal(
+          result, image_utils_ocl.sliding_SSD(self.ctx, img1, img2, 1))
+
+    jobs = [(img1, img2, row) for img1, img2 in pairs[:2] for row in (3, 6)]
+    results = image_utils_ocl.score_rectified_row_batch(self.ctx, jobs, 2)
+    for (img1, img2, row), result in zip(jobs, results):
+      np.testing.assert_array_equal(
+          result,
+          image_utils_ocl.score_rectified_row(self.ctx, img1, img2, 2, row))
+
+  def test_batch_num_buffers(self):
+    pairs = [(np.zeros((4, 5)), np.zeros((4, 5)))]
+    with self.assertRaises(ValueError):
+      image_utils_ocl.sliding_NCC_batch(self.ctx, pairs, 1, num_buffers=0)
+    with self.assertRaises(ValueError):
+      image_utils_ocl.sliding_SSD_batch(self.ctx, pairs, 1, num_buffers=0)
+    with self.assertRaises(ValueError):
+      image_utils_ocl.score_rectified_row_batch(self.ctx, [pairs[0] + (2,)], 1,
+                                                num_buffers=0)
+    results = list(image_utils_ocl.sliding_NCC_batch(self.ctx, pairs, 1,
+                                                     num_buffers=1))
+    self.assertEqual(len(results), 1)
+
+  def test_compute_scale_image_ssd(self):
+    rng = np.random.default_rng(3)
+    img = scipy.ndimage.gaussian_filter(rng.random((48, 64)), 2.0)
+    img = img.astype(np.float32)
+    np.testing.assert_array_equal(
+        image_utils_ocl.compute_scale_image_ssd(self.ctx, img, thresh=0.002),
+        image_utils.compute_scale_image_ssd(img, thresh=0.002))
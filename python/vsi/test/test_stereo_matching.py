@@ -0,0 +1,93 @@
+import unittest
+
+try:
+  import numpy as np
+  import scipy.ndimage
+  from vsi.utils import stereo_matching
+except ImportError:
+  np = None
+
+
+@unittest.skipIf(np is None, "numpy/scipy not installed")
+class StereoMatchingTest(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.default_rng(0)
+    self.img0 = scipy.ndimage.gaussian_filter(rng.uniform(0, 255, (60, 80)), 1.0)
+    # two fronto-parallel layers: img1[y, x + d] = img0[y, x]
+    self.true_disparity = np.where(np.arange(60)[:, np.newaxis] < 30, 4.0, 7.5)
+    cols = np.arange(80)[np.newaxis, :] - self.true_disparity
+    rows = np.broadcast_to(np.arange(60)[:, np.newaxis], cols.shape)
+    self.img1 = scipy.ndimage.map_coordinates(self.img0, (rows, cols), order=3,
+                                              mode='nearest')
+
+  def test_cost_volume(self):
+    costs = stereo_matching.compute_cost_volume(self.img0, self.img1, 0, 10,
+                                                window_radius=1, method='SSD')
+    self.assertEqual(costs.shape, (60, 80, 11))
+    self.assertTrue(np.isnan(costs[0]).all())
+    # the window of x + 10 leaves img1
+    self.assertTrue(np.isnan(costs[5, 69:, 10]).all())
+    np.testing.assert_allclose(costs[5, 10:60, 4], 0, atol=1e-6)
+
+    # compare the integral image SSD to a direct sum
+    y, x, d = 20, 30, 6
+    diff = self.img0[y-1:y+2, x-1:x+2] - self.img1[y-1:y+2, x+d-1:x+d+2]
+    self.assertAlmostEqual(costs[y, x, d], np.mean(diff**2), places=2)
+
+    for method in ('NCC', 'census'):
+      costs = stereo_matching.compute_cost_volume(self.img0, self.img1, 0, 10,
+                                                  method=method)
+      self.assertTrue((costs[~np.isnan(costs)] >= 0).all())
+      self.assertTrue((costs[~np.isnan(costs)] <= 1).all())
+      best = np.nanargmin(costs[10, 10:60], axis=1)
+      self.assertGreater(np.mean(best == 4), 0.9)
+
+  def test_compute_disparity(self):
+    for method in ('NCC', 'SSD', 'census'):
+      disparity = stereo_matching.compute_disparity(
+          self.img0, self.img1, 0, 12, method=method, tile_rows=16,
+          num_threads=2)
+      valid = np.isfinite(disparity)
+      self.assertGreater(valid.mean(), 0.7)
+      errors = np.abs(disparity - self.true_disparity)[valid]
+      self.assertGreater((errors < 1).mean(), 0.95, method)
+
+  def test_left_right_check(self):
+    disparity0 = np.array(((1.0, 2.0, np.nan),))
+    disparity1 = np.array(((np.nan, 1.0, 0.0),))
+    checked = stereo_matching.left_right_check(disparity0, disparity1)
+    np.testing.assert_array_equal(checked, ((1.0, np.nan, np.nan),))
+
+  def test_rectify_images(self):
+    H = np.array(((1, 0, 2), (0, 1, 0), (0, 0, 1)), np.float64)
+    rect0, rect1 = stereo_matching.rectify_images(self.img0, self.img0, np.eye(3),
+                                                  H, (60, 80), (60, 82))
+    np.testing.assert_allclose(rect0, self.img0, rtol=1e-5)
+    np.testing.assert_allclose(rect1[:, 2:], self.img0, rtol=1e-5)
+    self.assertTrue(np.isnan(rect1[:, 0:2]).all())
+
+  def test_rectifier(self):
+    H0 = np.array(((1.02, 0.05, -3), (-0.03, 0.98, 2), (1e-4, -2e-4, 1)))
+    H1 = np.array(((0.97, -0.02, 4), (0.04, 1.01, -1), (-1e-4, 1e-4, 1)))
+    rectifier = stereo_matching.Rectifier(H0, H1, (58, 84), (62, 80),
+                                          self.img0.shape, self.img1.shape,
+                                          chunk_rows=7, num_threads=2)
+    rgb = np.stack((self.img1, self.img1 / 2, self.img1 / 4), axis=2)
+    for order in (1, 3):
+      rectifier.order = order
+      rect0, rect1 = rectifier.rectify(self.img0, rgb)
+      expected0, expected1 = stereo_matching.rectify_images(
+          self.img0, rgb, H0, H1, (58, 84), (62, 80), order=order)
+      self.assertEqual(rect1.shape, (62, 80, 3))
+      np.testing.assert_allclose(rect0, expected0, rtol=1e-4, atol=1e-3)
+      np.testing.assert_allclose(rect1, expected1, rtol=1e-4, atol=1e-3)
+    np.testing.assert_array_equal(rectifier.valid_masks[0], np.isfinite(rect0))
+
+    # integer frames are interpolated, not rounded to integers
+    rectifier.order = 1
+    frame = np.round(self.img0).astype(np.uint8)
+    rect_uint8 = rectifier.rectify_image(0, frame)
+    rect_float = rectifier.rectify_image(0, frame.astype(np.float64))
+    np.testing.assert_allclose(rect_uint8, rect_float, rtol=1e-6)
+    self.assertTrue((rect_uint8[np.isfinite(rect_uint8)] % 1 != 0).any())
+    rectifier.close()
@@ -0,0 +1,61 @@
+import unittest
+
+try:
+  import numpy as np
+  from vsi.utils import camera_utils, geometry_utils, stereo_utils
+except ImportError:
+  np = None
+
+
+def disparity_to_depth_reference(disparity_image, cam0, cam1):
+  """ per-pixel triangulation, as disparity_to_depth was originally written """
+  ximg = np.full(disparity_image.shape, np.nan)
+  yimg = np.full(disparity_image.shape, np.nan)
+  zimg = np.full(disparity_image.shape, np.nan)
+  for (y, x), disp in np.ndenumerate(disparity_image):
+    if not np.isnan(disp):
+      p = camera_utils.triangulate_point((cam0, cam1),
+                                         ((x, y), (x + disp, y)))
+      ximg[y, x], yimg[y, x], zimg[y, x] = p[0:3] / p[3]
+  return ximg, yimg, zimg
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class StereoUtilsTest(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.default_rng(0)
+    self.K = camera_utils.construct_K((40, 30), focal_len=35.0)
+    self.cam0 = camera_utils.ProjectiveCamera(
+        np.dot(self.K, np.hstack((np.eye(3), np.zeros((3, 1))))))
+
+  def test_disparity_to_depth_rectified(self):
+    baseline = 0.5
+    cam1 = camera_utils.ProjectiveCamera(
+        np.dot(self.K, np.hstack((np.eye(3), np.array(((-baseline,), (0,), (0,)))))))
+    depth = self.rng.uniform(5, 10, (30, 40))
+    disparity = -35.0 * baseline / depth
+    disparity[3, 4] = np.nan
+
+    ximg, yimg, zimg = stereo_utils.disparity_to_depth(disparity, self.cam0,
+                                                       cam1, chunk_rows=7)
+    self.assertEqual(zimg.dtype, np.float32)
+    np.testing.assert_allclose(zimg, np.where(np.isnan(disparity), np.nan, depth),
+                               rtol=1e-5)
+    expected = disparity_to_depth_reference(disparity, self.cam0, cam1)
+    for result, ref in zip((ximg, yimg, zimg), expected):
+      np.testing.assert_allclose(result, ref, rtol=1e-5, atol=1e-5)
+
+  def test_disparity_to_depth_general(self):
+    R = geometry_utils.Euler_angles_to_matrix(0.0, 0.02, 0.01)
+    cam1 = camera_utils.ProjectiveCamera(
+        np.dot(self.K, np.hstack((R, np.array(((-0.5,), (0.01,), (0,)))))))
+    disparity = self.rng.uniform(-4, -2, (12, 15))
+    disparity[0, 0] = np.nan
+
+    output = np.zeros((12, 15, 3))
+    result = stereo_utils.disparity_to_depth(disparity, self.cam0, cam1,
+                                             output=output, chunk_rows=5)
+    self.assertIs(result, output)
+    expected = disparity_to_depth_reference(disparity, self.cam0, cam1)
+    for i in range(3):
+      np.testing.assert_allclose(output[..., i], expected[i], rtol=1e-8)
@@ -1,4 +1,6 @@
 """ Utility classes for modeling cameras """
+import functools
+
 import numpy as np
 import vsi.utils.geometry_utils as geometry_utils
 
@@ -95,6 +97,62 @@ class ProjectiveCamera(object):
     pts_2d = [col[0:2] / col[2] for col in pts_2d_m_h.transpose()]
     return pts_2d
 
+  def project_points_array(self, pts_3d, dtype=None, image_shape=None,
+                           chunk_size=1048576):
+    """ project pts_3d into image coordinates, returning an array
+
+        Unlike :meth:`project_points`, no homogeneous copy of the points is
+        made: each chunk of points is projected with a single matrix multiply
+        against P[:, :3], plus P[:, 3].
+
+        Parameters
+        ----------
+        pts_3d : array_like
+            The 3D Points. Shape = N x 3.
+        dtype : numpy.dtype, optional
+            The dtype used for computation and output. Default: float32 if
+            pts_3d is float32, otherwise float64
+        image_shape : array_like, optional
+            The image (rows, cols). If given, a visibility mask is also
+            returned
+        chunk_size : int, optional
+            The number of points projected at once, which bounds the size of
+            the temporary arrays
+
+        Returns
+        -------
+        numpy.array
+            The 2D points. Shape = N x 2.
+        numpy.array
+            True for points in front of the camera and inside the image
+            bounds. Only returned if image_shape is given.
+    """
+    pts_3d = np.asarray(pts_3d).reshape(-1, 3)
+    if dtype is None:
+      dtype = np.result_type(pts_3d.dtype, np.float32)
+    M = self.P[:, 0:3].astype(dtype)
+    t = self.P[:, 3].astype(dtype)
+    num_pts = len(pts_3d)
+    pts_2d = np.empty((num_pts, 2), dtype)
+    if image_shape is not None:
+      visible = np.empty(num_pts, bool)
+      # points in front of the camera have w with the same sign as det(M)
+      w_sign = np.sign(np.linalg.det(self.P[:, 0:3]))
+    for start in range(0, num_pts, chunk_size):
+      chunk = slice(start, start + chunk_size)
+      pts_2d_h = np.dot(pts_3d[chunk].astype(dtype, copy=False), M.T)
+      pts_2d_h += t
+      np.divide(pts_2d_h[:, 0:2], pts_2d_h[:, 2:3], out=pts_2d[chunk])
+      if image_shape is not None:
+        x = pts_2d[chunk, 0]
+        y = pts_2d[chunk, 1]
+        visible[chunk] = ((pts_2d_h[:, 2] * w_sign > 0) &
+                          (x >= 0) & (x < image_shape[1]) &
+                          (y >= 0) & (y < image_shape[0]))
+    if image_shape is not None:
+      return pts_2d, visible
+    return pts_2d
+
   def project_point(self, pt_3d):
     """ convenience wrapper around project_points
 
@@ -135,6 +193,36 @@ class ProjectiveCamera(object):
     vecs_2d = [col[0:2] / col[2] for col in vecs_2d_m_h.transpose()]
     return vecs_2d
 
+  def project_vectors_array(self, vecs_3d, dtype=None, chunk_size=1048576):
+    """ project vecs_3d into image coordinates, returning an array
+
+        Parameters
+        ----------
+        vecs_3d : array_like
+            The 3D Vectors. Shape = N x 3.
+        dtype : numpy.dtype, optional
+            The dtype used for computation and output. Default: float32 if
+            vecs_3d is float32, otherwise float64
+        chunk_size : int, optional
+            The number of vectors projected at once
+
+        Returns
+        -------
+        numpy.array
+            The 2D vanishing points. Shape = N x 2.
+    """
+    vecs_3d = np.asarray(vecs_3d).reshape(-1, 3)
+    if dtype is None:
+      dtype = np.result_type(vecs_3d.dtype, np.float32)
+    M = self.P[:, 0:3].astype(dtype)
+    num_vecs = len(vecs_3d)
+    vecs_2d = np.empty((num_vecs, 2), dtype)
+    for start in range(0, num_vecs, chunk_size):
+      chunk = slice(start, start + chunk_size)
+      vecs_2d_h = np.dot(vecs_3d[chunk].astype(dtype, copy=False), M.T)
+      np.divide(vecs_2d_h[:, 0:2], vecs_2d_h[:, 2:3], out=vecs_2d[chunk])
+    return vecs_2d
+
   def project_vector(self, vecs_3d):
     """ convenience wrapper around project_vectors
         Parameters
@@ -201,6 +289,78 @@ class ProjectiveCamera(object):
     pts_3d = [self.backproject_point_plane(p, plane, return_homogeneous) for p in pts_2d]
     return pts_3d
 
+  def image2world_plane(self, plane):
+    """ compute the transformation from image coordinates to points on a 3-d
+        plane, in world coordinates
+
+        Parameters
+        ----------
+        plane : array_like
+            The 3-D Plane (a, b, c, d)
+
+        Returns
+        -------
+        numpy.array
+            4x3 matrix mapping homogeneous image points to homogeneous 3-d
+            points on the plane
+
+        Raises
+        ------
+        numpy.linalg.LinAlgError
+            When the camera center lies on the plane
+    """
+    # a point X on the plane projecting to x satisfies [P; plane] X = [x; 0]
+    A = np.vstack((self.P, np.reshape(plane, (1, 4))))
+    return np.linalg.inv(A)[:, 0:3]
+
+  def backproject_points_plane_array(self, pts_2d, plane,
+                                     return_homogeneous=False):
+    """ backproject points onto 3-d plane(s), returning an array
+
+        Vectorized alternative to :meth:`backproject_points_plane`. With a
+        single plane, the image to plane transform is computed once and all
+        points are mapped with one matrix multiply. With one plane per point,
+        the 4x4 systems are solved in a single batched ``np.linalg.solve``.
+
+        Parameters
+        ----------
+        pts_2d : array_like
+            Two Dimensional Points. Shape = N x 2
+        plane : array_like
+            The 3-D Plane (a, b, c, d), or one plane per point. Shape = 4 or
+            N x 4
+        return_homogeneous : bool
+            If True it returns homogenous points
+
+        Returns
+        -------
+        numpy.array
+            The 3D Points. Shape = N x 3 (N x 4 if return_homogeneous). Points
+            whose viewing ray is parallel to the plane are not finite.
+    """
+    pts_2d = np.asarray(pts_2d, np.float64).reshape(-1, 2)
+    plane = np.asarray(plane, np.float64)
+    if plane.size == 4:
+      # a single plane, e.g. a 4x1 column
+      plane = plane.ravel()
+    if plane.ndim == 1:
+      H = self.image2world_plane(plane)
+      pts_3d = np.dot(pts_2d, H[:, 0:2].T)
+      pts_3d += H[:, 2]
+    else:
+      A = np.empty((len(pts_2d), 4, 4))
+      A[:, 0:3, :] = self.P
+      A[:, 3, :] = plane
+      b = np.zeros((len(pts_2d), 4, 1))
+      b[:, 0:2, 0] = pts_2d
+      b[:, 2, 0] = 1
+      pts_3d = np.linalg.solve(A, b)[..., 0]
+
+    if return_homogeneous:
+      return pts_3d
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return pts_3d[:, 0:3] / pts_3d[:, 3:4]
+
   def plane2image(self, plane_origin, plane_x, plane_y):
     """ compute the transformation from points on a 3-d plane to image
         coordinates
@@ -289,6 +449,58 @@ class ProjectiveCamera(object):
     return np.linalg.inv(p2i)
 
 
+def viewing_ray_grid(camera, shape, stride=1):
+  """ compute the unit viewing ray direction of every pixel of an image
+
+      The grids of the two most recently used cameras and image shapes are
+      cached, so repeated calls for e.g. a stereo pair are free. A
+      full-resolution 4K grid is about 100 MB; call
+      ``viewing_ray_grid.cache_clear()`` to release the cached grids. The
+      returned array is read only, since it may be shared.
+
+      Parameters
+      ----------
+      camera : array_like
+          The camera (anything with a 3x4 ``P`` attribute)
+      shape : array_like
+          The image shape (rows, cols)
+      stride : int, optional
+          Compute the ray of every stride-th pixel in each dimension
+
+      Returns
+      -------
+      numpy.array
+          The float32 ray directions, pointing away from the camera.
+          Shape = (ceil(rows/stride), ceil(cols/stride), 3)
+  """
+  P = np.ascontiguousarray(camera.P, np.float64)
+  return _viewing_ray_grid(P.tobytes(), (int(shape[0]), int(shape[1])),
+                           int(stride))
+
+
+@functools.lru_cache(maxsize=2)
+def _viewing_ray_grid(P_bytes, shape, stride):
+  """ cached implementation of :func:`viewing_ray_grid`, keyed on the bytes
+  of the projection matrix """
+  P = np.frombuffer(P_bytes, np.float64).reshape(3, 4)
+  M = P[:, 0:3]
+  # M^-1 x is the ray direction, up to sign; det(M) > 0 for points in front
+  M_inv = np.linalg.inv(M) * np.sign(np.linalg.det(M))
+  xs = np.arange(0, shape[1], stride, dtype=np.float64)
+  ys = np.arange(0, shape[0], stride, dtype=np.float64)
+  rays = np.empty((len(ys), len(xs), 3), np.float32)
+  # M_inv (x, y, 1) = x*M_inv[:,0] + y*M_inv[:,1] + M_inv[:,2]
+  row_rays = np.outer(xs, M_inv[:, 0]) + M_inv[:, 2]
+  for r, y in enumerate(ys):
+    ray = row_rays + y * M_inv[:, 1]
+    ray /= np.linalg.norm(ray, axis=1, keepdims=True)
+    rays[r] = ray
+  rays.setflags(write=False)
+  return rays
+
+viewing_ray_grid.cache_clear = _viewing_ray_grid.cache_clear
+
+
 def triangulate_point(cameras, projections, return_homogeneous=True):
   """ Triangulate a 3-d point given it's projection in two images
 
@@ -329,3 +541,386 @@ def triangulate_point(cameras, projections, return_homogeneous=True):
   return point
 
 
+
+
+def _projection_matrices(cameras):
+  """ stack the projection matrices of a list of cameras (or pass through an
+  (M, 3, 4) array) """
+  if isinstance(cameras, np.ndarray):
+    return cameras.reshape(-1, 3, 4).astype(np.float64)
+  return np.array([camera.P for camera in cameras], np.float64).reshape(-1, 3, 4)
+
+
+def triangulate_points(cameras, projections, method='DLT',
+                       return_homogeneous=False, chunk_size=65536):
+  """ Triangulate many 3-d points, each observed in up to M views
+
+      Parameters
+      ----------
+      cameras : array_like
+          The M cameras (anything with a 3x4 ``P`` attribute), or their
+          projection matrices. Shape = M x 3 x 4
+      projections : array_like
+          The 2-d projection of each point in each view. Views that do not
+          observe a point are NaN. Shape = N x M x 2
+      method : str, optional
+          method should be one of {'DLT', 'midpoint'}
+            - DLT: the linear method of :func:`triangulate_point`, solved for
+              all points at once with a batched SVD
+            - midpoint: the point closest (in the least-squares sense) to all
+              of the viewing rays. Faster, but not projective invariant.
+      return_homogeneous : bool, optional
+          Default: False
+      chunk_size : int, optional
+          The number of points triangulated at once, which bounds the size of
+          the temporary arrays
+
+      Returns
+      -------
+      numpy.array
+          The Points. Shape = N x 3 (N x 4 if return_homogeneous). Points
+          observed in fewer than two views are NaN.
+      numpy.array
+          The root mean square reprojection error of each point, over the
+          views that observe it. Shape = N
+
+      Raises
+      ------
+      Exception
+          When the number of cameras and 2-d projections are not the same.
+  """
+  Ps = _projection_matrices(cameras)
+  projections = np.asarray(projections, np.float64)
+  if projections.ndim == 2:
+    projections = projections[np.newaxis]
+  num_pts, num_views = projections.shape[0:2]
+  if num_views != len(Ps):
+    raise Exception('Expecting same number of cameras and 2-d projections')
+  if method not in ('DLT', 'midpoint'):
+    raise ValueError('Unrecognized method string ' + str(method))
+
+  points = np.full((num_pts, 4), np.nan)
+  errors = np.full(num_pts, np.nan)
+  for start in range(0, num_pts, chunk_size):
+    chunk = slice(start, start + chunk_size)
+    obs = projections[chunk]
+    valid = np.all(np.isfinite(obs), axis=2)
+    good = valid.sum(axis=1) >= 2
+    obs = np.where(valid[..., np.newaxis], obs, 0)
+
+    if method == 'DLT':
+      points[chunk] = _triangulate_dlt(Ps, obs, valid)
+    else:
+      points[chunk] = _triangulate_midpoint(Ps, obs, valid)
+
+    # reprojection error over the observing views
+    proj = np.einsum('mij,nj->nmi', Ps, points[chunk])
+    with np.errstate(divide='ignore', invalid='ignore'):
+      residuals = proj[..., 0:2] / proj[..., 2:3] - obs
+      sq_err = np.where(valid, (residuals**2).sum(axis=2), 0).sum(axis=1)
+      errors[chunk] = np.sqrt(sq_err / valid.sum(axis=1))
+    points[start:start + len(good)][~good] = np.nan
+    errors[start:start + len(good)][~good] = np.nan
+
+  if return_homogeneous:
+    return points, errors
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return points[:, 0:3] / points[:, 3:4], errors
+
+
+def _triangulate_dlt(Ps, obs, valid):
+  """ batched DLT: the right null vector of each 2M x 4 system """
+  # rows P[0] - x*P[2] and P[1] - y*P[2] for every view, zero for missing views
+  A = Ps[np.newaxis, :, 0:2, :] - obs[..., np.newaxis] * Ps[np.newaxis, :, 2:3, :]
+  A *= valid[..., np.newaxis, np.newaxis]
+  A = A.reshape(len(obs), -1, 4)
+  _, _, Vh = np.linalg.svd(A)
+  return Vh[:, -1, :]
+
+
+def _triangulate_midpoint(Ps, obs, valid):
+  """ batched least-squares intersection of the viewing rays """
+  M = Ps[:, :, 0:3]
+  M_inv = np.linalg.inv(M)
+  centers = -np.einsum('mij,mj->mi', M_inv, Ps[:, :, 3])
+  obs_h = np.concatenate((obs, np.ones(obs.shape[:-1] + (1,))), axis=-1)
+  rays = np.einsum('mij,nmj->nmi', M_inv, obs_h)
+  rays /= np.linalg.norm(rays, axis=2, keepdims=True)
+  # sum over views of (I - d d^T) X = (I - d d^T) C
+  proj = np.eye(3) - rays[..., :, np.newaxis] * rays[..., np.newaxis, :]
+  proj *= valid[..., np.newaxis, np.newaxis]
+  A = proj.sum(axis=1)
+  b = np.einsum('nmij,mj->ni', proj, centers)
+  # regularize the systems of points with fewer than 2 views, which are
+  # discarded anyway
+  A[valid.sum(axis=1) < 2] = np.eye(3)
+  points = np.ones((len(obs), 4))
+  points[:, 0:3] = np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+  return points
+
+
+class CameraBundle(object):
+  """ A set of M projective cameras stored as arrays, for batch operations
+
+      Attributes
+      ----------
+      P : numpy.array
+          The projection matrices. Shape = M x 3 x 4
+      centers : numpy.array
+          The camera centers. Shape = M x 3
+      principal_rays : numpy.array
+          Unit vectors along the principal axes, pointing away from the
+          cameras. Shape = M x 3
+      image_shapes : numpy.array
+          The image (rows, cols) of each camera, or None. Shape = M x 2
+  """
+  def __init__(self, Ps, image_shapes=None):
+    """ Parameters
+        ----------
+        Ps : array_like
+            The projection matrices. Shape = M x 3 x 4
+        image_shapes : array_like, optional
+            The image (rows, cols) of each camera, or one shape shared by all
+            the cameras. Required for visibility queries.
+    """
+    self.P = np.array(Ps, np.float64).reshape(-1, 3, 4)
+    M = self.P[:, :, 0:3]
+    self._det_sign = np.sign(np.linalg.det(M))
+    self.centers = -np.linalg.solve(M, self.P[:, :, 3:4])[:, :, 0]
+    # the third row of M, pointed forward, is the principal axis (H-Z p161)
+    self.principal_rays = M[:, 2, :] * self._det_sign[:, np.newaxis]
+    self.principal_rays /= np.linalg.norm(self.principal_rays, axis=1,
+                                          keepdims=True)
+    if image_shapes is None:
+      self.image_shapes = None
+    else:
+      self.image_shapes = np.broadcast_to(
+          np.asarray(image_shapes).reshape(-1, 2)[:, 0:2],
+          (len(self.P), 2)).copy()
+
+  def __len__(self):
+    return len(self.P)
+
+  def __getitem__(self, index):
+    """ return camera index as a ProjectiveCamera """
+    return ProjectiveCamera(self.P[index].copy())
+
+  def to_cameras(self):
+    """ return a list of ProjectiveCamera objects """
+    return [self[i] for i in range(len(self))]
+
+  @classmethod
+  def from_cameras(cls, cameras, image_shapes=None):
+    """ construct from a list of cameras (anything with a 3x4 ``P``) """
+    return cls(_projection_matrices(cameras), image_shapes)
+
+  @classmethod
+  def from_KRT(cls, Ks, Rs, Ts, image_shapes=None):
+    """ construct from calibration matrices, rotations and translations
+
+        Parameters
+        ----------
+        Ks : array_like
+            The calibration matrices. Shape = M x 3 x 3, or 3 x 3 if shared
+        Rs : array_like
+            The rotation matrices. Shape = M x 3 x 3
+        Ts : array_like
+            The translation vectors. Shape = M x 3
+    """
+    Rs = np.asarray(Rs, np.float64).reshape(-1, 3, 3)
+    Ts = np.asarray(Ts, np.float64).reshape(-1, 3, 1)
+    Ks = np.asarray(Ks, np.float64)
+    return cls(np.matmul(Ks, np.concatenate((Rs, Ts), axis=2)), image_shapes)
+
+  @classmethod
+  def from_KRT_files(cls, filenames, image_shapes=None):
+    """ construct from KRT text files (see io_utils.read_camera_KRT) """
+    from vsi.utils import io_utils
+    Ks, Rs, Ts = zip(*[io_utils.read_camera_KRT(f) for f in filenames])
+    return cls.from_KRT(Ks, Rs, Ts, image_shapes)
+
+  @classmethod
+  def from_bundler_file(cls, filename, image_shapes=None):
+    """ construct from the output of the 'bundler' program
+
+        Bundler cameras look down -z with y up, and image coordinates relative
+        to the image center. The cameras are converted to the usual
+        convention (origin at the top left, y down) when image_shapes is
+        given; otherwise the principal point is left at the origin. Radial
+        distortion is ignored.
+    """
+    from vsi.utils import io_utils
+    intrinsics, Rs, Ts, _ = io_utils.read_bundler_file(filename)
+    fs = np.array([intrinsic[0] for intrinsic in intrinsics], np.float64)
+    cx, cy = cls._principal_points(len(fs), image_shapes)
+    Ks = np.zeros((len(fs), 3, 3))
+    # u = cx + f*x/(-z), v = cy - f*y/(-z), with homogeneous scale -z
+    Ks[:, 0, 0] = fs
+    Ks[:, 1, 1] = -fs
+    Ks[:, 0, 2] = -cx
+    Ks[:, 1, 2] = -cy
+    Ks[:, 2, 2] = -1
+    return cls.from_KRT(Ks, Rs, Ts, image_shapes)
+
+  @classmethod
+  def from_nvm_file(cls, filename, image_shapes=None):
+    """ construct from a "VisualSFM" .nvm file
+
+        NVM measurements are relative to the image center, so the principal
+        point is only moved to the center of the image when image_shapes is
+        given. Distortion is ignored.
+
+        Returns
+        -------
+        CameraBundle
+            The cameras
+        list
+            The image file names
+
+        Raises
+        ------
+        IOError
+            When the file can not be opened or is not a .nvm file
+    """
+    from vsi.utils import io_utils
+    nvm = io_utils.read_vsfm_nvm_file(filename)
+    if nvm is None:
+      raise IOError('Unable to read NVM file ' + filename)
+    img_fnames, fs, Rs, Ts, _, _ = nvm
+    fs = np.asarray(fs, np.float64)
+    cx, cy = cls._principal_points(len(fs), image_shapes)
+    Ks = np.zeros((len(fs), 3, 3))
+    Ks[:, 0, 0] = fs
+    Ks[:, 1, 1] = fs
+    Ks[:, 0, 2] = cx
+    Ks[:, 1, 2] = cy
+    Ks[:, 2, 2] = 1
+    return cls.from_KRT(Ks, Rs, Ts, image_shapes), img_fnames
+
+  @staticmethod
+  def _principal_points(num_cams, image_shapes):
+    """ image centers (cx, cy), or zeros if image_shapes is None """
+    if image_shapes is None:
+      return np.zeros(num_cams), np.zeros(num_cams)
+    shapes = np.broadcast_to(np.asarray(image_shapes, np.float64).reshape(-1, 2),
+                             (num_cams, 2))
+    return shapes[:, 1] / 2.0, shapes[:, 0] / 2.0
+
+  def _point_chunks(self, num_pts, chunk_size):
+    """ slices over the points s.t. each chunk has ~chunk_size projections """
+    step = max(1, chunk_size // max(1, len(self)))
+    for start in range(0, num_pts, step):
+      yield slice(start, start + step)
+
+  def _project_h(self, pts_3d, dtype):
+    """ homogeneous projections of a chunk of points. Shape = M x N x 3 """
+    pts_2d_h = np.matmul(pts_3d.astype(dtype, copy=False),
+                         self.P[:, :, 0:3].transpose(0, 2, 1).astype(dtype))
+    pts_2d_h += self.P[:, np.newaxis, :, 3].astype(dtype)
+    return pts_2d_h
+
+  def project(self, pts_3d, dtype=None, chunk_size=1048576):
+    """ project points into every camera
+
+        Parameters
+        ----------
+        pts_3d : array_like
+            The 3D Points. Shape = N x 3
+        dtype : numpy.dtype, optional
+            The dtype used for computation and output. Default: float32 if
+            pts_3d is float32, otherwise float64
+        chunk_size : int, optional
+            The approximate number of projections computed at once, which
+            bounds the size of the temporary arrays
+
+        Returns
+        -------
+        numpy.array
+            The image coordinates. Shape = M x N x 2
+    """
+    pts_3d = np.asarray(pts_3d).reshape(-1, 3)
+    if dtype is None:
+      dtype = np.result_type(pts_3d.dtype, np.float32)
+    pts_2d = np.empty((len(self), len(pts_3d), 2), dtype)
+    for chunk in self._point_chunks(len(pts_3d), chunk_size):
+      pts_2d_h = self._project_h(pts_3d[chunk], dtype)
+      np.divide(pts_2d_h[..., 0:2], pts_2d_h[..., 2:3], out=pts_2d[:, chunk])
+    return pts_2d
+
+  def visibility(self, pts_3d, max_distance=None, chunk_size=1048576):
+    """ test which points fall inside the view frustum of each camera
+
+        Parameters
+        ----------
+        pts_3d : array_like
+            The 3D Points. Shape = N x 3
+        max_distance : float, optional
+            If given, points further than this from the camera center are
+            not visible
+        chunk_size : int, optional
+            The approximate number of projections computed at once
+
+        Returns
+        -------
+        numpy.array
+            True for points in front of the camera and inside its image.
+            Shape = M x N
+    """
+    if self.image_shapes is None:
+      raise Exception('visibility requires image_shapes')
+    pts_3d = np.asarray(pts_3d, np.float64).reshape(-1, 3)
+    rows = self.image_shapes[:, 0, np.newaxis]
+    cols = self.image_shapes[:, 1, np.newaxis]
+    visible = np.empty((len(self), len(pts_3d)), bool)
+    for chunk in self._point_chunks(len(pts_3d), chunk_size):
+      pts_2d_h = self._project_h(pts_3d[chunk], np.float64)
+      w = pts_2d_h[..., 2]
+      with np.errstate(divide='ignore', invalid='ignore'):
+        x = pts_2d_h[..., 0] / w
+        y = pts_2d_h[..., 1] / w
+      vis = ((w * self._det_sign[:, np.newaxis] > 0) &
+             (x >= 0) & (x < cols) & (y >= 0) & (y < rows))
+      if max_distance is not None:
+        offsets = pts_3d[np.newaxis, chunk, :] - self.centers[:, np.newaxis, :]
+        vis &= np.einsum('mni,mni->mn', offsets, offsets) <= max_distance**2
+      visible[:, chunk] = vis
+    return visible
+
+  def nearest_cameras(self, pts_3d, k=1, chunk_size=1048576):
+    """ find the k cameras whose centers are closest to each point
+
+        Parameters
+        ----------
+        pts_3d : array_like
+            The 3D Points. Shape = N x 3
+        k : int, optional
+            The number of cameras returned per point
+        chunk_size : int, optional
+            The approximate number of distances computed at once
+
+        Returns
+        -------
+        numpy.array
+            The camera indices, nearest first. Shape = N x k
+        numpy.array
+            The distances to those camera centers. Shape = N x k
+    """
+    pts_3d = np.asarray(pts_3d, np.float64).reshape(-1, 3)
+    k = min(k, len(self))
+    indices = np.empty((len(pts_3d), k), np.intp)
+    distances = np.empty((len(pts_3d), k), np.float64)
+    center_sq = np.einsum('mi,mi->m', self.centers, self.centers)
+    for chunk in self._point_chunks(len(pts_3d), chunk_size):
+      pts = pts_3d[chunk]
+      dist_sq = (np.einsum('ni,ni->n', pts, pts)[:, np.newaxis] -
+                 2 * np.dot(pts, self.centers.T) + center_sq)
+      if k < len(self):
+        nearest = np.argpartition(dist_sq, k - 1, axis=1)[:, 0:k]
+      else:
+        nearest = np.broadcast_to(np.arange(len(self)), dist_sq.shape)
+      nearest_sq = np.take_along_axis(dist_sq, nearest, axis=1)
+      order = np.argsort(nearest_sq, axis=1)
+      indices[chunk] = np.take_along_axis(nearest, order, axis=1)
+      distances[chunk] = np.sqrt(np.maximum(
+          np.take_along_axis(nearest_sq, order, axis=1), 0))
+    return indices, distances
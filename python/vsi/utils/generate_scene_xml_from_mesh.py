@@ -3,7 +3,6 @@
 import argparse
 import vsi.vxl.generate_scene_xml as generate_scene_xml
 import vsi.utils.mesh_utils as mesh_utils
-import sys
 import numpy as np
 
 def generate_scene_xml_from_mesh(mesh_filename, output_filename, model_dir_rel, num_blocks, max_num_subblocks, appearance_models, num_bins, max_level, lvcs_origin ):
@@ -54,8 +53,8 @@ def generate_scene_xml_from_mesh(mesh_filename, output_filename, model_dir_rel,
 def main():
   """ main """
   parser = argparse.ArgumentParser()
-  parser.add_argument('mesh_filename', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
-  parser.add_argument('output_filename', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+  parser.add_argument('mesh_filename')
+  parser.add_argument('output_filename')
   parser.add_argument('--model_dir_rel', default='.')
   parser.add_argument('--num_blocks', nargs=3, type=int, default=(1,1,1))
   parser.add_argument('--num_subblocks', nargs=3, type=int, default=(100,100,100))
@@ -66,7 +65,7 @@ def main():
   args = parser.parse_args()
 
 
-  generate_scene_xml_from_mesh(args.mesh_filename, args.output_file, args.model_dir_rel, args.num_blocks, args.num_subblocks, args.appearance_models, args.num_bins, args.max_level, args.lvcs_origin)
+  generate_scene_xml_from_mesh(args.mesh_filename, args.output_filename, args.model_dir_rel, args.num_blocks, args.num_subblocks, args.appearance_models, args.num_bins, args.max_level, args.lvcs_origin)
 
 
 if __name__ == '__main__':
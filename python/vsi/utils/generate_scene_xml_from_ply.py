@@ -3,7 +3,6 @@
 import argparse
 import vsi.vxl.generate_scene_xml as generate_scene_xml
 import vsi.utils.mesh_utils as mesh_utils
-import sys
 import numpy as np
 
 def generate_scene_xml_from_ply(ply_filename, output_filename, model_dir_rel, num_blocks, max_num_subblocks, appearance_models, num_bins, max_level, lvcs_origin ):
@@ -32,13 +31,45 @@ def generate_scene_xml_from_ply(ply_filename, output_filename, model_dir_rel, nu
   """
   # get the mesh vertices in numpy matrix form
   verts = mesh_utils.get_ply_vertices(ply_filename)
-  # compute subblock size needed to contain all vertices
-  bbox_size = verts.max(axis=1) - verts.min(axis=1)
+  generate_scene_xml_from_bbox(verts.min(axis=1), verts.max(axis=1), output_filename, model_dir_rel, num_blocks, max_num_subblocks, appearance_models, num_bins, max_level, lvcs_origin)
+
+def generate_scene_xml_from_bbox(bbox_min, bbox_max, output_filename, model_dir_rel, num_blocks, max_num_subblocks, appearance_models, num_bins, max_level, lvcs_origin, pad_fraction=0.04):
+  """ generate the scene.xml to fit a bounding box, such as the bounds kept
+      by :class:`vsi.utils.mesh_utils.PlyStreamWriter`
+
+      Parameters
+      ----------
+      bbox_min : array_like
+        The minimum x, y, z of the geometry
+      bbox_max : array_like
+        The maximum x, y, z of the geometry
+      output_filename : str
+        The output filename
+      model_dir_rel : str
+        The relative path to the model directory
+      num_blocks : int
+        The number of blocks
+      max_num_subblocks: int
+        The maximum number of subblocks
+      appearance_models : list
+        List of appearance models
+      num_bins : int
+        The number of bins
+      max_level : int
+        The maximum number of octree subdivisions
+      lvcs_origin : array_like
+        A 3D array
+      pad_fraction : float
+        The padding added to each side, as a fraction of the box size
+  """
+  bbox_min = np.asarray(bbox_min, np.float64)
+  # compute subblock size needed to contain the bounding box
+  bbox_size = np.asarray(bbox_max, np.float64) - bbox_min
   # add some padding to avoid points right on the boundary of the volume
-  bbox_pad = 0.04 * bbox_size
+  bbox_pad = pad_fraction * bbox_size
   bbox_size += 2.0 * bbox_pad
   # local origin is the minimum of the vertices
-  local_origin = verts.min(axis=1) - bbox_pad
+  local_origin = bbox_min - bbox_pad
   print('local_origin = ' + str(local_origin))
   max_total_num_subblocks = np.array(num_blocks) * max_num_subblocks
   subblock_size = np.max(bbox_size / max_total_num_subblocks )
@@ -48,14 +79,14 @@ def generate_scene_xml_from_ply(ply_filename, output_filename, model_dir_rel, nu
   print('subblock_size = ' + str(subblock_size))
   print('num_subblocks = ' + str(num_subblocks))
 
-  output_fd = open(output_filename, 'w')
-  generate_scene_xml.generate_scene_xml(output_fd, model_dir_rel, num_blocks, num_subblocks, subblock_size, appearance_models, num_bins, max_level, lvcs_origin, local_origin)
+  with open(output_filename, 'w') as output_fd:
+    generate_scene_xml.generate_scene_xml(output_fd, model_dir_rel, num_blocks, num_subblocks, subblock_size, appearance_models, num_bins, max_level, lvcs_origin, local_origin)
 
 def main():
   """ main """
   parser = argparse.ArgumentParser()
-  parser.add_argument('ply_filename', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
-  parser.add_argument('output_filename', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+  parser.add_argument('ply_filename')
+  parser.add_argument('output_filename')
   parser.add_argument('--model_dir_rel', default='.')
   parser.add_argument('--num_blocks', nargs=3, type=int, default=(1,1,1))
   parser.add_argument('--num_subblocks', nargs=3, type=int, default=(100,100,100))
@@ -66,7 +97,7 @@ def main():
   args = parser.parse_args()
 
 
-  generate_scene_xml_from_ply(args.ply_filename, args.output_file, args.model_dir_rel, args.num_blocks, args.num_subblocks, args.appearance_models, args.num_bins, args.max_level, args.lvcs_origin)
+  generate_scene_xml_from_ply(args.ply_filename, args.output_filename, args.model_dir_rel, args.num_blocks, args.num_subblocks, args.appearance_models, args.num_bins, args.max_level, args.lvcs_origin)
 
 
 if __name__ == '__main__':
@@ -72,7 +72,7 @@ def fit_plane_3d(points):
   P[3, :] = 1
 
   A = np.dot(P, P.transpose())
-  _, _, Vh = np.linalg.linalg.svd(A)
+  _, _, Vh = np.linalg.svd(A)
   V = Vh.conj().transpose()
   plane = V[:, -1]
 
@@ -91,17 +91,38 @@ def fit_plane_3d(points):
   return plane
 
 
-def fit_plane_3d_RANSAC(points, inlier_thresh=1.0, max_draws=100):
+def fit_plane_3d_RANSAC(points, inlier_thresh=1.0, max_draws=100,
+                        confidence=0.99, batch_size=32, local_optimization=True,
+                        preemptive_size=None, chunk_size=1048576, rng=None):
   """ fit a plane to a noisy set of points.
 
+      Hypotheses are drawn in batches, and each batch is scored against the
+      points with a single matrix multiply. Drawing stops once enough
+      hypotheses have been scored to find an all-inlier sample with the
+      given confidence, based on the best inlier ratio seen so far.
+
       Parameters
       ----------
       points : array_like
-        A Noisy Set of Points
+        A Noisy Set of Points. Shape = N x 3
       inlier_thresh : float
         The Threshold
       max_draws : int
         The Maximum Number of Draws
+      confidence : float, optional
+        The desired probability of drawing at least one all-inlier sample
+      batch_size : int, optional
+        The number of hypotheses scored at once
+      local_optimization : bool, optional
+        Iteratively refit the plane to its inliers while the inlier count
+        grows
+      preemptive_size : int, optional
+        If given, hypotheses are scored on a random subset of this many
+        points, and only the winner is scored on the full set
+      chunk_size : int, optional
+        The approximate number of point to plane distances computed at once
+      rng : numpy.random.Generator or int, optional
+        The random generator, or a seed for one
 
       Returns
       -------
@@ -110,33 +131,94 @@ def fit_plane_3d_RANSAC(points, inlier_thresh=1.0, max_draws=100):
       array_like
         The Indices of Inliers
   """
+  rng = np.random.default_rng(rng)
+  points = np.asarray(points, np.float64).reshape(-1, 3)
   num_pts_total = len(points)
-  best_inliers = np.zeros(num_pts_total,np.bool)
+  if preemptive_size is not None and preemptive_size < num_pts_total:
+    score_points = points[rng.choice(num_pts_total, preemptive_size,
+                                     replace=False)]
+  else:
+    score_points = points
+
+  best_plane = None
   best_inlier_sum = 0
-  points_homg_np = np.hstack((np.array(points), np.ones((num_pts_total,1))))
-  for _ in range(max_draws):
-    # randomly select 3 points from the set
-    selection = np.random.randint(0,num_pts_total,3)
-    points_rand = [points[s] for s in selection]
-    # fit plane to random selection of points
-    plane_rand = fit_plane_3_points(points_rand)
-    # compute distances from all points to the plane
-    dists = np.dot(points_homg_np, plane_rand)
-    inliers = np.abs(dists) < inlier_thresh
-    inlier_sum = inliers.sum()
-    if inlier_sum > best_inlier_sum:
-      best_inliers = inliers
-      best_inlier_sum = inlier_sum
-    # no need to keep going if all points are inliers
-    if inlier_sum == num_pts_total:
-      break
+  num_draws = 0
+  needed_draws = max_draws
+  while num_draws < needed_draws:
+    num_batch = min(batch_size, needed_draws - num_draws)
+    num_draws += num_batch
+    planes = _fit_planes_3_points(points[rng.integers(0, num_pts_total,
+                                                      (num_batch, 3))])
+    inlier_sums = _count_plane_inliers(score_points, planes, inlier_thresh,
+                                       chunk_size)
+    best = np.argmax(inlier_sums)
+    if inlier_sums[best] > best_inlier_sum:
+      best_inlier_sum = inlier_sums[best]
+      best_plane = planes[best]
+      needed_draws = min(max_draws, num_draws + _ransac_num_draws(
+          best_inlier_sum / float(len(score_points)), 3, confidence))
+
+  if best_plane is None:
+    # every sample was degenerate
+    return np.array((0,0,0,np.inf)), np.zeros(num_pts_total, bool)
+  best_inliers = _plane_inliers(points, best_plane, inlier_thresh, chunk_size)
+
   # now re-fit using all inliers
-  points_good = [points[n] for n in range(num_pts_total) if best_inliers[n]]
-  plane = fit_plane_3d(points_good)
+  plane = fit_plane_3d(points[best_inliers])
+  while local_optimization:
+    inliers = _plane_inliers(points, plane, inlier_thresh, chunk_size)
+    if inliers.sum() <= best_inliers.sum():
+      break
+    best_inliers = inliers
+    plane = fit_plane_3d(points[best_inliers])
 
   return plane, best_inliers
 
 
+def _ransac_num_draws(inlier_ratio, sample_size, confidence):
+  """ the number of draws needed to pick an all-inlier sample with the given
+  confidence """
+  p_good = inlier_ratio ** sample_size
+  if p_good >= 1:
+    return 0
+  if p_good <= 0:
+    return np.iinfo(np.int64).max
+  return int(np.ceil(np.log(1 - confidence) / np.log(1 - p_good)))
+
+
+def _fit_planes_3_points(samples):
+  """ vectorized :func:`fit_plane_3_points` for samples of shape K x 3 x 3.
+  Degenerate samples give the plane (0,0,0,inf) """
+  norms = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+  norm_mags = np.sqrt(np.einsum('ki,ki->k', norms, norms))
+  planes = np.zeros((len(samples), 4))
+  planes[:, 3] = np.inf
+  good = norm_mags > 0
+  planes[good, 0:3] = norms[good] / norm_mags[good, np.newaxis]
+  planes[good, 3] = -np.einsum('ki,ki->k', planes[good, 0:3], samples[good, 0])
+  return planes
+
+
+def _count_plane_inliers(points, planes, inlier_thresh, chunk_size):
+  """ the number of points within inlier_thresh of each of K planes """
+  counts = np.zeros(len(planes), np.int64)
+  step = max(1, chunk_size // len(planes))
+  for start in range(0, len(points), step):
+    dists = np.dot(points[start:start + step], planes[:, 0:3].T)
+    dists += planes[:, 3]
+    counts += (np.abs(dists) < inlier_thresh).sum(axis=0)
+  return counts
+
+
+def _plane_inliers(points, plane, inlier_thresh, chunk_size):
+  """ mask of the points within inlier_thresh of plane """
+  inliers = np.empty(len(points), bool)
+  for start in range(0, len(points), chunk_size):
+    chunk = slice(start, start + chunk_size)
+    inliers[chunk] = np.abs(np.dot(points[chunk], plane[0:3]) + plane[3]) < inlier_thresh
+  return inliers
+
+
 def axis_angle_to_matrix(axis,theta):
   """ Convert a rotation axis / angle pair to a 3x3 rotation matrix
 
@@ -465,6 +547,294 @@ def matrix_to_Euler_angles(M, order='XYZ'):
   return quaternion_to_Euler_angles(matrix_to_quaternion(M),order=order)
 
 
+def quaternion_multiply_batch(q1, q2):
+  """ multiply arrays of quaternions: the batch version of composing two
+  quaternions with :func:`compose_quaternions`
+
+      Parameters
+      ----------
+      q1 : array_like
+        The First Quaternions (w, x, y, z). Shape = N x 4
+      q2 : array_like
+        The Second Quaternions (w, x, y, z). Shape = N x 4
+
+      Returns
+      -------
+      array_like
+        The Products q1 * q2. Shape = N x 4
+  """
+  q1 = np.asarray(q1, np.float64)
+  q2 = np.asarray(q2, np.float64)
+  q1, q2 = np.broadcast_arrays(q1, q2)
+  q = np.empty(q1.shape)
+  q[..., 0] = q1[..., 0]*q2[..., 0] - _dot_batch(q1[..., 1:4], q2[..., 1:4])
+  q[..., 1:4] = (np.cross(q1[..., 1:4], q2[..., 1:4]) +
+                 q2[..., 1:4]*q1[..., 0:1] + q1[..., 1:4]*q2[..., 0:1])
+  return q
+
+
+def _dot_batch(a, b):
+  """ dot products of arrays of vectors. A stacked matmul gives the same
+  rounding as np.dot on single vectors, so batch results match exactly """
+  a, b = np.broadcast_arrays(a, b)
+  return np.matmul(a[..., np.newaxis, :], b[..., :, np.newaxis])[..., 0, 0]
+
+
+def compose_quaternions_batch(quaternion_list):
+  """ batch version of :func:`compose_quaternions`
+
+      Parameters
+      ----------
+      quaternion_list : array_like
+        The List of Quaternion arrays (w, x, y, z), each of shape N x 4
+
+      Returns
+      -------
+      array_like
+        The Compositions. Shape = N x 4
+  """
+  qtotal = np.array((1.0,0,0,0))
+  for q in quaternion_list:
+    qtotal = quaternion_multiply_batch(qtotal, q)
+  return qtotal
+
+
+def quaternion_to_matrix_batch(q):
+  """ batch version of :func:`quaternion_to_matrix`. Unlike the single
+  version, q is not normalized in place
+
+      Parameters
+      ----------
+      q : array_like
+        The Quaternions: (w, x, y, z). Shape = N x 4
+
+      Returns
+      -------
+      array_like
+        The Rotation Matrices. Shape = N x 3 x 3
+  """
+  q = np.asarray(q, np.float64)
+  q = q / np.sqrt((q*q).sum(axis=-1, keepdims=True))
+  w = q[..., 0]
+  x = q[..., 1]
+  y = q[..., 2]
+  z = q[..., 3]
+  R = np.empty(q.shape[:-1] + (3, 3))
+
+  R[..., 0,0] = 1 - 2*y*y - 2*z*z
+  R[..., 0,1] = 2*x*y - 2*z*w
+  R[..., 0,2] = 2*x*z + 2*y*w
+
+  R[..., 1,0] = 2*x*y + 2*z*w
+  R[..., 1,1] = 1 - 2*x*x - 2*z*z
+  R[..., 1,2] = 2*y*z - 2*x*w
+
+  R[..., 2,0] = 2*x*z - 2*y*w
+  R[..., 2,1] = 2*y*z + 2*x*w
+  R[..., 2,2] = 1 - 2*x*x - 2*y*y
+
+  return R
+
+
+def matrix_to_quaternion_batch(rot):
+  """ batch version of :func:`matrix_to_quaternion`
+
+      Each quaternion is computed from the largest of the four
+      (Shepperd) diagonal combinations, as in the single version.
+
+      Parameters
+      ----------
+      rot : array_like
+        The Rotation Matrices. Shape = N x 3 x 3
+
+      Returns
+      -------
+      array_like
+        The Quaternions: (w, x, y, z). Shape = N x 4
+  """
+  rot = np.asarray(rot, np.float64)
+  d0 = rot[..., 0,0]
+  d1 = rot[..., 1,1]
+  d2 = rot[..., 2,2]
+  vals = np.stack((1.0 + d0 - d1 - d2,
+                   1.0 - d0 + d1 - d2,
+                   1.0 - d0 - d1 + d2,
+                   1.0 + d0 + d1 + d2), axis=-1)
+  imax = np.argmax(np.abs(vals), axis=-1)
+  q = np.empty(rot.shape[:-2] + (4,))
+
+  # the component at imax is sqrt(val)/2, the others are sums or differences
+  # of off diagonal elements divided by 2*sqrt(val)
+  v4 = np.sqrt(np.take_along_axis(vals, imax[..., np.newaxis], -1)[..., 0])*2
+  big = v4 / 4
+  with np.errstate(divide='ignore'):
+    iv4 = 1.0 / v4
+  r21 = rot[..., 2,1] - rot[..., 1,2]
+  r02 = rot[..., 0,2] - rot[..., 2,0]
+  r10 = rot[..., 1,0] - rot[..., 0,1]
+  s10 = rot[..., 1,0] + rot[..., 0,1]
+  s20 = rot[..., 2,0] + rot[..., 0,2]
+  s21 = rot[..., 2,1] + rot[..., 1,2]
+
+  # (w, x, y, z) for each choice of imax: 0 -> x, 1 -> y, 2 -> z, 3 -> w
+  q[:] = np.stack((r21*iv4, big, s10*iv4, s20*iv4), axis=-1)
+  for index, comps in ((1, (r02, s10, big, s21)),
+                       (2, (r10, s20, s21, big)),
+                       (3, (big, r21, r02, r10))):
+    mask = imax == index
+    for c, comp in enumerate(comps):
+      q[..., c][mask] = comp[mask] if comp is big else (comp*iv4)[mask]
+  return q
+
+
+def axis_angle_to_quaternion_batch(axis, theta):
+  """ batch version of :func:`axis_angle_to_quaternion`
+
+      Parameters
+      ----------
+      axis : array_like
+        The Rotation Axes. Shape = N x 3
+      theta : array_like
+        The Angles. Shape = N
+
+      Returns
+      -------
+      array_like
+        The Quaternions (w, x, y, z). Shape = N x 4
+  """
+  axis = np.asarray(axis, np.float64)
+  theta = np.asarray(theta, np.float64)
+  axis_u = axis / np.sqrt(_dot_batch(axis, axis))[..., np.newaxis]
+  sin_half = np.sin(theta/2.0)
+  q = np.empty(np.broadcast_shapes(axis.shape[:-1], theta.shape) + (4,))
+  q[..., 0] = np.cos(theta/2.0)
+  q[..., 1:4] = sin_half[..., np.newaxis] * axis_u
+  return q
+
+
+def axis_angle_to_matrix_batch(axis, theta):
+  """ batch version of :func:`axis_angle_to_matrix`. Returns N x 3 x 3 """
+  return quaternion_to_matrix_batch(axis_angle_to_quaternion_batch(axis, theta))
+
+
+def Euler_angles_to_quaternion_batch(theta1, theta2, theta3, order='XYZ'):
+  """ batch version of :func:`Euler_angles_to_quaternion`
+
+      Parameters
+      ----------
+      theta1 : array_like
+        The First Angles. Shape = N
+      theta2: array_like
+        The Second Angles. Shape = N
+      theta3 : array_like
+        The Third Angles. Shape = N
+      order : string
+        The Order of the Axes
+
+      Returns
+      -------
+      array_like
+        The Quaternions: (w, x, y, z). Shape = N x 4
+  """
+  if not axis_order_is_valid(order):
+    raise ValueError('Invalid order string: ' + str(order))
+
+  qs = []
+  for theta, axis in zip(np.broadcast_arrays(theta1, theta2, theta3), order):
+    theta = np.asarray(theta, np.float64)
+    q = np.zeros(theta.shape + (4,))
+    q[..., 0] = np.cos(theta/2.0)
+    q[..., 1:4] = axis_from_string(axis) * np.sin(theta/2.0)[..., np.newaxis]
+    qs.append(q)
+  return compose_quaternions_batch(qs)
+
+
+def Euler_angles_to_matrix_batch(theta1, theta2, theta3, order='XYZ'):
+  """ batch version of :func:`Euler_angles_to_matrix`. Returns N x 3 x 3 """
+  return quaternion_to_matrix_batch(
+      Euler_angles_to_quaternion_batch(theta1, theta2, theta3, order=order))
+
+
+def quaternion_to_Euler_angles_batch(q, order='XYZ'):
+  """ batch version of :func:`quaternion_to_Euler_angles`
+
+      Parameters
+      ----------
+      q : array_like
+        The Quaternions (w, x, y, z). Shape = N x 4
+      order : str
+        The Order of the Axes
+
+      Returns
+      -------
+      array_like
+        The three arrays of angles, in the order of application
+  """
+  if not axis_order_is_valid(order):
+    raise Exception('Invalid order string: ' + str(order))
+  q = np.asarray(q, np.float64)
+  component = {'X': 1, 'Y': 2, 'Z': 3}
+  p0 = q[..., 0]  # real component
+  p1 = q[..., component[order[0]]]
+  p2 = q[..., component[order[1]]]
+  p3 = q[..., component[order[2]]]
+
+  e1 = axis_from_string(order[0])
+  e2 = axis_from_string(order[1])
+  e3 = axis_from_string(order[2])
+
+  e = np.sign(np.dot(np.cross(e3,e2),e1))
+
+  theta1 = np.arctan2(e*2*(p2*p3 + e*p0*p1), p0*p0 - p1*p1 - p2*p2 + p3*p3)
+  theta2 = np.arcsin(-e*2*(p1*p3 - e*p0*p2))
+  theta3 = np.arctan2(e*2*(p1*p2 + e*p0*p3), p0*p0 + p1*p1 - p2*p2 - p3*p3)
+
+  return theta1, theta2, theta3
+
+
+def matrix_to_Euler_angles_batch(M, order='XYZ'):
+  """ batch version of :func:`matrix_to_Euler_angles` for N x 3 x 3 """
+  return quaternion_to_Euler_angles_batch(matrix_to_quaternion_batch(M),
+                                          order=order)
+
+
+def quaternion_slerp(q0, q1, t):
+  """ spherical linear interpolation between quaternions
+
+      Parameters
+      ----------
+      q0 : array_like
+        The Start Quaternions (w, x, y, z). Shape = N x 4, or 4
+      q1 : array_like
+        The End Quaternions (w, x, y, z). Shape = N x 4, or 4
+      t : array_like
+        The interpolation parameters, 0 at q0 and 1 at q1. Shape = N
+
+      Returns
+      -------
+      array_like
+        The unit Quaternions, along the shortest path. Shape = N x 4
+  """
+  q0 = np.asarray(q0, np.float64)
+  q1 = np.asarray(q1, np.float64)
+  q0 = q0 / np.linalg.norm(q0, axis=-1, keepdims=True)
+  q1 = q1 / np.linalg.norm(q1, axis=-1, keepdims=True)
+  t = np.asarray(t, np.float64)[..., np.newaxis]
+  cos_omega = (q0*q1).sum(axis=-1, keepdims=True)
+  # q and -q are the same rotation: take the shorter arc
+  q1 = np.where(cos_omega < 0, -q1, q1)
+  cos_omega = np.minimum(np.abs(cos_omega), 1.0)
+  omega = np.arccos(cos_omega)
+  sin_omega = np.sin(omega)
+  # fall back to linear interpolation for nearly identical quaternions
+  near = sin_omega < 1e-8
+  safe_sin = np.where(near, 1.0, sin_omega)
+  w0 = np.where(near, 1 - t, np.sin((1 - t) * omega) / safe_sin)
+  w1 = np.where(near, t, np.sin(t * omega) / safe_sin)
+  q = w0 * q0 + w1 * q1
+  return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
 def make_RT(R, T=None, pos=None):
     """ Construct a 4x4 homogeneous rigid transform matrix.
     Specify R and at most one of T, pos
@@ -677,6 +1047,169 @@ def intersect_plane_ray(plane, ray_origin, ray_vector):
   return ray_origin + dist * ray_vector
 
 
+def intersect_plane_rays(plane, ray_origins, ray_vectors, return_distances=False):
+  """ Compute the intersection points of planes and rays.
+
+      Parameters
+      ----------
+      plane : array_like
+        The Plane(s). The parameters (a,b,c,d) of the plane,
+        ax + by + cz + d = 0. Shape = 4 or N x 4
+      ray_origins : array_like
+        The Origins of the Rays. Shape = N x 3
+      ray_vectors : array_like
+        The directions of the rays. Shape = N x 3
+      return_distances : bool, optional
+        Also return the ray parameter of each intersection, in units of the
+        ray vector length
+
+      Returns
+      -------
+      array_like
+        The intersection points. Rays parallel to the plane give NaN or inf.
+        Shape = N x 3
+  """
+  plane = np.asarray(plane, np.float64)
+  ray_origins = np.asarray(ray_origins, np.float64)
+  ray_vectors = np.asarray(ray_vectors, np.float64)
+  numer = (ray_origins * plane[..., 0:3]).sum(axis=-1) + plane[..., 3]
+  denom = (ray_vectors * plane[..., 0:3]).sum(axis=-1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    dist = -numer / denom
+  points = ray_origins + dist[..., np.newaxis] * ray_vectors
+  if return_distances:
+    return points, dist
+  return points
+
+
+def traverse_voxels(ray_origins, ray_vectors, grid_origin, grid_dims, vox_len,
+                    max_distance=np.inf, chunk_size=65536):
+  """ Find the voxels of a grid visited by each ray, in order.
+
+      Amanatides-Woo DDA traversal, stepping all the rays of a chunk in
+      lockstep: every iteration advances each active ray into its next
+      voxel.
+
+      Parameters
+      ----------
+      ray_origins : array_like
+        The Origins of the Rays. Shape = N x 3
+      ray_vectors : array_like
+        The directions of the rays. Shape = N x 3
+      grid_origin: array_like
+        3-D position of voxel grid origin point (ox, oy, oz)
+      grid_dims: array_like
+        number of voxels in x,y,z dimensions.  (nx, ny, nz)
+      vox_len: float
+        The side length of a single voxel (voxels assumed to be cubes)
+      max_distance: float, optional
+        Stop each ray at this distance, in units of the ray vector length
+      chunk_size: int, optional
+        The number of rays traversed at once
+
+      Returns
+      -------
+      array_like
+        CSR offsets: the visits of ray n are entries offsets[n] to
+        offsets[n+1]. Shape = N+1
+      array_like
+        The int32 (i, j, k) index of each visited voxel. Shape = M x 3
+      array_like
+        The distance along the ray where it enters each voxel. Shape = M
+      array_like
+        The distance along the ray where it leaves each voxel. Shape = M
+  """
+  ray_origins = np.asarray(ray_origins, np.float64).reshape(-1, 3)
+  ray_vectors = np.asarray(ray_vectors, np.float64).reshape(-1, 3)
+  grid_origin = np.asarray(grid_origin, np.float64)
+  grid_dims = np.asarray(grid_dims, np.int64)
+  counts = []
+  voxels = []
+  entries = []
+  exits = []
+  for start in range(0, len(ray_origins), chunk_size):
+    chunk = slice(start, start + chunk_size)
+    ray_ids, chunk_voxels, chunk_entries, chunk_exits = _traverse_voxels_chunk(
+        ray_origins[chunk], ray_vectors[chunk], grid_origin, grid_dims,
+        float(vox_len), max_distance)
+    counts.append(np.bincount(ray_ids, minlength=len(ray_origins[chunk])))
+    voxels.append(chunk_voxels)
+    entries.append(chunk_entries)
+    exits.append(chunk_exits)
+  if not counts:
+    return (np.zeros(1, np.int64), np.zeros((0, 3), np.int32), np.zeros(0),
+            np.zeros(0))
+  offsets = np.concatenate(([0], np.cumsum(np.concatenate(counts))))
+  return (offsets, np.concatenate(voxels), np.concatenate(entries),
+          np.concatenate(exits))
+
+
+def _traverse_voxels_chunk(origins, vectors, grid_origin, grid_dims, vox_len,
+                           max_distance):
+  """ lockstep DDA for one chunk of rays. Returns the ray id, voxel, entry
+  and exit distance of each visit, sorted by ray """
+  grid_max = grid_origin + vox_len * grid_dims
+  # clip each ray to the grid bounds (slab test)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    inv = 1.0 / vectors
+    t_lo = (grid_origin - origins) * inv
+    t_hi = (grid_max - origins) * inv
+  t_near = np.minimum(t_lo, t_hi)
+  t_far = np.maximum(t_lo, t_hi)
+  # rays parallel to a slab are either always or never inside it
+  parallel = vectors == 0
+  inside = (origins >= grid_origin) & (origins <= grid_max)
+  t_near[parallel] = np.where(inside[parallel], -np.inf, np.inf)
+  t_far[parallel] = np.where(inside[parallel], np.inf, -np.inf)
+  t_enter = np.maximum(t_near.max(axis=1), 0)
+  t_leave = np.minimum(t_far.min(axis=1), max_distance)
+
+  rays = np.nonzero(t_enter < t_leave)[0]
+  t = t_enter[rays]
+  t_end = t_leave[rays]
+  pos = origins[rays] + t[:, np.newaxis] * vectors[rays]
+  idx = np.floor((pos - grid_origin) / vox_len).astype(np.int64)
+  np.clip(idx, 0, grid_dims - 1, out=idx)
+
+  vec = vectors[rays]
+  step = np.sign(vec).astype(np.int64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    t_delta = np.where(step != 0, vox_len / np.abs(vec), np.inf)
+    boundary = grid_origin + vox_len * (idx + (step > 0))
+    t_max = np.where(step != 0, (boundary - origins[rays]) / vec, np.inf)
+
+  ray_ids = []
+  voxels = []
+  entries = []
+  exits = []
+  active = np.arange(len(rays))
+  while len(active):
+    axis = np.argmin(t_max[active], axis=1)
+    t_next = np.minimum(t_max[active, axis], t_end[active])
+    # skip zero length visits, e.g. where a ray passes through an edge
+    visit = t_next > t[active]
+    ray_ids.append(rays[active[visit]])
+    voxels.append(idx[active[visit]].astype(np.int32))
+    entries.append(t[active[visit]])
+    exits.append(t_next[visit])
+
+    t[active] = t_next
+    idx[active, axis] += step[active, axis]
+    t_max[active, axis] += t_delta[active, axis]
+    idx_active = idx[active]
+    keep = ((t_next < t_end[active]) &
+            (idx_active >= 0).all(axis=1) & (idx_active < grid_dims).all(axis=1))
+    active = active[keep]
+
+  if not ray_ids:
+    return (np.zeros(0, np.int64), np.zeros((0, 3), np.int32), np.zeros(0),
+            np.zeros(0))
+  ray_ids = np.concatenate(ray_ids)
+  order = np.argsort(ray_ids, kind='stable')
+  return (ray_ids[order], np.concatenate(voxels)[order],
+          np.concatenate(entries)[order], np.concatenate(exits)[order])
+
+
 def rasterize_plane(grid_origin, grid_dims, vox_len, plane):
   """ Visit each cell of a 3-d grid that intersects the plane.
 
@@ -705,7 +1238,7 @@ def rasterize_plane(grid_origin, grid_dims, vox_len, plane):
     for j in range(grid_dims[d1]):
       d1_val = grid_origin[d1] + vox_len * j
       d2_val = -(plane[d0]*d0_val + plane[d1]*d1_val + plane[3]) / plane[d2]
-      k = np.int(np.floor((d2_val - grid_origin[d2])/vox_len))
+      k = int(np.floor((d2_val - grid_origin[d2])/vox_len))
       #if (k >= 0) and (k < grid_dims[d2]):
       if 0 <= k < grid_dims[d2]:
         p = [0,0,0]
@@ -715,6 +1248,175 @@ def rasterize_plane(grid_origin, grid_dims, vox_len, plane):
         yield p
 
 
+def rasterize_plane_array(grid_origin, grid_dims, vox_len, plane,
+                          chunk_size=1048576):
+  """ Find each cell of a 3-d grid that intersects the plane.
+
+      Array version of :func:`rasterize_plane`, returning the same cells in
+      the same order.
+
+      Parameters
+      ----------
+      grid_origin: array_like
+        3-D position of voxel grid origin point (ox, oy, oz)
+      grid_dims: array_like
+        number of voxels in x,y,z dimensions.  (nx, ny, nz)
+      vox_len: float
+        The side length of a single voxel (voxels assumed to be cubes)
+      plane: array_like
+        The parameters (a,b,c,d) of the plane.  ax + by + cz + d = 0
+      chunk_size: int, optional
+        The approximate number of candidate cells computed at once
+
+      Returns
+      -------
+      numpy.array
+        The int32 (i, j, k) cell indices. Shape = N x 3
+  """
+  # get dimensions of normal in ascending order
+  d0, d1, d2 = np.argsort(np.abs(plane[0:3]))
+  n0, n1, n2 = int(grid_dims[d0]), int(grid_dims[d1]), int(grid_dims[d2])
+  d1_vals = grid_origin[d1] + vox_len * np.arange(n1)
+  step = max(1, chunk_size // max(n1, 1))
+  cells = []
+  for start in range(0, n0, step):
+    i = np.arange(start, min(start + step, n0))
+    d0_vals = grid_origin[d0] + vox_len * i
+    # solve for the d2 coordinate of each (d0, d1) grid line
+    d2_vals = -(plane[d0]*d0_vals[:, np.newaxis] + plane[d1]*d1_vals + plane[3]) / plane[d2]
+    k = np.floor((d2_vals - grid_origin[d2]) / vox_len)
+    ii, jj = np.nonzero((k >= 0) & (k < n2))
+    chunk_cells = np.empty((len(ii), 3), np.int32)
+    chunk_cells[:, d0] = i[ii]
+    chunk_cells[:, d1] = jj
+    chunk_cells[:, d2] = k[ii, jj]
+    cells.append(chunk_cells)
+  if not cells:
+    return np.zeros((0, 3), np.int32)
+  return np.concatenate(cells)
+
+
+def voxelize_triangles(vertices, faces, grid_origin, grid_dims, vox_len,
+                       packed=False, batch_size=1048576):
+  """ Find the cells of a 3-d grid that intersect a triangle mesh surface.
+
+      The candidate cells of each triangle are those overlapping its bounding
+      box. Each (triangle, cell) pair is then checked with the separating
+      axis test of Akenine-Moller, vectorized over batches of pairs.
+
+      Parameters
+      ----------
+      vertices: array_like
+        The mesh vertices. Shape = N x 3
+      faces: array_like
+        The vertex indices of each triangle. Shape = M x 3
+      grid_origin: array_like
+        3-D position of voxel grid origin point (ox, oy, oz)
+      grid_dims: array_like
+        number of voxels in x,y,z dimensions.  (nx, ny, nz)
+      vox_len: float
+        The side length of a single voxel (voxels assumed to be cubes)
+      packed: bool, optional
+        If true, return the occupancy bit-packed along z (as
+        numpy.packbits would), which takes 1/8 of the memory
+      batch_size: int, optional
+        The maximum number of (triangle, cell) pairs tested at once. The
+        candidate cells of large triangles are split across batches
+
+      Returns
+      -------
+      numpy.array
+        The occupancy grid: bool with shape (nx, ny, nz), or uint8 with
+        shape (nx, ny, ceil(nz/8)) if packed
+  """
+  grid_origin = np.asarray(grid_origin, np.float64)
+  grid_dims = np.asarray(grid_dims, np.int64)
+  tris = np.asarray(vertices, np.float64)[np.asarray(faces).reshape(-1, 3)]
+  if packed:
+    occupancy = np.zeros((grid_dims[0], grid_dims[1], (grid_dims[2] + 7) // 8),
+                         np.uint8)
+  else:
+    occupancy = np.zeros(tuple(grid_dims), bool)
+
+  # the range of cells overlapping each triangle's bounding box
+  lo = np.floor((tris.min(axis=1) - grid_origin) / vox_len).astype(np.int64)
+  hi = np.floor((tris.max(axis=1) - grid_origin) / vox_len).astype(np.int64)
+  lo = np.maximum(lo, 0)
+  hi = np.minimum(hi, grid_dims - 1)
+  extents = np.maximum(hi - lo + 1, 0)
+  num_cells = extents.prod(axis=1)
+  tri_ids = np.flatnonzero(num_cells > 0)
+  lo = lo[tri_ids]
+  extents = extents[tri_ids]
+  num_cells = num_cells[tri_ids]
+
+  # split the boxes of triangles with more than batch_size candidate cells
+  # into blocks of at most batch_size cells, so every batch is bounded
+  big = num_cells > batch_size
+  if big.any():
+    pieces = [(tri_ids[~big], lo[~big], extents[~big])]
+    for tri_id, tri_lo, tri_ext in zip(tri_ids[big], lo[big], extents[big]):
+      block = np.empty(3, np.int64)
+      block[2] = min(tri_ext[2], batch_size)
+      block[1] = min(tri_ext[1], max(1, batch_size // block[2]))
+      block[0] = min(tri_ext[0], max(1, batch_size // (block[1] * block[2])))
+      block_starts = np.stack(np.meshgrid(*[np.arange(0, e, b) for e, b in
+                                            zip(tri_ext, block)],
+                                          indexing='ij'), axis=-1).reshape(-1, 3)
+      pieces.append((np.full(len(block_starts), tri_id), tri_lo + block_starts,
+                     np.minimum(block, tri_ext - block_starts)))
+    tri_ids, lo, extents = [np.concatenate(p) for p in zip(*pieces)]
+    num_cells = extents.prod(axis=1)
+  tris = tris[tri_ids]
+
+  ends = np.cumsum(num_cells)
+  start = 0
+  while start < len(tris):
+    # the batch of triangles with about batch_size candidate cells
+    stop = max(start + 1, np.searchsorted(ends, ends[start] - num_cells[start]
+                                          + batch_size, side='right'))
+    tri_idx = np.repeat(np.arange(start, stop), num_cells[start:stop])
+    offsets = np.arange(len(tri_idx)) - np.repeat(ends[start:stop] - num_cells[start:stop]
+                                                  - (ends[start] - num_cells[start]),
+                                                  num_cells[start:stop])
+    ext = extents[tri_idx]
+    cells = lo[tri_idx] + np.column_stack((offsets // (ext[:, 1] * ext[:, 2]),
+                                           (offsets // ext[:, 2]) % ext[:, 1],
+                                           offsets % ext[:, 2]))
+    centers = grid_origin + vox_len * (cells + 0.5)
+    hit = _triangle_box_overlap(tris[tri_idx] - centers[:, np.newaxis, :],
+                                vox_len / 2.0)
+    i, j, k = cells[hit].T
+    if packed:
+      np.bitwise_or.at(occupancy, (i, j, k // 8),
+                       (128 >> (k % 8)).astype(np.uint8))
+    else:
+      occupancy[i, j, k] = True
+    start = stop
+  return occupancy
+
+
+def _triangle_box_overlap(tris, half_len):
+  """ separating axis test of triangles (K x 3 x 3, relative to the box
+  centers) against cubes of half side length half_len. The box face normals
+  are assumed to have been tested already """
+  edges = np.stack((tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 1],
+                    tris[:, 0] - tris[:, 2]), axis=1)
+  overlap = np.ones(len(tris), bool)
+  # the 9 cross products of the box axes with the triangle edges
+  for axis in np.eye(3):
+    for e in range(3):
+      a = np.cross(axis, edges[:, e])
+      proj = np.einsum('kvi,ki->kv', tris, a)
+      r = half_len * np.abs(a).sum(axis=1)
+      overlap &= (proj.min(axis=1) <= r) & (proj.max(axis=1) >= -r)
+  # the triangle normal
+  normal = np.cross(edges[:, 0], edges[:, 1])
+  dist = np.einsum('ki,ki->k', normal, tris[:, 0])
+  overlap &= np.abs(dist) <= half_len * np.abs(normal).sum(axis=1)
+  return overlap
+
+
 class AxisAlignedBox(object):
   def __init__(self, min_pt, max_pt):
     """  """
@@ -858,6 +1560,306 @@ def union(box0, box1):
   return Box2D(min_pt, max_pt)
 
 
+class BoxArray(object):
+  """ N axis-aligned boxes in D dimensions, stored as an N x 2 x D array of
+  (min_pt, max_pt) pairs """
+
+  def __init__(self, boxes):
+    """ constructor
+
+        Parameters
+        ----------
+        boxes : array_like
+          The (min_pt, max_pt) of each box. Shape = N x 2 x D
+    """
+    self.boxes = np.array(boxes, np.float64)
+    if self.boxes.ndim != 3 or self.boxes.shape[1] != 2:
+      raise ValueError('Expecting boxes of shape N x 2 x D')
+    # make sure max_pt >= min_pt in all dimensions
+    np.maximum(self.boxes[:, 1], self.boxes[:, 0], out=self.boxes[:, 1])
+
+  @classmethod
+  def from_min_max(cls, min_pts, max_pts):
+    """ construct from N x D arrays of minimum and maximum points """
+    return cls(np.stack((min_pts, max_pts), axis=1))
+
+  @classmethod
+  def from_boxes(cls, boxes):
+    """ construct from a list of AxisAlignedBox (e.g. Box2D) objects """
+    return cls([(box.min_pt, box.max_pt) for box in boxes])
+
+  @property
+  def min_pts(self):
+    return self.boxes[:, 0]
+
+  @property
+  def max_pts(self):
+    return self.boxes[:, 1]
+
+  def __len__(self):
+    return len(self.boxes)
+
+  def __getitem__(self, index):
+    """ a single box as a Box2D (or AxisAlignedBox if not 2-d), or a
+    BoxArray for slices, masks and index arrays """
+    if np.ndim(index) == 0 and not isinstance(index, slice):
+      box_class = Box2D if self.boxes.shape[2] == 2 else AxisAlignedBox
+      return box_class(self.boxes[index, 0].copy(), self.boxes[index, 1].copy())
+    return BoxArray(self.boxes[index])
+
+  def to_boxes(self):
+    """ return a list of Box2D (or AxisAlignedBox) objects """
+    return [self[i] for i in range(len(self))]
+
+  def area(self):
+    """ area (volume) of each box, 0 for degenerate boxes """
+    return _box_areas(self.boxes)
+
+  def centroids(self):
+    """ the centroid of each box. Shape = N x D """
+    return self.boxes.mean(axis=1)
+
+  def dims(self):
+    """ the dimensions of each box. Shape = N x D """
+    return self.boxes[:, 1] - self.boxes[:, 0]
+
+  def intersection(self, other):
+    """ elementwise intersection with other (a BoxArray of the same length,
+    or a single box) """
+    other = _as_box_array(other).boxes
+    return BoxArray(np.stack((np.maximum(self.boxes[:, 0], other[:, 0]),
+                              np.minimum(self.boxes[:, 1], other[:, 1])), axis=1))
+
+  def union(self, other):
+    """ elementwise union (bounding box) with other """
+    other = _as_box_array(other).boxes
+    return BoxArray(np.stack((np.minimum(self.boxes[:, 0], other[:, 0]),
+                              np.maximum(self.boxes[:, 1], other[:, 1])), axis=1))
+
+  def intersection_areas(self, other=None, chunk_size=4194304):
+    """ pairwise intersection areas
+
+        Parameters
+        ----------
+        other : BoxArray, optional
+          The M boxes to compare with. Default: self
+        chunk_size : int, optional
+          The approximate number of pairs computed at once
+
+        Returns
+        -------
+        array_like
+          The intersection areas. Shape = N x M
+    """
+    other = self if other is None else _as_box_array(other)
+    areas = np.empty((len(self), len(other)))
+    step = max(1, chunk_size // max(len(other), 1))
+    for start in range(0, len(self), step):
+      chunk = self.boxes[start:start + step]
+      out = areas[start:start + step]
+      out[:] = 1
+      for d in range(self.boxes.shape[2]):
+        widths = (np.minimum(chunk[:, 1, d, np.newaxis], other.boxes[:, 1, d]) -
+                  np.maximum(chunk[:, 0, d, np.newaxis], other.boxes[:, 0, d]))
+        out *= np.maximum(widths, 0)
+    return areas
+
+  def iou(self, other=None, chunk_size=4194304):
+    """ pairwise intersection over union
+
+        Parameters
+        ----------
+        other : BoxArray, optional
+          The M boxes to compare with. Default: self
+        chunk_size : int, optional
+          The approximate number of pairs computed at once
+
+        Returns
+        -------
+        array_like
+          The IoU of each pair, 0 if both boxes are empty. Shape = N x M
+    """
+    other = self if other is None else _as_box_array(other)
+    inter = self.intersection_areas(other, chunk_size)
+    union_areas = self.area()[:, np.newaxis] + other.area() - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return np.where(union_areas > 0, inter / union_areas, 0.0)
+
+  def non_max_suppression(self, scores, iou_thresh=0.5):
+    """ greedy non-maximum suppression
+
+        The overlapping pairs are found with a :class:`BoxIndex`, so only
+        those pairs are compared.
+
+        Parameters
+        ----------
+        scores : array_like
+          The score of each box
+        iou_thresh : float, optional
+          Boxes overlapping a higher scoring kept box with a larger IoU are
+          suppressed
+
+        Returns
+        -------
+        array_like
+          The indices of the kept boxes, in order of decreasing score
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    idx0, idx1 = BoxIndex(self).query_overlaps(self)
+    pairs = idx0 != idx1
+    idx0, idx1 = idx0[pairs], idx1[pairs]
+    inter = _box_areas(np.stack((np.maximum(self.boxes[idx0, 0], self.boxes[idx1, 0]),
+                                 np.minimum(self.boxes[idx0, 1], self.boxes[idx1, 1])),
+                                axis=1))
+    areas = self.area()
+    union_areas = areas[idx0] + areas[idx1] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+      iou = np.where(union_areas > 0, inter / union_areas, 0.0)
+    idx0, idx1 = idx0[iou > iou_thresh], idx1[iou > iou_thresh]
+    # the suppression neighbors of each box, in CSR form
+    neighbors = idx1[np.argsort(idx0, kind='stable')]
+    counts = np.bincount(idx0, minlength=len(self))
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    suppressed = np.zeros(len(self), bool)
+    keep = []
+    for i in order:
+      if suppressed[i]:
+        continue
+      keep.append(i)
+      suppressed[neighbors[starts[i]:ends[i]]] = True
+    return np.array(keep, np.intp)
+
+  def __str__(self):
+    return 'BoxArray: %d boxes' % len(self)
+
+  def __repr__(self):
+    return '%s(%s)' % (self.__class__, self.boxes)
+
+
+def _box_areas(boxes):
+  """ areas of a (..., 2, D) array of boxes, 0 if any dimension is <= 0 """
+  diff = boxes[..., 1, :] - boxes[..., 0, :]
+  return np.where((diff > 0).all(axis=-1), np.prod(diff, axis=-1), 0.0)
+
+
+def _boxes_overlap(boxes0, boxes1):
+  """ elementwise test of (..., 2, D) boxes for overlap, including touching """
+  return ((boxes0[..., 0, :] <= boxes1[..., 1, :]) &
+          (boxes0[..., 1, :] >= boxes1[..., 0, :])).all(axis=-1)
+
+
+def _as_box_array(boxes):
+  """ convert a single box (with min_pt, max_pt) or a list of them to a
+  BoxArray """
+  if isinstance(boxes, BoxArray):
+    return boxes
+  if isinstance(boxes, AxisAlignedBox):
+    return BoxArray(((boxes.min_pt, boxes.max_pt),))
+  return BoxArray.from_boxes(boxes)
+
+
+class BoxIndex(object):
+  """ A static R-tree over a BoxArray, bulk loaded with Sort-Tile-Recursive
+  packing on the first two dimensions, for window and overlap queries.
+
+  Boxes that only touch a query box count as overlapping it.
+  """
+
+  def __init__(self, boxes, node_capacity=16):
+    """ constructor
+
+        Parameters
+        ----------
+        boxes : BoxArray
+          The boxes to index
+        node_capacity : int, optional
+          The maximum number of children of each node
+    """
+    self.boxes = _as_box_array(boxes)
+    self.node_capacity = node_capacity
+    # order the leaves by STR: vertical slices sorted by x, each sorted by y
+    num_boxes = len(self.boxes)
+    centers = self.boxes.centroids()
+    num_leaves = -(-num_boxes // node_capacity)
+    slice_size = node_capacity * int(np.ceil(np.sqrt(num_leaves)))
+    by_x = np.argsort(centers[:, 0], kind='stable')
+    slice_ids = np.empty(num_boxes, np.intp)
+    slice_ids[by_x] = np.arange(num_boxes) // slice_size
+    y = centers[:, 1] if centers.shape[1] > 1 else centers[:, 0]
+    self.order = np.lexsort((y, slice_ids))
+
+    # levels[0] are the leaves: bounds of groups of node_capacity boxes.
+    # Each node's children are the contiguous entries of the level below.
+    self.levels = []
+    bounds = self.boxes.boxes[self.order]
+    while True:
+      starts = np.arange(0, len(bounds), node_capacity)
+      node_bounds = np.stack((np.minimum.reduceat(bounds[:, 0], starts, axis=0),
+                              np.maximum.reduceat(bounds[:, 1], starts, axis=0)),
+                             axis=1) if len(bounds) else np.zeros((0, 2, bounds.shape[2]))
+      self.levels.append(node_bounds)
+      if len(node_bounds) <= 1:
+        break
+      bounds = node_bounds
+    self.levels.reverse()
+
+  def _children(self, nodes, level):
+    """ the children of nodes at level (entries of level+1, or sorted box
+    positions below the leaves), and the position in nodes of each child's
+    parent """
+    num_below = (len(self.levels[level + 1]) if level + 1 < len(self.levels)
+                 else len(self.boxes))
+    starts = nodes * self.node_capacity
+    counts = np.minimum(starts + self.node_capacity, num_below) - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.arange(len(nodes)), counts), np.repeat(starts, counts) + offsets
+
+  def query_overlaps(self, query_boxes, chunk_size=4096):
+    """ find all (query, box) pairs that overlap
+
+        Parameters
+        ----------
+        query_boxes : BoxArray
+          The query boxes (or a single box)
+        chunk_size : int, optional
+          The number of queries processed at once
+
+        Returns
+        -------
+        array_like
+          The query indices
+        array_like
+          The indices of the overlapping boxes
+    """
+    query_boxes = _as_box_array(query_boxes).boxes
+    query_ids = []
+    box_ids = []
+    for start in range(0, len(query_boxes), chunk_size):
+      queries = query_boxes[start:start + chunk_size]
+      # (query, node) candidate pairs, refined one level at a time
+      if len(self.boxes) == 0:
+        break
+      q = np.arange(len(queries))
+      nodes = np.zeros(len(queries), np.intp)
+      for level, bounds in enumerate(self.levels):
+        hit = _boxes_overlap(queries[q], bounds[nodes])
+        parents, nodes = self._children(nodes[hit], level)
+        q = q[hit][parents]
+      entries = self.order[nodes]
+      hit = _boxes_overlap(queries[q], self.boxes.boxes[entries])
+      query_ids.append(q[hit] + start)
+      box_ids.append(entries[hit])
+    if not query_ids:
+      return np.zeros(0, np.intp), np.zeros(0, np.intp)
+    return np.concatenate(query_ids), np.concatenate(box_ids)
+
+  def query_window(self, box):
+    """ return the indices of the boxes overlapping a single query box """
+    _, box_ids = self.query_overlaps(box)
+    return np.sort(box_ids)
+
+
 def compute_bounding_box(pts):
   """ compute the bounding box of a list of points
 
@@ -1053,7 +2055,7 @@ def compute_2D_affine_xform(from_points, to_points):
 
   #conditioned points have mean zero, so translation is zero
   A = np.concatenate((fp_cond[:2],tp_cond[:2]), axis=0)
-  U,S,V = np.linalg.svd(A.T)
+  U,S,V = np.linalg.svd(A.T, full_matrices=False)
 
   #create B and C matrices as Hartley-Zisserman (2nd ed) p 130.
   tmp = V[:2].T
@@ -1067,3 +2069,189 @@ def compute_2D_affine_xform(from_points, to_points):
   H = np.dot(np.linalg.inv(C2),np.dot(H,C1))
 
   return H / H[2,2]
+
+
+def compute_2D_affine_xform_batch(from_points, to_points, mask=None):
+  """ batch version of :func:`compute_2D_affine_xform`: solve K independent
+  affine fits at once
+
+      Each fit uses the same conditioning and Gold Standard estimate as the
+      single version, with the SVD replaced by an eigen-decomposition of the
+      4x4 scatter matrix so that point sets can be masked.
+
+      Parameters
+      ----------
+      from_points : array_like
+        The From Points. Shape = K x N x 2
+      to_points : array_like
+        The To Points. to_points = H * from_points. Shape = K x N x 2
+      mask : array_like, optional
+        Which points take part in each fit (at least 3 per fit).
+        Shape = K x N
+
+      Returns
+      -------
+      array_like
+        The K transforms, of form [a b c; d e f; 0 0 1]. Shape = K x 3 x 3
+
+      Raises
+      ------
+      Exception
+        The number of points do not match
+  """
+  fp = np.asarray(from_points, np.float64)
+  tp = np.asarray(to_points, np.float64)
+  if fp.shape != tp.shape:
+    raise Exception('number of points do not match')
+  fp = fp.reshape((-1,) + fp.shape[-2:])
+  tp = tp.reshape(fp.shape)
+  if mask is None:
+    weights = np.ones(fp.shape[:2])
+  else:
+    weights = np.asarray(mask, np.float64).reshape(fp.shape[:2])
+  counts = weights.sum(axis=1)[:, np.newaxis]
+
+  #condition points: remove the means, and use the same scaling for both sets
+  m_from = np.einsum('kn,kni->ki', weights, fp) / counts
+  m_to = np.einsum('kn,kni->ki', weights, tp) / counts
+  fp_cond = fp - m_from[:, np.newaxis]
+  tp_cond = tp - m_to[:, np.newaxis]
+  maxstd = np.sqrt(np.max(np.einsum('kn,kni->ki', weights, fp_cond**2) / counts, axis=1))
+  A = np.concatenate((fp_cond, tp_cond), axis=2) / maxstd[:, np.newaxis, np.newaxis]
+
+  #the top 2 right singular vectors of A, as Hartley-Zisserman (2nd ed) p 130.
+  scatter = np.einsum('kn,kni,knj->kij', weights, A, A)
+  _, vecs = np.linalg.eigh(scatter)
+  B = vecs[:, 0:2, 2:4]
+  C = vecs[:, 2:4, 2:4]
+  M = np.matmul(C, np.linalg.pinv(B))
+
+  #decondition: the scaling cancels, leaving the translation between means
+  H = np.zeros((len(fp), 3, 3))
+  H[:, 0:2, 0:2] = M
+  H[:, 0:2, 2] = m_to - np.einsum('kij,kj->ki', M, m_from)
+  H[:, 2, 2] = 1
+  return H
+
+
+def _affine_from_3_points(from_points, to_points):
+  """ exact affine transforms from K minimal samples (K x 3 x 2). Returns the
+  K x 3 x 3 transforms and a mask of the non-degenerate samples """
+  X = np.concatenate((from_points, np.ones(from_points.shape[:2] + (1,))), axis=2)
+  det = np.linalg.det(X)
+  # collinear samples have no unique solution
+  scale = np.abs(from_points - from_points.mean(axis=1, keepdims=True)).max(axis=(1, 2))
+  valid = np.abs(det) > 1e-10 * np.maximum(scale, 1e-300)**2
+  X[~valid] = np.eye(3)
+  H = np.zeros((len(X), 3, 3))
+  H[:, 0:2, :] = np.linalg.solve(X, to_points).transpose(0, 2, 1)
+  H[:, 2, 2] = 1
+  return H, valid
+
+
+def _affine_residuals(H, from_points, to_points):
+  """ transfer errors |H from - to| of N points under each of K affines.
+  Shape = K x N """
+  mapped = np.matmul(from_points, H[:, 0:2, 0:2].transpose(0, 2, 1))
+  mapped += H[:, np.newaxis, 0:2, 2]
+  return np.sqrt(((mapped - to_points)**2).sum(axis=-1))
+
+
+def compute_2D_affine_xform_RANSAC(from_points, to_points, inlier_thresh=1.0,
+                                   max_draws=1000, confidence=0.99,
+                                   batch_size=64, method='MSAC',
+                                   chunk_size=1048576, rng=None):
+  """ robustly fit an affine transform to point correspondences
+
+      Minimal 3-point samples are drawn in batches, solved in closed form and
+      scored against all correspondences at once. Drawing stops adaptively,
+      as in :func:`fit_plane_3d_RANSAC`. The best hypothesis is refit to its
+      inliers with :func:`compute_2D_affine_xform`.
+
+      Parameters
+      ----------
+      from_points : array_like
+        The From Points. Shape = N x 2
+      to_points : array_like
+        The To Points. to_points = H * from_points. Shape = N x 2
+      inlier_thresh : float, optional
+        The largest transfer error of an inlier
+      max_draws : int, optional
+        The Maximum Number of Draws
+      confidence : float, optional
+        The desired probability of drawing at least one all-inlier sample
+      batch_size : int, optional
+        The number of hypotheses scored at once
+      method : str, optional
+        method should be one of {'RANSAC','MSAC'}
+          - RANSAC: maximize the number of inliers
+          - MSAC: minimize the sum of squared errors, truncated at
+            inlier_thresh
+      chunk_size : int, optional
+        The approximate number of residuals computed at once
+      rng : numpy.random.Generator or int, optional
+        The random generator, or a seed for one
+
+      Returns
+      -------
+      array_like
+        H is of form [a b c; d e f; 0 0 1], or None if no non-degenerate
+        sample was found
+      array_like
+        The inlier mask
+      array_like
+        The transfer error of each correspondence
+  """
+  if method not in ('RANSAC', 'MSAC'):
+    raise Exception('Unrecognized method string ' + method)
+  rng = np.random.default_rng(rng)
+  fp = np.asarray(from_points, np.float64).reshape(-1, 2)
+  tp = np.asarray(to_points, np.float64).reshape(-1, 2)
+  if fp.shape != tp.shape:
+    raise Exception('number of points do not match')
+  num_pts = len(fp)
+  if num_pts < 3:
+    raise Exception('at least 3 correspondences are needed')
+  thresh_sq = inlier_thresh**2
+
+  best_H = None
+  best_cost = np.inf
+  num_draws = 0
+  needed_draws = max_draws
+  while num_draws < needed_draws:
+    num_batch = min(batch_size, needed_draws - num_draws)
+    num_draws += num_batch
+    # samples with repeated points are degenerate, and rejected below
+    samples = rng.integers(0, num_pts, (num_batch, 3))
+    Hs, valid = _affine_from_3_points(fp[samples], tp[samples])
+    costs = np.zeros(num_batch)
+    step = max(1, chunk_size // num_batch)
+    for start in range(0, num_pts, step):
+      chunk = slice(start, start + step)
+      res_sq = _affine_residuals(Hs, fp[chunk], tp[chunk])**2
+      if method == 'MSAC':
+        costs += np.minimum(res_sq, thresh_sq).sum(axis=1)
+      else:
+        costs -= (res_sq < thresh_sq).sum(axis=1)
+    costs[~valid] = np.inf
+    best = np.argmin(costs)
+    if costs[best] < best_cost:
+      best_cost = costs[best]
+      best_H = Hs[best]
+      num_inliers = (_affine_residuals(best_H[np.newaxis], fp, tp)[0] < inlier_thresh).sum()
+      needed_draws = min(max_draws, num_draws + _ransac_num_draws(
+          num_inliers / float(num_pts), 3, confidence))
+
+  if best_H is None:
+    return None, np.zeros(num_pts, bool), np.full(num_pts, np.inf)
+  residuals = _affine_residuals(best_H[np.newaxis], fp, tp)[0]
+  inliers = residuals < inlier_thresh
+  if inliers.sum() >= 3:
+    H = compute_2D_affine_xform(fp[inliers], tp[inliers])
+    refit_residuals = _affine_residuals(H[np.newaxis], fp, tp)[0]
+    # keep the refit unless it loses inliers
+    if (refit_residuals < inlier_thresh).sum() >= inliers.sum():
+      best_H = H
+      residuals = refit_residuals
+      inliers = residuals < inlier_thresh
+  return best_H, inliers, residuals
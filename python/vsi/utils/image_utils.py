@@ -1,10 +1,7 @@
 """ A collection of utility functions related to Image data """
 import numpy as np
 import PIL.Image as Image
-try:
-  from itertools import izip
-except ImportError:
-  izip = zip
+import scipy.ndimage
 import scipy.ndimage.filters
 import skimage.transform
 
@@ -89,9 +86,15 @@ def rgb2gray(rgb):
   return gr.astype(rgb.dtype)
 
 
-def weighted_smooth(image, weights, pyramid_min_dim=50, convergence_thresh=0.01, max_its=1000):
+def weighted_smooth(image, weights, pyramid_min_dim=50, convergence_thresh=0.01,
+                    max_its=1000, method='fixed_point', return_info=False):
   """ smooth the values in image using a multi-scale regularization.
 
+  The result is the fixed point of
+  ``x = weights*image + (1-weights)*gaussian_filter(x)``, which is found
+  coarse to fine over an image pyramid, each level being initialized with the
+  upsampled result of the previous level.
+
   Parameters
   ----------
   image : array_like
@@ -100,14 +103,40 @@ def weighted_smooth(image, weights, pyramid_min_dim=50, convergence_thresh=0.01,
       weights should be the same dimensions as image, with values in range (0,1)
   pyramid_min_dim : array_like, optional
   convergence_thres : float, optional
-      The convergence threshold
+      The convergence threshold, on the largest change of a pixel value that
+      one more fixed-point iteration would make
   max_its : int, optional
+      The maximum number of iterations per level
+  method : str, optional
+      method should be one of {'fixed_point', 'krylov'}
+        - fixed_point: Repeat the fixed-point iteration until convergence.
+          Slow where the weights are small.
+        - krylov: Solve the equivalent (non-symmetric) linear system
+          ``x - (1-weights)*gaussian_filter(x) = weights*image`` with
+          BiCGSTAB in float32, using NumPy arrays only. Each iteration costs
+          two Gaussian filters, but far fewer iterations are needed.
+  return_info : bool, optional
+      If True, also return a dict with the number of iterations performed at
+      each level ('iterations', coarsest level first) and the largest
+      residual at the finest level ('residual')
 
   Returns
   -------
   numpy.array
       The smooth image
+  dict
+      The solver info. Only returned if return_info is True
   """
+  if method == 'krylov':
+    image_smooth, info = _weighted_smooth_krylov(image, weights,
+                                                 pyramid_min_dim,
+                                                 convergence_thresh, max_its)
+    if return_info:
+      return image_smooth, info
+    return image_smooth
+  elif method != 'fixed_point':
+    raise ValueError('Unrecognized method string ' + str(method))
+
   # create image pyramids
   image_py = [Image.fromarray(image),]
   weight_py = [Image.fromarray(weights),]
@@ -124,6 +153,7 @@ def weighted_smooth(image, weights, pyramid_min_dim=50, convergence_thresh=0.01,
   image_smooth_prev = np.array(image_py[num_levels-1])
   # traverse all levels of pyramid
   num_its = 0
+  level_its = []
   for l in reversed(range(num_levels)):
     weights_np = np.array(weight_py[l])
     for i in range(max_its):
@@ -138,13 +168,94 @@ def weighted_smooth(image, weights, pyramid_min_dim=50, convergence_thresh=0.01,
         break
       image_smooth_prev = image_smooth
     print('level %d: %d iterations' % (l,num_its))
+    level_its.append(num_its)
     # initialize next level with output from previous level
     if l > 0:
       image_smooth_prev_pil = Image.fromarray(image_smooth_prev)
       image_smooth_prev = np.array(image_smooth_prev_pil.resize(image_py[l-1].size))
+  if return_info:
+    return image_smooth, {'iterations': level_its, 'residual': maxdiff}
   return image_smooth
 
 
+def _weighted_smooth_krylov(image, weights, pyramid_min_dim, convergence_thresh,
+                            max_its):
+  """ coarse to fine BiCGSTAB solver for :func:`weighted_smooth` """
+  image_py = [np.asarray(image, np.float32)]
+  weight_py = [np.asarray(weights, np.float32)]
+  new_shape = (image_py[-1].shape[0] // 2, image_py[-1].shape[1] // 2)
+  while np.min(new_shape) > pyramid_min_dim:
+    image_py.append(_resize_float32(image_py[-1], new_shape))
+    weight_py.append(_resize_float32(weight_py[-1], new_shape))
+    new_shape = (image_py[-1].shape[0] // 2, image_py[-1].shape[1] // 2)
+
+  image_smooth = image_py[-1]
+  level_its = []
+  for image_level, weights_level in zip(reversed(image_py), reversed(weight_py)):
+    if image_smooth.shape != image_level.shape:
+      image_smooth = _resize_float32(image_smooth, image_level.shape)
+    one_minus_w = 1.0 - weights_level
+    def apply_A(x):
+      return x - one_minus_w * scipy.ndimage.gaussian_filter(x, sigma=1.0,
+                                                             mode='nearest')
+    image_smooth, num_its, residual = _bicgstab(
+        apply_A, weights_level * image_level, image_smooth,
+        convergence_thresh, max_its)
+    level_its.append(num_its)
+  return image_smooth, {'iterations': level_its, 'residual': residual}
+
+
+def _resize_float32(img, shape):
+  """ bilinear resize of a float image, without rescaling its values """
+  return skimage.transform.resize(img, shape, order=1, mode='edge',
+                                  preserve_range=True,
+                                  anti_aliasing=np.any(np.less(shape, img.shape))
+                                  ).astype(np.float32)
+
+
+def _bicgstab(apply_A, b, x0, convergence_thresh, max_its):
+  """ solve A x = b with the BiCGSTAB method, stopping once the largest
+  element of the residual is at most convergence_thresh.
+
+  Returns the solution, the number of iterations and the largest element of
+  the final (true) residual """
+  x = x0.copy()
+  r = b - apply_A(x)
+  r_hat = r.copy()
+  rho = alpha = omega = 1.0
+  v = np.zeros_like(x)
+  p = np.zeros_like(x)
+  num_its = 0
+  while num_its < max_its and np.abs(r).max() > convergence_thresh:
+    num_its += 1
+    rho_new = np.vdot(r_hat, r)
+    if rho_new == 0:
+      # breakdown: restart with the current residual
+      r_hat = r.copy()
+      rho_new = np.vdot(r_hat, r)
+      p[:] = 0
+      v[:] = 0
+    beta = (rho_new / rho) * (alpha / omega)
+    p = r + beta * (p - omega * v)
+    v = apply_A(p)
+    alpha = rho_new / np.vdot(r_hat, v)
+    s = r - alpha * v
+    if np.abs(s).max() <= convergence_thresh:
+      x += alpha * p
+      break
+    t = apply_A(s)
+    t_norm = np.vdot(t, t)
+    if t_norm == 0:
+      x += alpha * p
+      break
+    omega = np.vdot(t, s) / t_norm
+    x += alpha * p + omega * s
+    r = s - omega * t
+    rho = rho_new
+  residual = np.abs(b - apply_A(x)).max()
+  return x, num_its, residual
+
+
 def mutual_information(img1, img2, min_val, max_val, nbins):
   """ compute mutual information of img1 and img2
 
@@ -154,38 +265,109 @@ def mutual_information(img1, img2, min_val, max_val, nbins):
       The first image
   img2 : array_like
       The second image
-  min_val : array_like
-      The minimum of an array
-  max_val : array_like
-      The maximum value of an array along a given axis
-  nbins :
+  min_val : float
+      The value mapped to the bottom of the first bin. Smaller values are
+      counted in the first bin.
+  max_val : float
+      The value mapped to the top of the last bin. Larger values are counted
+      in the last bin.
+  nbins : int
+      The number of bins
 
   Returns
   -------
-  numpy.array
-      Mutual information of img1 and img2
+  float
+      Mutual information of img1 and img2, normalized by log(nbins). Pixels
+      that are NaN in either image are ignored.
   """
-  i1 = np.array(img1).ravel().astype('float')
-  i2 = np.array(img2).ravel().astype('float')
-  val_range = max_val - min_val
+  b1 = quantize_image(np.ravel(img1), nbins, min_val, max_val)
+  b2 = quantize_image(np.ravel(img2), nbins, min_val, max_val)
+  valid = (b1 >= 0) & (b2 >= 0)
 
   # fill in counts
-  b1 = ((i1 - min_val) / val_range * nbins).astype('int')
-  b2 = ((i2 - min_val) / val_range * nbins).astype('int')
-  counts = np.zeros((nbins,nbins))
-  for (v1,v2) in izip(b1,b2):
-    counts[v1,v2] += 1
-  total = float(len(i1))
+  counts = np.bincount(b1[valid] * nbins + b2[valid],
+                       minlength=nbins*nbins).reshape(nbins, nbins)
+  total = float(valid.sum())
   p0 = counts.sum(axis=0) / total
   p1 = counts.sum(axis=1) / total
   p01 = counts / total
-  ind_prob = np.tile(p0.reshape(1,nbins),(nbins,1)) * np.tile(p1.reshape(nbins,1),(1,nbins))
+  ind_prob = np.outer(p1, p0)
   # avoid divide by zero
-  zero_mask = (p01 == 0).astype('float')
-  p01_clean = p01 + zero_mask
-  ind_prob_clean = ind_prob + zero_mask
-  mi_matrix = p01 * np.log(p01_clean / ind_prob_clean)
-  return mi_matrix.sum() / np.log(nbins)
+  nonzero = p01 > 0
+  mi = (p01[nonzero] * np.log(p01[nonzero] / ind_prob[nonzero])).sum()
+  return mi / np.log(nbins)
+
+
+def _sum_xlogx(counts):
+  """ sum of c*log(c), with 0*log(0) = 0 """
+  return counts * np.log(np.maximum(counts, 1))
+
+
+def sliding_mutual_information(img1, img2, radius, nbins, min_val=None,
+                               max_val=None):
+  """ compute the mutual information of img1 and img2 in a window centered
+  around every pixel
+
+  The window histograms are computed with one summed-area table per
+  (occupied) pair of bins, one table at a time, so the cost per pixel does not
+  depend on radius and memory use is a few images worth.
+
+  Parameters
+  ----------
+  img1 : array_like
+      The first image
+  img2 : array_like
+      The second image
+  radius : int
+      The window radius. Windows are (2*radius+1) x (2*radius+1)
+  nbins : int
+      The number of bins
+  min_val : float, optional
+      The value mapped to the bottom of the first bin.
+      Default: The minimum of both images
+  max_val : float, optional
+      The value mapped to the top of the last bin.
+      Default: The maximum of both images
+
+  Returns
+  -------
+  numpy.array
+      The image of :func:`mutual_information` scores. Pixels closer than
+      radius to the border, or whose window contains no valid pixels, are NaN.
+  """
+  img1 = np.asarray(img1, np.float64)
+  img2 = np.asarray(img2, np.float64)
+  if img1.shape != img2.shape:
+    raise ValueError('Expecting img1 and img2 to have the same shape')
+  if min_val is None:
+    min_val = min(np.nanmin(img1), np.nanmin(img2))
+  if max_val is None:
+    max_val = max(np.nanmax(img1), np.nanmax(img2))
+
+  b1 = quantize_image(img1, nbins, min_val, max_val)
+  b2 = quantize_image(img2, nbins, min_val, max_val)
+  valid = (b1 >= 0) & (b2 >= 0)
+  joint = np.where(valid, b1 * nbins + b2, -1)
+  b1[~valid] = -1
+  b2[~valid] = -1
+
+  # N*MI = sum c_ij log c_ij - sum a_i log a_i - sum b_j log b_j + N log N
+  # where c is the joint histogram of the window, and a, b its marginals
+  num_pixels = _window_sums(integral_image(valid), radius).astype(np.float64)
+  weighted_log = _sum_xlogx(num_pixels)
+  occupied = np.flatnonzero(np.bincount(joint[valid], minlength=nbins*nbins))
+  for pair in occupied:
+    counts = _window_sums(integral_image(joint == pair), radius)
+    weighted_log += _sum_xlogx(counts)
+  for bins in (b1, b2):
+    for b in np.unique(bins[valid]):
+      counts = _window_sums(integral_image(bins == b), radius)
+      weighted_log -= _sum_xlogx(counts)
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mi = weighted_log / (num_pixels * np.log(nbins))
+  mi[num_pixels == 0] = np.nan
+  return _fill_interior(mi, img1.shape, radius)
 
 
 def normalized_cross_correlation(img1, img2):
@@ -216,6 +398,91 @@ def normalized_cross_correlation(img1, img2):
   return np.dot(i1, i2)
 
 
+def _normalize_patches(patches, dtype):
+  """ flatten a stack of patches, remove each patch's mean and scale it to
+  unit norm. Constant patches are left as zeros """
+  patches = np.asarray(patches)
+  flat = patches.reshape(len(patches), -1).astype(dtype)
+  flat -= flat.mean(axis=1, keepdims=True)
+  norms = np.sqrt(np.einsum('ij,ij->i', flat, flat))
+  norms[norms == 0] = 1
+  flat /= norms[:, np.newaxis]
+  return flat
+
+
+def normalized_cross_correlation_batch(patches1, patches2, dtype=np.float64,
+                                       chunk_size=65536):
+  """ compute the normalized cross correlation of corresponding patches
+
+  Equivalent to calling :func:`normalized_cross_correlation` on each pair.
+
+  Parameters
+  ----------
+  patches1 : array_like
+      The first stack of patches. Shape = (N, h, w) or (N, h, w, c)
+  patches2 : array_like
+      The second stack of patches, same shape as patches1
+  dtype : numpy.dtype, optional
+      The dtype used for computation. np.float32 halves memory use and
+      bandwidth. Default: np.float64
+  chunk_size : int, optional
+      The number of patch pairs processed at once, which bounds the size of
+      the temporary arrays
+
+  Returns
+  -------
+  numpy.array
+      The (N,) array of scores
+  """
+  patches1 = np.asarray(patches1)
+  patches2 = np.asarray(patches2)
+  if patches1.shape != patches2.shape:
+    raise ValueError('Expecting patches1 and patches2 to have the same shape')
+  num_patches = len(patches1)
+  scores = np.empty(num_patches, dtype)
+  for start in range(0, num_patches, chunk_size):
+    chunk = slice(start, start + chunk_size)
+    n1 = _normalize_patches(patches1[chunk], dtype)
+    n2 = _normalize_patches(patches2[chunk], dtype)
+    scores[chunk] = np.einsum('ij,ij->i', n1, n2)
+  return scores
+
+
+def normalized_cross_correlation_all_pairs(patches1, patches2,
+                                           dtype=np.float64, chunk_size=4096):
+  """ compute the normalized cross correlation of every patch in patches1
+  with every patch in patches2
+
+  Parameters
+  ----------
+  patches1 : array_like
+      The first stack of patches. Shape = (N, h, w) or (N, h, w, c)
+  patches2 : array_like
+      The second stack of patches. Shape = (M, h, w) or (M, h, w, c)
+  dtype : numpy.dtype, optional
+      The dtype used for computation. Default: np.float64
+  chunk_size : int, optional
+      The number of patches of patches1 processed at once
+
+  Returns
+  -------
+  numpy.array
+      The (N, M) matrix of scores
+  """
+  patches1 = np.asarray(patches1)
+  patches2 = np.asarray(patches2)
+  if patches1.shape[1:] != patches2.shape[1:]:
+    raise ValueError('Expecting patches1 and patches2 to have the same patch '
+                     'shape')
+  n2 = _normalize_patches(patches2, dtype)
+  num_patches = len(patches1)
+  scores = np.empty((num_patches, len(n2)), dtype)
+  for start in range(0, num_patches, chunk_size):
+    chunk = slice(start, start + chunk_size)
+    np.dot(_normalize_patches(patches1[chunk], dtype), n2.T, out=scores[chunk])
+  return scores
+
+
 def sample_point(image, pt):
   """ return the pixel value, or None if the point is outside image bounds
 
@@ -236,6 +503,39 @@ def sample_point(image, pt):
   return None
 
 
+def sample_points(image, pts, order=1, cval=np.nan, dtype=np.float64):
+  """ sample a numpy image at many (sub-pixel) points at once
+
+  Vectorized alternative to :func:`sample_point`, for numpy images.
+
+  Parameters
+  ----------
+  image : array_like
+      The image. Shape = (nr, nc) or (nr, nc, c)
+  pts : array_like
+      The (x, y) points. Shape = (N, 2)
+  order : int, optional
+      The spline interpolation order (0: nearest, 1: bilinear, 3: bicubic).
+      Default: 1
+  cval : float, optional
+      The value of points outside the image bounds. Default: NaN
+  dtype : numpy.dtype, optional
+      The output dtype. Default: np.float64
+
+  Returns
+  -------
+  numpy.array
+      The sampled values. Shape = (N,) or (N, c)
+  """
+  image = np.asarray(image)
+  pts = np.asarray(pts, np.float64).reshape(-1, 2)
+  coeffs = _spline_coefficients(image, order)
+  values = _interpolate(coeffs, pts[:, 1], pts[:, 0], order, cval, dtype)
+  if image.ndim == 2:
+    return values[:, 0]
+  return values
+
+
 def sample_patch(image, corners, patch_size, check_bounds=True):
   """ return an Image of size patch_size, or None if the patch is outside image
   bounds
@@ -398,6 +698,146 @@ def sample_patch_projective(image, inv_xform_3x3, patch_shape):
   return patch
 
 
+def _spline_coefficients(image, order):
+  """ return the 2-d image(s) to interpolate, one per channel, prefiltered
+  once for spline interpolation when order > 1 """
+  image = np.asarray(image)
+  if image.ndim == 2:
+    channels = [image]
+  else:
+    channels = [image[..., c] for c in range(image.shape[2])]
+  if order > 1:
+    channels = [scipy.ndimage.spline_filter(c, order=order, output=np.float64,
+                                            mode='nearest')
+                for c in channels]
+  return channels
+
+
+def _interpolate(coeffs, rows, cols, order, cval, dtype):
+  """ interpolate the prefiltered channels at (rows, cols). Points outside the
+  image (or with NaN coordinates) are set to cval. The channel dimension is
+  last """
+  img_shape = coeffs[0].shape
+  if order == 0:
+    # nearest neighbor sampling is valid up to half a pixel past the centers
+    inside = ((rows >= -0.5) & (rows < img_shape[0] - 0.5) &
+              (cols >= -0.5) & (cols < img_shape[1] - 0.5))
+  else:
+    inside = ((rows >= 0) & (rows <= img_shape[0] - 1) &
+              (cols >= 0) & (cols <= img_shape[1] - 1))
+  coords = np.stack((np.where(inside, rows, 0), np.where(inside, cols, 0)))
+  values = np.empty(rows.shape + (len(coeffs),), dtype)
+  for c, coeff in enumerate(coeffs):
+    # interpolate in floating point, whatever the image type
+    values[..., c] = scipy.ndimage.map_coordinates(coeff, coords,
+                                                   output=np.float64,
+                                                   order=order, mode='nearest',
+                                                   prefilter=False)
+  values[~inside] = cval
+  return values
+
+
+def sample_patch_projective_multi(image, inv_xforms_3x3, patch_shape, order=1,
+                                  cval=np.nan, dtype=np.float32,
+                                  max_chunk_pixels=2**22):
+  """ warp image with each of K homographies, returning a stack of patches
+
+  Unlike :func:`sample_patch_projective`, the image is never copied or
+  rescaled, any interpolation prefiltering is done once for all K
+  homographies, and the sampling is vectorized across the homographies.
+
+  Parameters
+  ----------
+  image : array_like
+      The image. Shape = (nr, nc) or (nr, nc, c)
+  inv_xforms_3x3 : array_like
+      Homogeneous transformation matrices mapping patch (x, y) coordinates to
+      image coordinates. Shape = (K, 3, 3)
+  patch_shape : array_like
+      The patch shape (rows, cols)
+  order : int, optional
+      The spline interpolation order (0: nearest, 1: bilinear, 3: bicubic).
+      Default: 1
+  cval : float, optional
+      The value of samples outside the image. Default: NaN
+  dtype : numpy.dtype, optional
+      The output dtype. Default: np.float32
+  max_chunk_pixels : int, optional
+      The maximum number of output pixels computed at once, which bounds the
+      size of the temporary coordinate arrays
+
+  Returns
+  -------
+  numpy.array
+      The stack of warped patches. Shape = (K, rows, cols) or
+      (K, rows, cols, c)
+  """
+  image = np.asarray(image)
+  inv_xforms_3x3 = np.asarray(inv_xforms_3x3, np.float64).reshape(-1, 3, 3)
+  num_xforms = len(inv_xforms_3x3)
+  nrows, ncols = int(patch_shape[0]), int(patch_shape[1])
+  num_pixels = nrows * ncols
+
+  ys, xs = np.mgrid[0:nrows, 0:ncols]
+  grid = np.stack((xs.ravel(), ys.ravel(), np.ones(num_pixels)))
+
+  coeffs = _spline_coefficients(image, order)
+  patches = np.empty((num_xforms, num_pixels, len(coeffs)), dtype)
+  chunk_size = max(1, max_chunk_pixels // max(num_pixels, 1))
+  for start in range(0, num_xforms, chunk_size):
+    chunk = slice(start, start + chunk_size)
+    src = np.matmul(inv_xforms_3x3[chunk], grid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      cols = src[:, 0] / src[:, 2]
+      rows = src[:, 1] / src[:, 2]
+    patches[chunk] = _interpolate(coeffs, rows, cols, order, cval, dtype)
+
+  out_shape = (num_xforms, nrows, ncols) + image.shape[2:]
+  return patches.reshape(out_shape)
+
+
+def sample_planes(image, camera, plane_origins, plane_xs, plane_ys, patch_shape,
+                  **kwargs):
+  """ sample a patch for each of K 3-d planes, e.g. for a plane sweep
+
+  Vectorized equivalent of calling :func:`sample_plane` for each plane.
+
+  Parameters
+  ----------
+  image : array_like
+      The image
+  camera : array_like
+      A PinholeCamera
+  plane_origins : array_like
+      3-d points corresponding to the upper left of the patches.
+      Shape = (K, 3)
+  plane_xs : array_like
+      3-d vectors from origin to extent of patch in the "x" direction.
+      Shape = (K, 3)
+  plane_ys : array_like
+      3-d vectors from origin to extent of patch in the "y" direction:
+      assumed perpendicular to plane_x. Shape = (K, 3)
+  patch_shape : array_like
+      The patch shape
+  **kwargs
+      Passed to :func:`sample_patch_projective_multi`
+
+  Returns
+  -------
+  numpy.array
+      The stack of sampled patches. Shape = (K, rows, cols[, c])
+  """
+  patch2imgs = []
+  for plane_origin, plane_x, plane_y in zip(plane_origins, plane_xs, plane_ys):
+    plane_xlen = np.linalg.norm(plane_x)
+    plane_ylen = np.linalg.norm(plane_y)
+    plane2image = camera.plane2image(np.asarray(plane_origin), plane_x, plane_y)
+    patch2plane = np.array(((plane_xlen/patch_shape[1], 0, 0),(0, plane_ylen/patch_shape[0], 0),(0,0,1)))
+    patch2imgs.append(np.dot(plane2image, patch2plane))
+  return sample_patch_projective_multi(image, np.reshape(patch2imgs, (-1, 3, 3)),
+                                       patch_shape, **kwargs)
+
+
 def sample_patch_perspective(image, inv_xform_3x3, patch_size):
   """ return an Image of size patch_size
 
@@ -423,3 +863,339 @@ def sample_patch_perspective(image, inv_xform_3x3, patch_size):
   mask = ones_img.transform(patch_size_tuple, Image.PERSPECTIVE, inv_xform_array, Image.NEAREST)
   return patch, mask
 
+
+
+def integral_image(img):
+  """ compute the summed-area table of img
+
+  Parameters
+  ----------
+  img : array_like
+      The image. Any leading dimensions are treated as independent images; the
+      table is accumulated over the last two axes.
+
+  Returns
+  -------
+  numpy.array
+      The summed-area table, with a leading row and column of zeros so that
+      ``table[..., y, x]`` is the sum of ``img[..., :y, :x]``
+  """
+  img = np.asarray(img)
+  acc_dtype = np.int64 if issubclass(img.dtype.type, (np.integer, np.bool_)) else np.float64
+  shape = img.shape[:-2] + (img.shape[-2] + 1, img.shape[-1] + 1)
+  table = np.zeros(shape, acc_dtype)
+  np.cumsum(img, axis=-2, dtype=acc_dtype, out=table[..., 1:, 1:])
+  np.cumsum(table[..., 1:, 1:], axis=-1, out=table[..., 1:, 1:])
+  return table
+
+
+def integral_histogram(img, num_bins, min_val=None, max_val=None):
+  """ compute one summed-area table per bin of the quantized image
+
+  The histogram of any window can then be computed in O(num_bins),
+  independently of the window size.
+
+  Parameters
+  ----------
+  img : array_like
+      The image. NaN pixels are not counted in any bin.
+  num_bins : int
+      The number of bins
+  min_val : float, optional
+      The value mapped to the bottom of the first bin. Default: nanmin(img)
+  max_val : float, optional
+      The value mapped to the top of the last bin. Default: nanmax(img)
+
+  Returns
+  -------
+  numpy.array
+      The integral histogram, of shape (num_bins, nrows+1, ncols+1)
+  """
+  img = np.asarray(img, np.float64)
+  if min_val is None:
+    min_val = np.nanmin(img)
+  if max_val is None:
+    max_val = np.nanmax(img)
+  bins = quantize_image(img, num_bins, min_val, max_val)
+
+  table = np.zeros((num_bins, img.shape[0] + 1, img.shape[1] + 1), np.int32)
+  for b in range(num_bins):
+    np.cumsum(bins == b, axis=0, dtype=np.int32, out=table[b, 1:, 1:])
+    np.cumsum(table[b, 1:, 1:], axis=1, out=table[b, 1:, 1:])
+  return table
+
+
+def quantize_image(img, num_bins, min_val, max_val):
+  """ map each pixel value to a bin index in [0, num_bins)
+
+  Values are clipped to the valid range of bins. NaN pixels are assigned the
+  index -1.
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  num_bins : int
+      The number of bins
+  min_val : float
+      The value mapped to the bottom of the first bin
+  max_val : float
+      The value mapped to the top of the last bin
+
+  Returns
+  -------
+  numpy.array
+      The bin index image, with dtype int32
+  """
+  img = np.asarray(img, np.float64)
+  val_range = float(max_val - min_val)
+  nan_mask = np.isnan(img)
+  if val_range > 0:
+    bins = (img - min_val) * (num_bins / val_range)
+  else:
+    bins = np.zeros_like(img)
+  bins[nan_mask] = 0
+  bins = np.clip(bins, 0, num_bins - 1).astype(np.int32)
+  bins[nan_mask] = -1
+  return bins
+
+
+def _window_sums(table, window_radius):
+  """ sum over each (2r+1)x(2r+1) window fully contained in the image, using
+  a summed-area table. The result covers only the valid interior pixels """
+  d = 2 * int(window_radius) + 1
+  return (table[..., d:, d:] - table[..., :-d, d:]
+          - table[..., d:, :-d] + table[..., :-d, :-d])
+
+
+def _fill_interior(interior, img_shape, window_radius, dtype=np.float32):
+  """ place the valid interior results in a full size image, with NaN along
+  the border where the window does not fit (mimicking the OpenCL kernels) """
+  r = int(window_radius)
+  result = np.full(img_shape, np.nan, dtype)
+  if img_shape[0] > 2 * r and img_shape[1] > 2 * r:
+    result[r:img_shape[0]-r, r:img_shape[1]-r] = interior
+  return result
+
+
+def local_sum(img, window_radius):
+  """ compute the sum of all pixels in an encompassing window. CPU
+  equivalent of :func:`vsi.utils.image_utils_ocl.local_sum`
+
+  Parameters
+  ----------
+  img : array_like
+      The image. NaN pixels are ignored.
+  window_radius : int
+      The window radius
+
+  Returns
+  -------
+  numpy.array
+      The sum of all pixels in an encompassing window. Pixels closer than
+      window_radius to the border are NaN.
+  """
+  img = np.asarray(img, np.float64)
+  table = integral_image(np.nan_to_num(img, nan=0.0))
+  return _fill_interior(_window_sums(table, window_radius), img.shape, window_radius)
+
+
+def sliding_SSD(img1, img2, window_radius):
+  """ perform sum of squared differences on a window centered around every
+  pixel. CPU equivalent of :func:`vsi.utils.image_utils_ocl.sliding_SSD`
+
+  Parameters
+  ----------
+  img1 : array_like
+      The first image
+  img2 : array_like
+      The second image
+  window_radius : int
+      The window radius
+
+  Returns
+  -------
+  numpy.array
+      The sum of squared differences image. Windows containing NaN, and
+      pixels closer than window_radius to the border, are NaN.
+  """
+  diff_sq = np.square(np.asarray(img1, np.float64) - np.asarray(img2, np.float64))
+  nan_mask = np.isnan(diff_sq)
+  ssd = _window_sums(integral_image(np.where(nan_mask, 0.0, diff_sq)), window_radius)
+  if nan_mask.any():
+    ssd[_window_sums(integral_image(nan_mask), window_radius) > 0] = np.nan
+  return _fill_interior(ssd, diff_sq.shape, window_radius)
+
+
+def _local_entropy_integral(int_hist, window_radius):
+  """ compute the (count weighted) local entropy from an integral histogram """
+  num_pixels = 0
+  weighted_log = 0
+  for table in int_hist:
+    counts = _window_sums(table, window_radius).astype(np.float64)
+    num_pixels = num_pixels + counts
+    weighted_log = weighted_log + counts * np.log2(np.maximum(counts, 1))
+  # N * sum_b -p_b log2(p_b) == N log2(N) - sum_b c_b log2(c_b)
+  return num_pixels * np.log2(np.maximum(num_pixels, 1)) - weighted_log
+
+
+def local_entropy(img, window_radius, num_bins=8):
+  """ compute local entropy using a sliding window. CPU equivalent of
+  :func:`vsi.utils.image_utils_ocl.local_entropy`
+
+  The window histograms are computed from an integral histogram, so the
+  cost per pixel is O(num_bins) regardless of window_radius.
+
+  Parameters
+  ----------
+  img : array_like
+      The image. NaN pixels are ignored.
+  window_radius : int
+      The window radius
+  num_bins : int
+      The number of bins
+
+  Returns
+  -------
+  numpy.array
+      The local entropy (in bits) multiplied by the number of valid pixels in
+      the window. Pixels closer than window_radius to the border are NaN.
+  """
+  img = np.asarray(img)
+  int_hist = integral_histogram(img, num_bins)
+  return _fill_interior(_local_entropy_integral(int_hist, window_radius),
+                        img.shape, window_radius)
+
+
+def compute_scale_image_entropy(img, entropy_thresh=100, num_bins=8):
+  """ compute local scale at each pixel in the image entropy_thresh as units
+  bits. CPU equivalent of
+  :func:`vsi.utils.image_utils_ocl.compute_scale_image_entropy`
+
+  A single integral histogram is shared by all of the window sizes.
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  entropy_thresh : int, optional
+      The entropy threshold
+  num_bins : int, optional
+      The number of bins
+
+  Returns
+  -------
+  numpy.array
+    The scale image
+  """
+  img = np.asarray(img)
+  num_levels = 7
+  window_rads = [2**l for l in range(num_levels)]
+  scale_img = np.zeros_like(img,dtype=np.uint8)
+  scale_img[:] = num_levels
+  int_hist = integral_histogram(img, num_bins)
+  for i in reversed(range(num_levels)):
+    ent = _fill_interior(_local_entropy_integral(int_hist, window_rads[i]),
+                         img.shape, window_rads[i])
+    scale_img[ent > entropy_thresh] = i
+  return scale_img
+
+
+def compute_scale_image(img, entropy_thresh=100, num_bins=8):
+  """ compute local scale at each pixel in the image entropy_thresh as units
+  bits. CPU equivalent of :func:`vsi.utils.image_utils_ocl.compute_scale_image`
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  entropy_thresh : int, optional
+      The entropy threshold
+  num_bins : int, optional
+      The number of bins
+
+  Returns
+  -------
+  numpy.array
+      The local scale at each pixel in the image entropy_thresh as units bits
+  """
+  return compute_scale_image_entropy(img, entropy_thresh, num_bins)
+
+
+def compute_scale_image_gradx(img, grad_sum_thresh=1.0):
+  """ compute local scale at each pixel based on the absolute gradient
+  (x component). CPU equivalent of
+  :func:`vsi.utils.image_utils_ocl.compute_scale_image_gradx`
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  grad_sum_thresh : float, optional
+      The gradient sum threshold
+
+  Returns
+  -------
+  numpy.array
+      The local scale at each pixel based on the absolute gradient
+  """
+  img = np.asarray(img)
+  num_levels = 7
+  window_radii = [2**l for l in range(num_levels)]
+  scale_img = np.zeros_like(img,dtype=np.uint8)
+  scale_img[:] = num_levels
+  _, gx = np.gradient(img)
+  table = integral_image(np.nan_to_num(np.abs(gx), nan=0.0))
+  for i in reversed(range(num_levels)):
+    gsum = _fill_interior(_window_sums(table, window_radii[i]), img.shape,
+                          window_radii[i])
+    scale_img[gsum > grad_sum_thresh] = i
+  return scale_img
+
+
+def _gaussian_pyramid(img, max_layer):
+  """ the levels of skimage.transform.pyramid_gaussian with nearest-edge
+  padding. Padding is done here, since scikit-image passes the same mode name
+  to both scipy.ndimage (which calls it 'nearest') and numpy.pad (which calls
+  it 'edge') """
+  layer = skimage.img_as_float(img)
+  levels = [layer]
+  for _ in range(max_layer):
+    out_shape = tuple(-(-d // 2) for d in layer.shape)
+    if out_shape == layer.shape:
+      break
+    # the sigma pyramid_gaussian uses for a downscale of 2
+    smoothed = scipy.ndimage.gaussian_filter(layer, sigma=2.0 / 3.0,
+                                             mode='nearest')
+    layer = skimage.transform.resize(smoothed, out_shape, order=1, mode='edge',
+                                     anti_aliasing=False)
+    levels.append(layer)
+  return levels
+
+
+def compute_scale_image_ssd(img, thresh=0.2):
+  """ compute local scale at each pixel in the image. CPU equivalent of
+  :func:`vsi.utils.image_utils_ocl.compute_scale_image_ssd`
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  thresh : float, optional
+      The threshold
+
+  Returns
+  -------
+  numpy.array
+      The scale image
+  """
+  num_levels = 6
+  scale_img = np.zeros_like(img,dtype=np.uint8)
+  levels = _gaussian_pyramid(img, num_levels)
+  num_levels = len(levels)
+  for i in range(1,num_levels):
+    lvl_img = skimage.transform.resize(levels[i],img.shape)
+    diff_img = sliding_SSD(img, lvl_img, window_radius=2**i)
+    prediction_good = diff_img < thresh
+    scale_img[prediction_good] = i
+  return scale_img
@@ -1,10 +1,32 @@
-""" A collection of GPGPU image processing utility functions """
+""" A collection of GPGPU image processing utility functions
 
+CPU implementations of local_sum, local_entropy, sliding_SSD and the
+compute_scale_image functions are available in :mod:`vsi.utils.image_utils`
+"""
+
+import collections
+import functools
 import numpy as np
 import pyopencl as cl
 import skimage.transform
 import os
 
+from vsi.utils import image_utils, ocl_utils
+
+
+@functools.lru_cache(maxsize=None)
+def _kernel_source(cl_name):
+  """ read the source of one of the kernels in the cl directory """
+  cl_filename = os.path.join(os.path.dirname(__file__), 'cl', cl_name + '.cl')
+  with open(cl_filename, 'r') as fd:
+    return fd.read()
+
+
+def _get_kernel(ocl_ctx, cl_name, kernel_name=None):
+  """ return the (cached) kernel kernel_name, built from cl/<cl_name>.cl """
+  program = ocl_utils.build_program(ocl_ctx, _kernel_source(cl_name))
+  return ocl_utils.get_kernel(program, kernel_name or cl_name)
+
 
 def NCC_score_image(ocl_ctx, images_and_masks, window_radius):
   """ compute a sliding NCC score based on a set of images with masks
@@ -23,7 +45,7 @@ def NCC_score_image(ocl_ctx, images_and_masks, window_radius):
       The score image
   """
 
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
 
   num_images = len(images_and_masks)
   img_dims = images_and_masks[0][0].size
@@ -42,16 +64,11 @@ def NCC_score_image(ocl_ctx, images_and_masks, window_radius):
   score_img = np.zeros((img_dims[1], img_dims[0]),np.float32)
   output_buff = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, score_img.nbytes)
 
-  cl_dir = os.path.dirname(__file__)
-  cl_filename = cl_dir + '/cl/NCC_score_multi.cl'
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.NCC_score_multi(cl_queue, (img_dims[1], img_dims[0]), None,
-                      image_buff, mask_buff, output_buff, np.int32(num_images),
-                      np.int32(img_dims[0]), np.int32(img_dims[1]), 
-                      np.int32(window_radius))
+  kernel = _get_kernel(ocl_ctx, 'NCC_score_multi')
+  kernel(cl_queue, (img_dims[1], img_dims[0]), None,
+         image_buff, mask_buff, output_buff, np.int32(num_images),
+         np.int32(img_dims[0]), np.int32(img_dims[1]),
+         np.int32(window_radius))
 
   cl.enqueue_copy(cl_queue, score_img, output_buff)
   cl_queue.finish()
@@ -78,7 +95,7 @@ def sliding_NCC(ocl_ctx, img1, img2, window_radius):
       The normalized cross-correllation image
   """
 
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
 
   img1_np = np.array(img1).astype(np.float32)
   img2_np = np.array(img2).astype(np.float32)
@@ -88,16 +105,11 @@ def sliding_NCC(ocl_ctx, img1, img2, window_radius):
   i2_buf = cl.Buffer(ocl_ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=img2_np)
   dest_buf = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, img1_np.nbytes)
 
-  cl_dir = os.path.dirname(__file__)
-  cl_filename = cl_dir + '/cl/sliding_ncc.cl'
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.sliding_ncc(cl_queue, img1_np.shape, None,
-                  i1_buf, i2_buf, dest_buf,
-                  np.int32(img1_np.shape[1]), np.int32(img1_np.shape[0]),
-                  np.int32(window_radius))
+  kernel = _get_kernel(ocl_ctx, 'sliding_ncc')
+  kernel(cl_queue, img1_np.shape, None,
+         i1_buf, i2_buf, dest_buf,
+         np.int32(img1_np.shape[1]), np.int32(img1_np.shape[0]),
+         np.int32(window_radius))
 
   ncc_img = np.zeros_like(img1_np)
   cl.enqueue_copy(cl_queue, ncc_img, dest_buf)
@@ -126,7 +138,7 @@ def sliding_SSD(ocl_ctx, img1, img2, window_radius):
       The sum of squared differences image
   """
 
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
 
   img1_np = np.array(img1).astype(np.float32)
   img2_np = np.array(img2).astype(np.float32)
@@ -136,16 +148,11 @@ def sliding_SSD(ocl_ctx, img1, img2, window_radius):
   i2_buf = cl.Buffer(ocl_ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=img2_np)
   dest_buf = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, img1_np.nbytes)
 
-  cl_dir = os.path.dirname(__file__)
-  cl_filename = cl_dir + '/cl/sliding_ssd.cl'
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.sliding_ssd(cl_queue, img1_np.shape, None,
-                  i1_buf, i2_buf, dest_buf,
-                  np.int32(img1_np.shape[1]), np.int32(img1_np.shape[0]),
-                  np.int32(window_radius))
+  kernel = _get_kernel(ocl_ctx, 'sliding_ssd')
+  kernel(cl_queue, img1_np.shape, None,
+         i1_buf, i2_buf, dest_buf,
+         np.int32(img1_np.shape[1]), np.int32(img1_np.shape[0]),
+         np.int32(window_radius))
 
   ssd_img = np.zeros_like(img1_np)
   cl.enqueue_copy(cl_queue, ssd_img, dest_buf)
@@ -186,7 +193,7 @@ def score_rectified_row(ocl_ctx, img1, img2, window_radius, row, method='NCC'):
   Exception
       When there is an unrecognized method string. Expecting 'NCC' or 'SSD'
   """
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
 
   img1_np = np.array(img1).astype(np.float32)
   img2_np = np.array(img2).astype(np.float32)
@@ -203,24 +210,20 @@ def score_rectified_row(ocl_ctx, img1, img2, window_radius, row, method='NCC'):
   score_img = np.zeros(output_shape, np.float32)
   dest_buf = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, score_img.nbytes)
 
-  cl_dir = os.path.dirname(__file__)
   if method == 'NCC':
-    cl_filename = cl_dir + '/cl/score_rectified_row_ncc.cl'
+    cl_name = 'score_rectified_row_ncc'
   elif method == 'SSD':
-    cl_filename = cl_dir + '/cl/score_rectified_row_ssd.cl'
+    cl_name = 'score_rectified_row_ssd'
   else:
     raise Exception('Unrecognized method string ' + method)
 
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.score_rectified_row(cl_queue, output_shape, None,
-                          i1_buf, i2_buf, dest_buf,
-                          np.int32(row), np.int32(nrows),
-                          np.int32(img1_np.shape[1]),
-                          np.int32(img2_np.shape[1]),
-                          np.int32(window_radius))
+  kernel = _get_kernel(ocl_ctx, cl_name, 'score_rectified_row')
+  kernel(cl_queue, output_shape, None,
+         i1_buf, i2_buf, dest_buf,
+         np.int32(row), np.int32(nrows),
+         np.int32(img1_np.shape[1]),
+         np.int32(img2_np.shape[1]),
+         np.int32(window_radius))
 
   cl.enqueue_copy(cl_queue, score_img, dest_buf)
   cl_queue.finish()
@@ -228,6 +231,232 @@ def score_rectified_row(ocl_ctx, img1, img2, window_radius, row, method='NCC'):
   return score_img
 
 
+class _PipelineSlot(object):
+  """ pinned host staging arrays and device buffers for one in-flight kernel
+  launch. Each slot has its own queue, so the transfers of one slot can
+  overlap with the kernel execution of another. """
+
+  def __init__(self, ocl_ctx, input_shapes, output_shape):
+    self.ocl_ctx = ocl_ctx
+    self.shapes = (input_shapes, output_shape)
+    self.queue = cl.CommandQueue(ocl_ctx)
+    self._pinned_buffers = []
+    mf = cl.mem_flags
+    self.host_inputs = [self._pinned_array(shape) for shape in input_shapes]
+    self.dev_inputs = [cl.Buffer(ocl_ctx, mf.READ_ONLY, host.nbytes)
+                       for host in self.host_inputs]
+    self.host_output = self._pinned_array(output_shape)
+    self.dev_output = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, self.host_output.nbytes)
+    self.output_shape = output_shape
+    self._done = None
+
+  def _pinned_array(self, shape):
+    """ allocate a float32 host array in page-locked memory """
+    nbytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+    buf = cl.Buffer(self.ocl_ctx,
+                    cl.mem_flags.READ_WRITE | cl.mem_flags.ALLOC_HOST_PTR,
+                    nbytes)
+    array, _ = cl.enqueue_map_buffer(self.queue, buf,
+                                     cl.map_flags.READ | cl.map_flags.WRITE,
+                                     0, shape, np.float32)
+    # the mapped array is only valid while the buffer is alive
+    self._pinned_buffers.append(buf)
+    return array
+
+  def submit(self, kernel, inputs, scalar_args):
+    """ enqueue upload, kernel and download without blocking """
+    for host, dev, img in zip(self.host_inputs, self.dev_inputs, inputs):
+      # converts to float32 while staging, no temporary copy
+      np.copyto(host, img, casting='unsafe')
+      cl.enqueue_copy(self.queue, dev, host, is_blocking=False)
+    kernel(self.queue, self.output_shape, None,
+           *self.dev_inputs, self.dev_output, *scalar_args)
+    self._done = cl.enqueue_copy(self.queue, self.host_output, self.dev_output,
+                                 is_blocking=False)
+
+  def result(self):
+    """ wait for the download to finish and return a copy of the output """
+    self._done.wait()
+    self._done = None
+    return self.host_output.copy()
+
+
+def _run_pipelined(ocl_ctx, kernel, jobs, num_buffers=2):
+  """ check the arguments and return the generator of :func:`_pipeline`.
+  Checking here, rather than in the generator, raises errors at the call
+  instead of at the first iteration """
+  if num_buffers < 1:
+    raise ValueError('num_buffers must be at least 1, got %s' % num_buffers)
+  return _pipeline(ocl_ctx, kernel, jobs, num_buffers)
+
+
+def _pipeline(ocl_ctx, kernel, jobs, num_buffers):
+  """ run kernel on each job, keeping up to num_buffers jobs in flight
+
+  Parameters
+  ----------
+  ocl_ctx :
+  kernel : pyopencl.Kernel
+      The kernel. Its arguments must be the input buffers, followed by the
+      output buffer, followed by scalar arguments.
+  jobs : iterable
+      (inputs, output_shape, scalar_args) tuples
+  num_buffers : int, optional
+      The number of sets of buffers to cycle through
+
+  Yields
+  ------
+  numpy.array
+      The output of each job, in order
+  """
+  slots = []
+  idle = []
+  in_flight = collections.deque()
+  for inputs, output_shape, scalar_args in jobs:
+    inputs = [np.asarray(img) for img in inputs]
+    shapes = (tuple(img.shape for img in inputs), tuple(output_shape))
+    if not slots or slots[0].shapes != shapes:
+      # new image size: finish outstanding work and reallocate the pool
+      while in_flight:
+        yield in_flight.popleft().result()
+      slots = [_PipelineSlot(ocl_ctx, *shapes) for _ in range(num_buffers)]
+      idle = list(slots)
+    if not idle:
+      slot = in_flight.popleft()
+      yield slot.result()
+      idle.append(slot)
+    slot = idle.pop()
+    slot.submit(kernel, inputs, scalar_args)
+    in_flight.append(slot)
+  while in_flight:
+    yield in_flight.popleft().result()
+
+
+def _sliding_batch(ocl_ctx, cl_name, image_pairs, window_radius, num_buffers):
+  """ pipelined version of the sliding_* functions """
+  kernel = _get_kernel(ocl_ctx, cl_name)
+  def jobs():
+    for img1, img2 in image_pairs:
+      img1 = np.asarray(img1)
+      yield ((img1, img2), img1.shape,
+             (np.int32(img1.shape[1]), np.int32(img1.shape[0]),
+              np.int32(window_radius)))
+  return _run_pipelined(ocl_ctx, kernel, jobs(), num_buffers)
+
+
+def sliding_NCC_batch(ocl_ctx, image_pairs, window_radius, num_buffers=2):
+  """ perform :func:`sliding_NCC` on each pair of images
+
+  Device buffers and pinned host buffers are reused for consecutive pairs of
+  the same size, and the upload, compute and download of consecutive pairs
+  are overlapped.
+
+  Parameters
+  ----------
+  ocl_ctx :
+  image_pairs : iterable
+      (img1, img2) pairs of images
+  window_radius : float
+      The window radius
+  num_buffers : int, optional
+      The number of pairs in flight at once. Default: 2 (double-buffering)
+
+  Yields
+  ------
+  numpy.array
+      The normalized cross-correllation image of each pair, in order
+
+  Raises
+  ------
+  ValueError
+      When num_buffers is less than 1
+  """
+  return _sliding_batch(ocl_ctx, 'sliding_ncc', image_pairs, window_radius,
+                        num_buffers)
+
+
+def sliding_SSD_batch(ocl_ctx, image_pairs, window_radius, num_buffers=2):
+  """ perform :func:`sliding_SSD` on each pair of images
+
+  See :func:`sliding_NCC_batch`
+
+  Parameters
+  ----------
+  ocl_ctx :
+  image_pairs : iterable
+      (img1, img2) pairs of images
+  window_radius : float
+      The window radius
+  num_buffers : int, optional
+      The number of pairs in flight at once. Default: 2 (double-buffering)
+
+  Yields
+  ------
+  numpy.array
+      The sum of squared differences image of each pair, in order
+
+  Raises
+  ------
+  ValueError
+      When num_buffers is less than 1
+  """
+  return _sliding_batch(ocl_ctx, 'sliding_ssd', image_pairs, window_radius,
+                        num_buffers)
+
+
+def score_rectified_row_batch(ocl_ctx, jobs, window_radius, method='NCC',
+                              num_buffers=2):
+  """ perform :func:`score_rectified_row` on each (img1, img2, row) triple
+
+  See :func:`sliding_NCC_batch`
+
+  Parameters
+  ----------
+  ocl_ctx :
+  jobs : iterable
+      (img1, img2, row) triples
+  window_radius : float
+      The window radius
+  method : str, optional
+      method should be one of {'NCC','SSD'}
+  num_buffers : int, optional
+      The number of jobs in flight at once. Default: 2 (double-buffering)
+
+  Yields
+  ------
+  numpy.array
+      The score matrix of each job, in order
+
+  Raises
+  ------
+  Exception
+      When there are different number of rows in the images
+  Exception
+      When there is an unrecognized method string. Expecting 'NCC' or 'SSD'
+  ValueError
+      When num_buffers is less than 1
+  """
+  if method == 'NCC':
+    cl_name = 'score_rectified_row_ncc'
+  elif method == 'SSD':
+    cl_name = 'score_rectified_row_ssd'
+  else:
+    raise Exception('Unrecognized method string ' + method)
+  kernel = _get_kernel(ocl_ctx, cl_name, 'score_rectified_row')
+
+  def kernel_jobs():
+    for img1, img2, row in jobs:
+      img1 = np.asarray(img1)
+      img2 = np.asarray(img2)
+      nrows = img1.shape[0]
+      if img2.shape[0] != nrows:
+        raise Exception('Expecting same number of rows in img1 and img2')
+      yield ((img1, img2), (img1.shape[1], img2.shape[1]),
+             (np.int32(row), np.int32(nrows), np.int32(img1.shape[1]),
+              np.int32(img2.shape[1]), np.int32(window_radius)))
+  return _run_pipelined(ocl_ctx, kernel, kernel_jobs(), num_buffers)
+
+
 def compute_scale_image_ssd(ocl_ctx, img, thresh=0.2):
   """ compute local scale at each pixel in the image
 
@@ -246,7 +475,7 @@ def compute_scale_image_ssd(ocl_ctx, img, thresh=0.2):
   """
   num_levels = 6
   scale_img = np.zeros_like(img,dtype=np.uint8)
-  levels = [lvl for lvl in skimage.transform.pyramid_gaussian(img, max_layer=num_levels, mode='nearest' )]
+  levels = image_utils._gaussian_pyramid(img, num_levels)
   num_levels = len(levels)
   for i in range(1,num_levels):
     lvl_img = skimage.transform.resize(levels[i],img.shape)
@@ -362,20 +591,16 @@ def local_sum(ocl_ctx, img, window_radius):
       The sum of all pixels in an encompassing window
   """
   mf = cl.mem_flags
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
   img_np = np.array(img).astype(np.float32)
   img_buf = cl.Buffer(ocl_ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=img_np)
   sum_img = np.zeros_like(img,dtype=np.float32)
   dest_buf = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, sum_img.nbytes)
-  cl_dir = os.path.dirname(__file__)
-  cl_filename = cl_dir + '/cl/local_sum.cl'
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.local_sum(cl_queue, sum_img.shape, None,
-                img_buf, dest_buf,
-                np.int32(img.shape[1]), np.int32(img.shape[0]),
-                np.int32(window_radius))
+  kernel = _get_kernel(ocl_ctx, 'local_sum')
+  kernel(cl_queue, sum_img.shape, None,
+         img_buf, dest_buf,
+         np.int32(img.shape[1]), np.int32(img.shape[0]),
+         np.int32(window_radius))
 
   cl.enqueue_copy(cl_queue, sum_img, dest_buf)
   cl_queue.finish()
@@ -402,23 +627,19 @@ def local_entropy(ocl_ctx, img, window_radius, num_bins=8):
       The local entropy using a sliding window
   """
   mf = cl.mem_flags
-  cl_queue = cl.CommandQueue(ocl_ctx)
+  cl_queue = ocl_utils.get_command_queue(ocl_ctx)
   img_np = np.array(img).astype(np.float32)
   img_buf = cl.Buffer(ocl_ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=img_np)
   min_val = np.nanmin(img)
   max_val = np.nanmax(img)
   entropy = np.zeros_like(img,dtype=np.float32)
   dest_buf = cl.Buffer(ocl_ctx, mf.WRITE_ONLY, entropy.nbytes)
-  cl_dir = os.path.dirname(__file__)
-  cl_filename = cl_dir + '/cl/local_entropy.cl'
-  with open(cl_filename, 'r') as fd:
-    clstr = fd.read()
-  prg = cl.Program(ocl_ctx, clstr).build()
-  prg.local_entropy(cl_queue, entropy.shape, None,
-                    img_buf, dest_buf,
-                    np.int32(img.shape[1]), np.int32(img.shape[0]),
-                    np.int32(window_radius), np.int32(num_bins),
-                    np.float32(min_val), np.float32(max_val))
+  kernel = _get_kernel(ocl_ctx, 'local_entropy')
+  kernel(cl_queue, entropy.shape, None,
+         img_buf, dest_buf,
+         np.int32(img.shape[1]), np.int32(img.shape[0]),
+         np.int32(window_radius), np.int32(num_bins),
+         np.float32(min_val), np.float32(max_val))
 
   cl.enqueue_copy(cl_queue, entropy, dest_buf)
   cl_queue.finish()
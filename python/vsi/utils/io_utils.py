@@ -276,9 +276,10 @@ def read_vsfm_nvm_file(filename):
         T[ti] = float(next(tokgen))
       cam_center = np.dot(-R.transpose(),T)
     else:
+      # the quaternion is stored in (w, x, y, z) order, as quaternion_to_matrix
+      # expects
       q = np.zeros(4)
-      q[3] = float(next(tokgen))
-      for qi in range(3):
+      for qi in range(4):
         q[qi] = float(next(tokgen))
       R = geometry_utils.quaternion_to_matrix(q)
       cam_center = np.zeros(3)
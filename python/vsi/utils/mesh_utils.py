@@ -1,9 +1,87 @@
 """ Utility functions related to mesh processing """
+import itertools
+
 import numpy as np
 
 
-def save_point_cloud_ply(output_fname, pts, normals=None, colors=None):
-    """ Save a 3D point cloud in PLY acii format
+def _vertex_dtype(normals=False, colors=False):
+    """ The little-endian structured dtype of PLY vertices, in the property
+    order used by the writers """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if normals:
+        fields += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+    if colors:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    return np.dtype(fields)
+
+
+def _vertex_array(pts, normals=None, colors=None):
+    """ Pack points, normals and colors into one structured array """
+    pts = np.asarray(pts).reshape(-1, 3)
+    vertices = np.empty(len(pts), _vertex_dtype(normals is not None, colors is not None))
+    vertices['x'] = pts[:, 0]
+    vertices['y'] = pts[:, 1]
+    vertices['z'] = pts[:, 2]
+    if normals is not None:
+        normals = np.asarray(normals).reshape(-1, 3)
+        vertices['nx'] = normals[:, 0]
+        vertices['ny'] = normals[:, 1]
+        vertices['nz'] = normals[:, 2]
+    if colors is not None:
+        colors = np.asarray(colors).reshape(-1, 3)
+        vertices['red'] = colors[:, 0]
+        vertices['green'] = colors[:, 1]
+        vertices['blue'] = colors[:, 2]
+    return vertices
+
+
+def _ply_header(vertex_dtype, num_verts, num_faces, binary, face_property=True,
+                count_width=0):
+    """ Return the PLY header for vertices of vertex_dtype (a structured
+    dtype), optionally followed by a face element. The vertex count is
+    zero-padded to count_width digits, so it can be patched in place """
+    type_names = {'<f4': 'float', '|u1': 'uint8'}
+    lines = ['ply',
+             'format binary_little_endian 1.0' if binary else 'format ascii 1.0',
+             'element vertex %0*d' % (count_width, num_verts)]
+    for name in vertex_dtype.names:
+        lines.append('property %s %s' % (type_names[vertex_dtype[name].str], name))
+    lines.append('element face %d' % num_faces)
+    if face_property:
+        lines.append('property list uchar int vertex_index')
+    lines.append('end_header')
+    return '\n'.join(lines) + '\n'
+
+
+def _face_bytes(faces):
+    """ Pack faces as a uchar vertex count followed by int32 indices, the
+    binary_little_endian layout of 'property list uchar int vertex_index' """
+    if len(faces) == 0:
+        return b''
+    if isinstance(faces, np.ndarray) and faces.ndim == 2:
+        # all faces have the same number of vertices
+        face_dtype = np.dtype([('count', 'u1'), ('vertex_index', '<i4', (faces.shape[1],))])
+        packed = np.empty(len(faces), face_dtype)
+        packed['count'] = faces.shape[1]
+        packed['vertex_index'] = faces
+        return packed.tobytes()
+    counts = np.array([len(face) for face in faces], np.int64)
+    if len(counts) and counts.min() == counts.max():
+        return _face_bytes(np.array(faces).reshape(len(counts), -1))
+    indices = np.concatenate([np.asarray(face) for face in faces]).astype('<i4')
+    # each face takes 1 + 4 * count bytes
+    face_offsets = np.concatenate(([0], np.cumsum(1 + 4 * counts)))
+    index_offsets = np.concatenate(([0], np.cumsum(counts)))[:-1]
+    buf = np.empty(face_offsets[-1], np.uint8)
+    buf[face_offsets[:-1]] = counts
+    byte_pos = (np.repeat(face_offsets[:-1] + 1 - 4 * index_offsets, 4 * counts)
+                + np.arange(4 * index_offsets[-1] + 4 * counts[-1]))
+    buf[byte_pos] = indices.view(np.uint8)
+    return buf.tobytes()
+
+
+def save_point_cloud_ply(output_fname, pts, normals=None, colors=None, binary=True):
+    """ Save a 3D point cloud in PLY format
 
     Parameters
     ----------
@@ -15,29 +93,29 @@ def save_point_cloud_ply(output_fname, pts, normals=None, colors=None):
         The 3D normals. Shape = Nx3 (optional)
     colors : array_like
         RGB colors of points.  Shape = Nx3 (optional)
+    binary : bool
+        Write binary_little_endian (the default) rather than ascii. The
+        binary body is written with a single call, from a structured array.
+        The default used to be ascii; pass binary=False to keep writing
+        ascii files.
 
     """
     num_pts = len(pts)
+    if normals is not None:
+        assert len(normals) == num_pts, "different number of points and normals"
+    if colors is not None:
+        assert len(colors) == num_pts, "different number of points and colors"
+
+    if binary:
+        vertices = _vertex_array(pts, normals, colors)
+        with open(output_fname, 'wb') as fd:
+            fd.write(_ply_header(vertices.dtype, num_pts, 0, True, False).encode('ascii'))
+            vertices.tofile(fd)
+        return
 
     with open(output_fname, 'w') as fd:
-        fd.write('ply\n')
-        fd.write('format ascii 1.0\n')
-        fd.write('element vertex %d\n' % num_pts)
-        fd.write('property float x\n')
-        fd.write('property float y\n')
-        fd.write('property float z\n')
-        if normals is not None:
-            assert len(normals) == num_pts, "different number of points and normals"
-            fd.write('property float nx\n')
-            fd.write('property float ny\n')
-            fd.write('property float nz\n')
-        if colors is not None:
-            assert len(colors) == num_pts, "different number of points and colors"
-            fd.write('property uint8 red\n')
-            fd.write('property uint8 green\n')
-            fd.write('property uint8 blue\n')
-        fd.write('element face 0\n')
-        fd.write('end_header\n')
+        fd.write(_ply_header(_vertex_dtype(normals is not None, colors is not None),
+                             num_pts, 0, False, False))
 
         pt_strs = [f'{pt[0]:0.3f} {pt[1]:0.3f} {pt[2]:0.3f}' for pt in pts]
 
@@ -55,8 +133,8 @@ def save_point_cloud_ply(output_fname, pts, normals=None, colors=None):
             fd.write(f"{pt_str} {n_str} {c_str}\n")
 
 
-def save_mesh_ply(output_fname, verts, faces, vert_colors=None):
-    """ Save a polygonal mesh in ascii PLY format
+def save_mesh_ply(output_fname, verts, faces, vert_colors=None, binary=True):
+    """ Save a polygonal mesh in PLY format
 
     Parameters
     ----------
@@ -67,33 +145,37 @@ def save_mesh_ply(output_fname, verts, faces, vert_colors=None):
     faces : array_like
         Faces of the mesh.
         Shape = NxV, where V is the number of vertices per face.
+        (or a list of faces with varying numbers of vertices)
     vert_colors : array_like
         Per-vertex RGB colors.
         Shape = Nx3
+    binary : bool
+        Write binary_little_endian (the default) rather than ascii. Each
+        element block is written with a single call.
+        The default used to be ascii; pass binary=False to keep writing
+        ascii files.
     """
     num_verts = len(verts)
     num_faces = len(faces)
+    if vert_colors is not None:
+        assert len(vert_colors) == num_verts, "different number of vertices and colors"
+
+    if binary:
+        vertices = _vertex_array(verts, colors=vert_colors)
+        with open(output_fname, 'wb') as fd:
+            fd.write(_ply_header(vertices.dtype, num_verts, num_faces, True).encode('ascii'))
+            vertices.tofile(fd)
+            fd.write(_face_bytes(faces))
+        return
 
     with open(output_fname, 'w') as fd:
-        fd.write('ply\n')
-        fd.write('format ascii 1.0\n')
-        fd.write(f'element vertex {num_verts}\n')
-        fd.write('property float x\n')
-        fd.write('property float y\n')
-        fd.write('property float z\n')
-        if vert_colors is not None:
-            fd.write('property uint8 red\n')
-            fd.write('property uint8 green\n')
-            fd.write('property uint8 blue\n')
-        fd.write(f'element face {num_faces}\n')
-        fd.write('property list uchar int vertex_index\n')
-        fd.write('end_header\n')
+        fd.write(_ply_header(_vertex_dtype(colors=vert_colors is not None),
+                             num_verts, num_faces, False))
 
         if vert_colors is None:
             for vert in verts:
                 fd.write(f'{vert[0]} {vert[1]} {vert[2]}\n')
         else:
-            assert len(vert_colors) == num_verts, "different number of vertices and colors"
             for vert,c in zip(verts, vert_colors):
                 fd.write(f'{vert[0]} {vert[1]} {vert[2]} {c[0]} {c[1]} {c[2]}\n')
 
@@ -101,6 +183,549 @@ def save_mesh_ply(output_fname, verts, faces, vert_colors=None):
             fd.write(' '.join([f"{len(face)}",] + [f"{face[i]}" for i in range(len(face))]) + '\n')
 
 
+class PlyStreamWriter(object):
+    """ Write a binary PLY point cloud in batches, without holding all of
+    the points in memory
+
+    The header is written up front with a fixed-width vertex count, which
+    is patched when the writer is closed. The running bounds of the points
+    written so far are available as bbox_min and bbox_max, e.g. for
+    :func:`vsi.utils.generate_scene_xml_from_ply.generate_scene_xml_from_bbox`.
+
+    Parameters
+    ----------
+    output_fname : str
+        Filename to save to
+    normals : bool
+        Every batch includes normals
+    colors : bool
+        Every batch includes RGB colors
+
+    Examples
+    --------
+    >>> with PlyStreamWriter('cloud.ply', colors=True) as writer:
+    ...     for pts, colors in batches:
+    ...         writer.write(pts, colors=colors)
+    """
+
+    count_width = 20
+
+    def __init__(self, output_fname, normals=False, colors=False):
+        self.output_fname = output_fname
+        self.vertex_dtype = _vertex_dtype(normals, colors)
+        self.num_points = 0
+        self.bbox_min = None
+        self.bbox_max = None
+        self._fd = open(output_fname, 'wb')
+        header = _ply_header(self.vertex_dtype, 0, 0, True, False,
+                             self.count_width).encode('ascii')
+        self._count_offset = header.index(b'element vertex ') + len(b'element vertex ')
+        self._fd.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, pts, normals=None, colors=None):
+        """ Append a batch of points
+
+        Parameters
+        ----------
+        pts : array_like
+            The 3D points. Shape = Nx3
+        normals : array_like
+            The 3D normals. Shape = Nx3 (required if the writer has normals)
+        colors : array_like
+            RGB colors of points.  Shape = Nx3 (required if the writer has
+            colors)
+        """
+        if self._fd is None:
+            raise ValueError('write to a closed PlyStreamWriter')
+        names = self.vertex_dtype.names
+        if ('nx' in names) != (normals is not None):
+            raise ValueError('normals must be given if and only if the writer has normals')
+        if ('red' in names) != (colors is not None):
+            raise ValueError('colors must be given if and only if the writer has colors')
+        num_pts = len(pts)
+        if normals is not None:
+            assert len(normals) == num_pts, "different number of points and normals"
+        if colors is not None:
+            assert len(colors) == num_pts, "different number of points and colors"
+        vertices = _vertex_array(pts, normals, colors)
+        if len(vertices) == 0:
+            return
+        vertices.tofile(self._fd)
+        self.num_points += len(vertices)
+
+        # bounds of the float32 values actually written
+        batch_min = np.array([vertices[c].min() for c in 'xyz'], np.float32)
+        batch_max = np.array([vertices[c].max() for c in 'xyz'], np.float32)
+        if self.bbox_min is None:
+            self.bbox_min, self.bbox_max = batch_min, batch_max
+        else:
+            self.bbox_min = np.minimum(self.bbox_min, batch_min)
+            self.bbox_max = np.maximum(self.bbox_max, batch_max)
+
+    def close(self):
+        """ Patch the vertex count into the header and close the file """
+        if self._fd is None:
+            return
+        self._fd.seek(self._count_offset)
+        self._fd.write(b'%0*d' % (self.count_width, self.num_points))
+        self._fd.close()
+        self._fd = None
+
+
+# PLY property type names (both spellings) and their numpy type codes
+_PLY_TYPES = {'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+              'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+              'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+              'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'}
+
+
+def read_ply_header(filename):
+    """ Parse the header of a PLY file
+
+    Parameters
+    ----------
+    filename : str
+        The PLY file
+
+    Returns
+    -------
+    str
+        The format: 'ascii', 'binary_little_endian' or 'binary_big_endian'
+    list
+        (name, count, properties) of each element, where properties is a
+        list of (name, type code) for scalar properties and
+        (name, (count type code, item type code)) for list properties
+    int
+        The size of the header in bytes
+    """
+    with open(filename, 'rb') as fd:
+        if fd.readline().strip() != b'ply':
+            raise ValueError('%s is not a PLY file' % filename)
+        fmt = None
+        elements = []
+        while True:
+            line = fd.readline()
+            if not line:
+                raise ValueError('%s: no end_header' % filename)
+            tokens = line.decode('ascii').split()
+            if not tokens or tokens[0] in ('comment', 'obj_info'):
+                continue
+            if tokens[0] == 'end_header':
+                break
+            if tokens[0] == 'format':
+                fmt = tokens[1]
+            elif tokens[0] == 'element':
+                elements.append((tokens[1], int(tokens[2]), []))
+            elif tokens[0] == 'property':
+                if tokens[1] == 'list':
+                    elements[-1][2].append((tokens[4], (_PLY_TYPES[tokens[2]],
+                                                        _PLY_TYPES[tokens[3]])))
+                else:
+                    elements[-1][2].append((tokens[2], _PLY_TYPES[tokens[1]]))
+        header_size = fd.tell()
+    if fmt not in ('ascii', 'binary_little_endian', 'binary_big_endian'):
+        raise ValueError('%s: unsupported PLY format %s' % (filename, fmt))
+    return fmt, elements, header_size
+
+
+def read_ply(filename, properties=None, mmap=True, elements=None):
+    """ Read the elements of a PLY file as structured arrays
+
+    Binary elements with only scalar properties, and list elements whose
+    lists all have the same length (e.g. triangle faces), are returned as
+    zero-copy numpy.memmap views of the file. Lists of varying length are
+    returned as object arrays. ASCII bodies are parsed in bulk with
+    numpy.loadtxt.
+
+    Parameters
+    ----------
+    filename : str
+        The PLY file
+    properties : dict, optional
+        The properties to return for each element, e.g.
+        ``{'vertex': ('x', 'y', 'z')}``. Elements not in the dict are
+        returned in full. For ASCII files, only these columns are parsed.
+    mmap : bool
+        Memory map binary elements. Otherwise they are read into memory.
+    elements : list, optional
+        The names of the elements to return. Default: all of them. The file
+        is not read past the last of these elements, and the elements before
+        it are skipped without being parsed where possible. E.g. ``('vertex',)``
+        returns the vertices without reading the faces that follow them.
+
+    Returns
+    -------
+    dict
+        The structured array of each element, by element name. The two kinds
+        of list property have different fields: a list whose length is the
+        same in every record is returned as a ``<name>_count`` field plus a
+        ``<name>`` subarray field, while lists of varying length are returned
+        as a single ``<name>`` field of object arrays.
+    """
+    fmt, all_elements, offset = read_ply_header(filename)
+    properties = {} if properties is None else properties
+    if elements is not None:
+        wanted = set(elements)
+        missing = wanted - set(name for name, _, _ in all_elements)
+        if missing:
+            raise ValueError('%s has no element %s' % (filename, ', '.join(sorted(missing))))
+        # nothing past the last wanted element needs to be read
+        last = max(i for i, (name, _, _) in enumerate(all_elements) if name in wanted)
+        all_elements = all_elements[0:last + 1]
+    else:
+        wanted = set(name for name, _, _ in all_elements)
+    result = {}
+    if fmt == 'ascii':
+        with open(filename, 'rb') as fd:
+            fd.seek(offset)
+            for name, count, props in all_elements:
+                lines = itertools.islice(fd, count)
+                if name not in wanted:
+                    for _ in lines:
+                        pass
+                    continue
+                result[name] = _read_ply_ascii_element(lines, count, props,
+                                                       properties.get(name))
+        return result
+
+    byte_order = '<' if fmt == 'binary_little_endian' else '>'
+    for name, count, props in all_elements:
+        data, nbytes = _read_ply_binary_element(filename, offset, count, props,
+                                                byte_order, mmap,
+                                                skip=name not in wanted)
+        if name in wanted:
+            if name in properties:
+                data = data[list(properties[name])]
+            result[name] = data
+        offset += nbytes
+    return result
+
+
+def _scalar_dtype(props, byte_order):
+    """ The record dtype of scalar properties """
+    return np.dtype([(name, byte_order + code) for name, code in props])
+
+
+def _read_ply_binary_element(filename, offset, count, props, byte_order, mmap,
+                             skip=False):
+    """ Map (or read) a binary element. Returns the array (None if skip) and
+    its size in bytes
+
+    List properties are mapped with the lengths of the first record, and
+    the count of every record is checked against them. Elements that fail
+    the check are read by :func:`_read_ply_binary_ragged` """
+    def load(dtype, shape):
+        if mmap:
+            if shape == 0:
+                return np.zeros(0, dtype)
+            return np.memmap(filename, dtype, mode='r', offset=offset, shape=shape)
+        with open(filename, 'rb') as fd:
+            fd.seek(offset)
+            return np.fromfile(fd, dtype, count=shape)
+
+    lists = [(name, codes) for name, codes in props if isinstance(codes, tuple)]
+    if not lists:
+        dtype = _scalar_dtype(props, byte_order)
+        if skip:
+            return None, count * dtype.itemsize
+        return load(dtype, count), count * dtype.itemsize
+
+    # guess that every list has the length of the one in the first record.
+    # The guess is right if every record's count matches it, since records
+    # of the guessed size then line up exactly
+    fields = []
+    with open(filename, 'rb') as fd:
+        fd.seek(offset)
+        for name, codes in props:
+            if isinstance(codes, tuple):
+                count_dtype = np.dtype(byte_order + codes[0])
+                item_dtype = np.dtype(byte_order + codes[1])
+                length = 0
+                if count:
+                    count_bytes = fd.read(count_dtype.itemsize)
+                    if len(count_bytes) < count_dtype.itemsize:
+                        raise ValueError('%s: element extends past the end of the file'
+                                         % filename)
+                    length = int(np.frombuffer(count_bytes, count_dtype)[0])
+                    fd.seek(length * item_dtype.itemsize, 1)
+                fields += [(name + '_count', count_dtype),
+                           (name, item_dtype, (length,))]
+            else:
+                fields.append((name, byte_order + codes))
+                fd.seek(np.dtype(codes).itemsize, 1)
+        file_size = fd.seek(0, 2)
+    dtype = np.dtype(fields)
+    end = offset + count * dtype.itemsize
+    if end <= file_size:
+        data = load(dtype, count)
+        uniform = all((data[name + '_count'] == dtype[name].shape[0]).all()
+                      for name, _ in lists)
+        if uniform:
+            return None if skip else data, count * dtype.itemsize
+    return _read_ply_binary_ragged(filename, offset, count, props, byte_order,
+                                   skip)
+
+
+def _gather(buf, positions, dtype):
+    """ Read one value of dtype at each (unaligned) byte position of buf """
+    dtype = np.dtype(dtype)
+    if dtype.itemsize == 1:
+        return buf[positions].view(dtype)
+    byte_idx = positions[:, np.newaxis] + np.arange(dtype.itemsize)
+    return np.ascontiguousarray(buf[byte_idx]).view(dtype).ravel()
+
+
+def _record_ends(buf, starts, props, byte_order, list_offsets=None):
+    """ Walk the properties of records starting at each of starts, returning
+    where each record ends. The (offset, count) of each list property are
+    appended to list_offsets, if given """
+    pos = starts.copy()
+    for _, codes in props:
+        if isinstance(codes, tuple):
+            count_dtype = np.dtype(byte_order + codes[0])
+            item_size = np.dtype(codes[1]).itemsize
+            counts = _gather(buf, np.minimum(pos, len(buf) - 8), count_dtype)
+            pos += count_dtype.itemsize
+            if list_offsets is not None:
+                list_offsets.append((pos.copy(), counts))
+            # clip, so garbage counts cannot overflow the positions
+            step = np.minimum(counts.astype(np.int64) * item_size, len(buf))
+            pos += step.astype(pos.dtype)
+            np.minimum(pos, len(buf), out=pos)
+        else:
+            pos += np.dtype(codes).itemsize
+    return pos
+
+
+def _scan_records(buf, starts, ends, props, byte_order):
+    """ Step through the records from each of starts until reaching ends,
+    all lanes at once. Returns the record starts visited, shape
+    (steps, lanes) and padded with the exit position of each lane, and the
+    exit positions """
+    pos = starts.copy()
+    rows = [pos.copy()]
+    active = np.flatnonzero(pos < ends)
+    while len(active):
+        pos[active] = _record_ends(buf, pos[active], props, byte_order)
+        active = active[pos[active] < ends[active]]
+        rows.append(pos.copy())
+    return np.array(rows), pos
+
+
+def _record_starts(buf, num_bytes, count, props, byte_order, chunk_size=4096):
+    """ Find the start offsets of the first count records in buf
+
+    The buffer is split into chunks, which are parsed speculatively in
+    lockstep, each from its first byte. A parse that starts in the middle
+    of a record quickly lands on a true record start, after which it
+    follows the true records. A chunk is correct once the last record of
+    the previous chunk ends at one of its record starts. Chunks where that
+    fails are parsed again from there, until all chunks are correct. """
+    index_dtype = np.int32 if num_bytes < 2**31 - 2**20 else np.int64
+    chunk_starts = np.arange(0, num_bytes, chunk_size, dtype=index_dtype)
+    chunk_ends = np.minimum(chunk_starts + chunk_size, num_bytes)
+    paths, exits = _scan_records(buf, chunk_starts, chunk_ends, props, byte_order)
+    while True:
+        prev_exits = np.concatenate(([0], exits[:-1])).astype(index_dtype)
+        synced = (paths == prev_exits).any(axis=0)
+        # each correct chunk follows the true records from where the
+        # previous one ends. Bytes past the element need not sync
+        correct = np.logical_and.accumulate(synced)
+        records = (paths >= prev_exits) & (paths < chunk_ends) & correct
+        if correct.all() or np.count_nonzero(records) >= count:
+            break
+        # rescan from where the previous chunk ends. At least the first
+        # chunk that is out of sync is then correct
+        redo = np.flatnonzero(~synced)
+        redo_paths, exits[redo] = _scan_records(buf, prev_exits[redo],
+                                                chunk_ends[redo], props,
+                                                byte_order)
+        if len(redo_paths) > len(paths):
+            # pad with the exit positions, as _scan_records does
+            padding = np.repeat(paths[-1:], len(redo_paths) - len(paths), axis=0)
+            paths = np.concatenate((paths, padding))
+        paths[:, redo] = exits[redo]
+        paths[0:len(redo_paths), redo] = redo_paths
+    starts = paths.T[records.T]
+    if len(starts) < count:
+        raise ValueError('element extends past the end of the file')
+    return starts[0:count]
+
+
+def _read_ply_binary_ragged(filename, offset, count, props, byte_order,
+                            skip=False):
+    """ Read an element with lists of varying length. The records are
+    located with :func:`_record_starts`, then each property is gathered
+    for all records at once. If skip, only the size of the element is
+    found, and None is returned for the array """
+    fields = [(name, object if isinstance(codes, tuple) else byte_order + codes)
+              for name, codes in props]
+    data = np.empty(count, fields)
+    if count == 0:
+        return data, 0
+
+    # an upper bound on the size of the element, when the counts are small
+    max_record = 0
+    for _, codes in props:
+        if isinstance(codes, tuple):
+            count_dtype = np.dtype(codes[0])
+            if count_dtype.itemsize > 2:
+                max_record = None
+                break
+            max_record += (count_dtype.itemsize + np.iinfo(count_dtype).max
+                           * np.dtype(codes[1]).itemsize)
+        else:
+            max_record += np.dtype(codes).itemsize
+    with open(filename, 'rb') as fd:
+        fd.seek(offset)
+        size = -1 if max_record is None else count * max_record
+        # zero padding keeps reads past the end inside the buffer
+        buf = np.frombuffer(fd.read(size) + bytes(8), np.uint8)
+    num_bytes = len(buf) - 8
+    try:
+        starts = _record_starts(buf, num_bytes, count, props, byte_order)
+    except ValueError as e:
+        raise ValueError('%s: %s' % (filename, e))
+
+    list_offsets = []
+    ends = _record_ends(buf, starts, props, byte_order, list_offsets)
+    if ends[-1] > num_bytes:
+        raise ValueError('%s: element extends past the end of the file' % filename)
+    if skip:
+        return None, int(ends[-1])
+    list_offsets = iter(list_offsets)
+    pos = starts
+    for name, codes in props:
+        if isinstance(codes, tuple):
+            item_dtype = np.dtype(byte_order + codes[1])
+            list_starts, counts = next(list_offsets)
+            counts = counts.astype(np.int64)
+            # the bytes of all lists, concatenated
+            byte_counts = counts * item_dtype.itemsize
+            first = np.cumsum(byte_counts) - byte_counts
+            byte_idx = (np.repeat(list_starts - first, byte_counts)
+                        + np.arange(byte_counts.sum()))
+            items = buf[byte_idx].view(item_dtype)
+            bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+            data[name] = np.fromiter((items[a:b] for a, b in zip(bounds[:-1], bounds[1:])),
+                                     object, count)
+            pos = list_starts + byte_counts
+        else:
+            item_dtype = np.dtype(byte_order + codes)
+            data[name] = _gather(buf, pos, item_dtype)
+            pos = pos + item_dtype.itemsize
+    return data, int(ends[-1])
+
+
+def _read_ply_ascii_element(lines, count, props, subset):
+    """ Parse count lines of an ascii element in bulk """
+    lists = [name for name, codes in props if isinstance(codes, tuple)]
+    if count == 0:
+        # the same fields as an empty binary element
+        fields = []
+        for name, codes in props:
+            if isinstance(codes, tuple):
+                fields += [(name + '_count', codes[0]), (name, codes[1], (0,))]
+            else:
+                fields.append((name, codes))
+        data = np.empty(0, fields)
+        if subset is not None:
+            return data[list(subset)]
+        return data
+    if not lists:
+        names = [name for name, _ in props]
+        wanted = names if subset is None else list(subset)
+        columns = [names.index(name) for name in wanted]
+        dtype = np.dtype([(name, codes) for name, codes in props if name in wanted])
+        values = np.loadtxt(lines, dtype=np.float64, usecols=columns, ndmin=2)
+        if len(values) < count:
+            raise ValueError('element ends early, after %d of %d lines'
+                             % (len(values), count))
+        data = np.empty(count, dtype)
+        for column, name in enumerate(wanted):
+            data[name] = values[:, column]
+        return data
+
+    lines = list(lines)
+    if len(lines) < count:
+        raise ValueError('element ends early, after %d of %d lines'
+                         % (len(lines), count))
+    if len(props) == 1:
+        # a single list property, e.g. faces: uniform lists parse as a matrix
+        name, (count_code, item_code) = props[0]
+        try:
+            values = np.loadtxt(lines, dtype=np.int64, ndmin=2)
+        except ValueError:
+            values = None
+        if values is not None and (values[:, 0] == values.shape[1] - 1).all():
+            data = np.empty(count, [(name + '_count', count_code),
+                                    (name, item_code, (values.shape[1] - 1,))])
+            data[name + '_count'] = values[:, 0]
+            data[name] = values[:, 1:]
+            return data
+    fields = [(name, object if isinstance(codes, tuple) else codes)
+              for name, codes in props]
+    data = np.empty(count, fields)
+    for i, line in enumerate(lines):
+        tokens = line.split()
+        for name, codes in props:
+            if isinstance(codes, tuple):
+                length = int(tokens[0])
+                data[name][i] = np.array(tokens[1:length + 1], codes[1])
+                tokens = tokens[length + 1:]
+            else:
+                data[name][i] = tokens[0]
+                tokens = tokens[1:]
+    if subset is not None:
+        return data[list(subset)]
+    return data
+
+
+def get_ply_vertices(filename):
+    """ Read the vertex positions of a PLY file, without loading any other
+    vertex properties or the elements that follow the vertices
+
+    Parameters
+    ----------
+    filename : str
+        The PLY file
+
+    Returns
+    -------
+    numpy.array
+        The vertices. Shape = 3xN
+    """
+    vertices = read_ply(filename, properties={'vertex': ('x', 'y', 'z')},
+                        elements=('vertex',))['vertex']
+    return np.vstack((vertices['x'], vertices['y'], vertices['z']))
+
+
+def get_mesh_vertices(filename):
+    """ Read the vertex positions of a PLY or OBJ mesh file
+
+    Parameters
+    ----------
+    filename : str
+        The mesh file
+
+    Returns
+    -------
+    numpy.array
+        The vertices. Shape = 3xN
+    """
+    if filename.lower().endswith('.obj'):
+        with open(filename) as fd:
+            lines = (line[2:] for line in fd if line.startswith('v '))
+            return np.loadtxt(lines, usecols=(0, 1, 2), ndmin=2).T
+    return get_ply_vertices(filename)
+
+
 def save_cameras_ply(filename, cam_Ks, cam_Rs, cam_Ts, img_sizes, scale=1.0):
     """ Save perspective cameras as meshes in ascii PLY format for visualization
     Note that all input lists should have equal length
@@ -1,6 +1,28 @@
 """ OpenCL-related utility functions and classes """
+import hashlib
+import os
+import tempfile
+import threading
+
 import pyopencl as cl
 
+import logging
+logger = logging.getLogger(__name__)
+
+
+#: Default directory for the on-disk cache of compiled program binaries, used
+#: when ``cache_dir`` is not passed to :func:`build_program`. Initialized from
+#: the ``VSI_OCL_BINARY_CACHE_DIR`` environment variable; None disables the
+#: on-disk cache.
+binary_cache_dir = os.environ.get('VSI_OCL_BINARY_CACHE_DIR') or None
+
+# Programs, per-thread kernels and command queues, keyed on their context.
+# These keep the contexts alive; see clear_caches()
+_cache_lock = threading.RLock()
+_program_cache = {}
+_kernel_cache = {}
+_queue_cache = {}
+
 
 def init_ocl(device_string=None, platform_idx=0, device_idx=0, verbose=False):
   """ create an OpenCL context using a device whose name matches device_string
@@ -55,3 +77,179 @@ def init_ocl(device_string=None, platform_idx=0, device_idx=0, verbose=False):
   return ctx
 
 
+def get_command_queue(ocl_ctx, device=None, properties=0):
+  """ return a command queue for the context, creating it on first use
+
+  Parameters
+  ----------
+  ocl_ctx : pyopencl.Context
+      The context
+  device : pyopencl.Device, optional
+      The device. Default: the first device of the context
+  properties : int, optional
+      ``pyopencl.command_queue_properties`` flags. Default: 0
+
+  Returns
+  -------
+  pyopencl.CommandQueue
+      A queue shared by all callers asking for the same context, device and
+      properties
+  """
+  key = (ocl_ctx, device, properties)
+  with _cache_lock:
+    queue = _queue_cache.get(key)
+    if queue is None:
+      queue = cl.CommandQueue(ocl_ctx, device=device, properties=properties)
+      _queue_cache[key] = queue
+  return queue
+
+
+def _binary_cache_filename(cache_dir, device, source_hash, options):
+  """ name of the cached binary of a program built for device """
+  key = '\n'.join((device.platform.name, device.platform.version,
+                   device.name, device.version, device.driver_version,
+                   source_hash) + tuple(options))
+  return os.path.join(cache_dir,
+                      hashlib.sha256(key.encode('utf-8')).hexdigest() + '.bin')
+
+
+def _load_program_binaries(ocl_ctx, devices, filenames, options):
+  """ build a program from cached binaries, or return None on a cache miss """
+  if not all(os.path.isfile(filename) for filename in filenames):
+    return None
+  try:
+    binaries = []
+    for filename in filenames:
+      with open(filename, 'rb') as fid:
+        binaries.append(fid.read())
+    return cl.Program(ocl_ctx, devices, binaries).build(options=list(options))
+  except (OSError, cl.Error) as e:
+    # stale or corrupt cache entry, fall back to compiling the source
+    logger.warning('Ignoring cached OpenCL program binaries: %s', e)
+    return None
+
+
+def _save_program_binaries(program, filenames):
+  """ write the binaries of a built program to the on-disk cache """
+  devices = program.get_info(cl.program_info.DEVICES)
+  binaries = program.get_info(cl.program_info.BINARIES)
+  binaries = dict(zip(devices, binaries))
+  for device, filename in filenames.items():
+    try:
+      os.makedirs(os.path.dirname(filename), exist_ok=True)
+      # write to a temporary file first, so concurrent processes never see a
+      # partially written binary
+      with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename),
+                                       delete=False) as fid:
+        try:
+          fid.write(binaries[device])
+        except OSError:
+          fid.close()
+          os.remove(fid.name)
+          raise
+      try:
+        os.replace(fid.name, filename)
+      except OSError:
+        os.remove(fid.name)
+        raise
+    except OSError as e:
+      logger.warning('Unable to cache OpenCL program binary %s: %s',
+                     filename, e)
+
+
+def build_program(ocl_ctx, source, options=(), cache_dir=None):
+  """ build an OpenCL program, reusing previously built programs
+
+  Programs are cached in memory, keyed on the context, its devices, a hash of
+  the source and the build options. If an on-disk cache directory is given
+  (or :data:`binary_cache_dir` is set), the compiled binaries are also stored
+  there, so that new processes can skip compilation.
+
+  Parameters
+  ----------
+  ocl_ctx : pyopencl.Context
+      The context
+  source : str
+      The OpenCL C source code
+  options : list, optional
+      The build options
+  cache_dir : str, optional
+      The on-disk binary cache directory. Default: :data:`binary_cache_dir`
+
+  Returns
+  -------
+  pyopencl.Program
+      The built program
+  """
+  options = tuple(options)
+  devices = tuple(ocl_ctx.devices)
+  source_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()
+  key = (ocl_ctx, devices, source_hash, options)
+
+  with _cache_lock:
+    program = _program_cache.get(key)
+    if program is not None:
+      return program
+
+    if cache_dir is None:
+      cache_dir = binary_cache_dir
+
+    program = None
+    if cache_dir is not None:
+      filenames = {dev: _binary_cache_filename(cache_dir, dev, source_hash, options)
+                   for dev in devices}
+      program = _load_program_binaries(ocl_ctx, devices,
+                                       [filenames[dev] for dev in devices],
+                                       options)
+
+    if program is None:
+      program = cl.Program(ocl_ctx, source).build(options=list(options))
+      if cache_dir is not None:
+        _save_program_binaries(program, filenames)
+
+    _program_cache[key] = program
+  return program
+
+
+def get_kernel(program, kernel_name):
+  """ return the named kernel of a program, creating it on first use
+
+  Unlike ``getattr(program, kernel_name)``, repeated calls from the same
+  thread return the same :class:`pyopencl.Kernel` instead of creating a new
+  one. Kernel arguments are stored on the kernel object, so each thread gets
+  its own kernel, and two threads never race on setting the arguments and
+  enqueueing.
+
+  Parameters
+  ----------
+  program : pyopencl.Program
+      The built program
+  kernel_name : str
+      The name of the kernel function
+
+  Returns
+  -------
+  pyopencl.Kernel
+      The kernel
+  """
+  key = (program, kernel_name, threading.get_ident())
+  with _cache_lock:
+    kernel = _kernel_cache.get(key)
+    if kernel is None:
+      kernel = cl.Kernel(program, kernel_name)
+      _kernel_cache[key] = kernel
+  return kernel
+
+
+def clear_caches():
+  """ release all cached programs, kernels and command queues. The on-disk
+  binary cache is not modified
+
+  The in-memory caches hold references to every context they have seen,
+  so contexts (and their device memory) are never freed while cached.
+  Long-running processes that create and discard contexts should call this
+  once they are done with a context. """
+  with _cache_lock:
+    _kernel_cache.clear()
+    _program_cache.clear()
+    _queue_cache.clear()
@@ -0,0 +1,659 @@
+""" Dense stereo matching on the CPU
+
+The stages, each usable on its own, are:
+
+1. :func:`rectify_images` warps a pair of images with the rectifying
+   homographies from :mod:`vsi.utils.stereo_utils` (and
+   :func:`rectified_cameras` gives the matching cameras)
+2. :func:`compute_cost_volume` scores every disparity in a range with NCC,
+   SSD or census costs, using integral images for the window sums
+3. :func:`semi_global_matching` aggregates the costs along 4 or 8 paths
+4. :func:`select_disparity` picks the best disparity with sub-pixel
+   refinement, and :func:`left_right_check` removes inconsistent matches
+
+:class:`Rectifier` performs stage 1 repeatedly for a fixed rig, e.g. on video.
+:func:`compute_disparity` runs stages 2-4 over tiles of rows in a thread
+pool, so that memory is bounded by tile size times the disparity range. The
+resulting disparity image can be passed to
+:func:`vsi.utils.stereo_utils.disparity_to_depth` with the rectified cameras.
+"""
+import concurrent.futures
+
+import numpy as np
+import scipy.ndimage
+
+import vsi.utils.camera_utils as camera_utils
+import vsi.utils.image_utils as image_utils
+
+
+def rectify_images(img0, img1, H0, H1, rect_shape0, rect_shape1, order=1):
+  """ warp a pair of images with rectifying homographies
+
+  Parameters
+  ----------
+  img0 : array_like
+      The first image
+  img1 : array_like
+      The second image
+  H0 : array_like
+      The 3x3 homography mapping img0 to its rectified image
+  H1 : array_like
+      The 3x3 homography mapping img1 to its rectified image
+  rect_shape0 : array_like
+      The rectified image shape (rows, cols) of img0
+  rect_shape1 : array_like
+      The rectified image shape (rows, cols) of img1
+  order : int, optional
+      The spline interpolation order. Default: 1 (bilinear)
+
+  Returns
+  -------
+  numpy.array
+      The rectified images, float32 with NaN outside the source images
+  """
+  rect0 = image_utils.sample_patch_projective_multi(
+      img0, np.linalg.inv(H0)[np.newaxis], rect_shape0, order=order)[0]
+  rect1 = image_utils.sample_patch_projective_multi(
+      img1, np.linalg.inv(H1)[np.newaxis], rect_shape1, order=order)[0]
+  return rect0, rect1
+
+
+def rectified_cameras(cam0, cam1, H0, H1):
+  """ return the cameras of images rectified with H0 and H1
+
+  Parameters
+  ----------
+  cam0 :
+      The first camera (anything with a 3x4 ``P`` attribute)
+  cam1 :
+      The second camera
+  H0 : array_like
+      The 3x3 rectifying homography of the first image
+  H1 : array_like
+      The 3x3 rectifying homography of the second image
+
+  Returns
+  -------
+  vsi.utils.camera_utils.ProjectiveCamera
+      The rectified cameras
+  """
+  return (camera_utils.ProjectiveCamera(np.dot(H0, cam0.P)),
+          camera_utils.ProjectiveCamera(np.dot(H1, cam1.P)))
+
+
+class Rectifier(object):
+  """ Rectifies a sequence of image pairs from a fixed stereo rig
+
+  The source coordinates of every rectified pixel are computed once, so that
+  rectifying each frame pair costs only the interpolation.
+
+  Attributes
+  ----------
+  maps : tuple
+      The float32 (row, col) source coordinates of each rectified image.
+      Shape = (rows, cols, 2)
+  valid_masks : tuple
+      True for the rectified pixels whose source is inside the image
+
+  The worker threads are created once and reused for every frame. Call
+  :meth:`close`, or use the rectifier as a context manager, to shut them
+  down.
+  """
+  def __init__(self, H0, H1, rect_shape0, rect_shape1, img0_shape, img1_shape,
+               order=1, chunk_rows=128, num_threads=None):
+    """ Parameters
+        ----------
+        H0 : array_like
+            The 3x3 homography mapping img0 to its rectified image
+        H1 : array_like
+            The 3x3 homography mapping img1 to its rectified image
+        rect_shape0 : array_like
+            The rectified image shape (rows, cols) of img0
+        rect_shape1 : array_like
+            The rectified image shape (rows, cols) of img1
+        img0_shape : array_like
+            The shape of the input images of the first camera
+        img1_shape : array_like
+            The shape of the input images of the second camera
+        order : int, optional
+            The spline interpolation order. Default: 1 (bilinear)
+        chunk_rows : int, optional
+            The number of rows interpolated per task
+        num_threads : int, optional
+            The number of worker threads. Default: chosen by
+            concurrent.futures.ThreadPoolExecutor
+    """
+    self.order = order
+    self.chunk_rows = chunk_rows
+    self.num_threads = num_threads
+    self.img_shapes = (tuple(img0_shape[0:2]), tuple(img1_shape[0:2]))
+    maps = []
+    valid_masks = []
+    for H, rect_shape, img_shape in ((H0, rect_shape0, img0_shape),
+                                     (H1, rect_shape1, img1_shape)):
+      src_map = self._source_map(H, rect_shape)
+      rows = src_map[..., 0]
+      cols = src_map[..., 1]
+      if order == 0:
+        valid = ((rows >= -0.5) & (rows < img_shape[0] - 0.5) &
+                 (cols >= -0.5) & (cols < img_shape[1] - 0.5))
+      else:
+        valid = ((rows >= 0) & (rows <= img_shape[0] - 1) &
+                 (cols >= 0) & (cols <= img_shape[1] - 1))
+      # keep invalid coordinates harmless for map_coordinates
+      src_map[~valid] = 0
+      maps.append(src_map)
+      valid_masks.append(valid)
+    self.maps = tuple(maps)
+    self.valid_masks = tuple(valid_masks)
+    self._pool = concurrent.futures.ThreadPoolExecutor(num_threads)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    """ shut down the worker threads """
+    self._pool.shutdown()
+
+  @staticmethod
+  def _source_map(H, rect_shape):
+    """ the (row, col) image coordinates of each rectified pixel """
+    H_inv = np.linalg.inv(H)
+    nrows, ncols = int(rect_shape[0]), int(rect_shape[1])
+    src_map = np.empty((nrows, ncols, 2), np.float32)
+    xs = np.arange(ncols, dtype=np.float64)
+    for y in range(nrows):
+      src = np.outer(H_inv[:, 0], xs) + (H_inv[:, 1] * y + H_inv[:, 2])[:, np.newaxis]
+      with np.errstate(divide='ignore', invalid='ignore'):
+        src_map[y, :, 0] = src[1] / src[2]
+        src_map[y, :, 1] = src[0] / src[2]
+    return src_map
+
+  def rectify_image(self, index, image, cval=np.nan, output=None):
+    """ rectify an image of camera index (0 or 1)
+
+        Parameters
+        ----------
+        index : int
+            The camera index
+        image : array_like
+            The image. Shape = (nr, nc) or (nr, nc, c)
+        cval : float, optional
+            The value of pixels without a source. Default: NaN
+        output : array_like, optional
+            Where to write the float32 rectified image
+
+        Returns
+        -------
+        numpy.array
+            The rectified image
+    """
+    image = np.asarray(image)
+    if image.shape[0:2] != self.img_shapes[index]:
+      raise Exception('Expecting image of shape ' + str(self.img_shapes[index]))
+    src_map = self.maps[index]
+    valid = self.valid_masks[index]
+    if output is None:
+      output = np.empty(src_map.shape[0:2] + image.shape[2:], np.float32)
+    coeffs = image_utils._spline_coefficients(image, self.order)
+    out_channels = output[..., np.newaxis] if image.ndim == 2 else output
+
+    def rectify_rows(start):
+      rows = slice(start, start + self.chunk_rows)
+      coords = np.moveaxis(src_map[rows], 2, 0)
+      for c, coeff in enumerate(coeffs):
+        out = out_channels[rows, :, c]
+        # interpolate in floating point, whatever the image type
+        out[...] = scipy.ndimage.map_coordinates(
+            coeff, coords, output=np.float64, order=self.order, mode='nearest',
+            prefilter=False)
+        out[~valid[rows]] = cval
+
+    list(self._pool.map(rectify_rows, range(0, src_map.shape[0], self.chunk_rows)))
+    return output
+
+  def rectify(self, img0, img1, cval=np.nan):
+    """ rectify a frame pair
+
+        Returns
+        -------
+        numpy.array
+            The float32 rectified images
+    """
+    return self.rectify_image(0, img0, cval), self.rectify_image(1, img1, cval)
+
+
+def _box_sum(img, window_radius):
+  """ sum over the (2r+1)x(2r+1) window around each pixel, NaN where the
+  window does not fit inside the image """
+  r = int(window_radius)
+  d = 2 * r + 1
+  table = image_utils.integral_image(img)
+  out = np.full(img.shape, np.nan)
+  if img.shape[0] >= d and img.shape[1] >= d:
+    out[r:img.shape[0]-r, r:img.shape[1]-r] = (
+        table[d:, d:] - table[:-d, d:] - table[d:, :-d] + table[:-d, :-d])
+  return out
+
+
+def _shift_cols(img, disparity, num_cols, fill):
+  """ return out[y, x] = img[y, x + disparity] for x in [0, num_cols) """
+  out = np.full((img.shape[0], num_cols) + img.shape[2:], fill, img.dtype)
+  lo = max(0, -disparity)
+  hi = min(num_cols, img.shape[1] - disparity)
+  if hi > lo:
+    out[:, lo:hi] = img[:, lo + disparity:hi + disparity]
+  return out
+
+
+def _window_stats(img, window_radius):
+  """ window sums of img and img**2, NaN for windows with invalid pixels """
+  valid = np.isfinite(img)
+  img = np.where(valid, img, 0.0)
+  complete = _box_sum((~valid).astype(np.float64), window_radius) == 0
+  sums = np.where(complete, _box_sum(img, window_radius), np.nan)
+  sums_sq = np.where(complete, _box_sum(np.square(img), window_radius), np.nan)
+  return img, sums, sums_sq
+
+
+def _popcount(values):
+  """ number of set bits in each element of a uint64 array """
+  if hasattr(np, 'bitwise_count'):
+    return np.bitwise_count(values)
+  table = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+  as_bytes = values.view(np.uint8).reshape(values.shape + (8,))
+  return table[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def census_transform(img, window_radius):
+  """ compute the census transform of an image
+
+  Parameters
+  ----------
+  img : array_like
+      The image
+  window_radius : int
+      The window radius. At most 3, so that the bits fit in 64
+
+  Returns
+  -------
+  numpy.array
+      The uint64 census codes: bit k is set if the k-th neighbor is darker
+      than the center pixel
+  numpy.array
+      True where the whole window is inside the image and finite
+  """
+  r = int(window_radius)
+  if (2 * r + 1)**2 - 1 > 64:
+    raise ValueError('census window radius must be at most 3')
+  img = np.asarray(img, np.float64)
+  nrows, ncols = img.shape
+  codes = np.zeros(img.shape, np.uint64)
+  valid = _box_sum((~np.isfinite(img)).astype(np.float64), r) == 0
+  if nrows <= 2 * r or ncols <= 2 * r:
+    return codes, valid
+  center = img[r:nrows-r, r:ncols-r]
+  interior = codes[r:nrows-r, r:ncols-r]
+  bit = 0
+  for dy in range(-r, r + 1):
+    for dx in range(-r, r + 1):
+      if dy == 0 and dx == 0:
+        continue
+      neighbor = img[r+dy:nrows-r+dy, r+dx:ncols-r+dx]
+      interior |= (neighbor < center).astype(np.uint64) << np.uint64(bit)
+      bit += 1
+  return codes, valid
+
+
+def compute_cost_volume(img0, img1, min_disparity, max_disparity,
+                        window_radius=2, method='NCC'):
+  """ compute the matching cost of every pixel of img0 at every disparity
+
+  Pixel (x, y) of img0 is matched with pixel (x + d, y) of img1, for
+  d in [min_disparity, max_disparity].
+
+  Parameters
+  ----------
+  img0 : array_like
+      The first rectified image. NaN marks invalid pixels.
+  img1 : array_like
+      The second rectified image, with the same number of rows
+  min_disparity : int
+      The smallest disparity
+  max_disparity : int
+      The largest disparity
+  window_radius : int, optional
+      The matching window radius. Default: 2
+  method : str, optional
+      method should be one of {'NCC','SSD','census'}
+        - NCC: (1 - normalized cross correlation) / 2, in [0, 1]
+        - SSD: mean squared difference over the window
+        - census: Hamming distance of the census transforms over the
+          number of bits, in [0, 1]
+
+  Returns
+  -------
+  numpy.array
+      The float32 costs, lower is better. NaN where the window of either
+      image leaves the image or contains NaN. Shape = (rows, cols, D)
+
+  Raises
+  ------
+  Exception
+      When the images have different numbers of rows, or the method is
+      unrecognized
+  """
+  img0 = np.asarray(img0, np.float64)
+  img1 = np.asarray(img1, np.float64)
+  if img0.shape[0] != img1.shape[0]:
+    raise Exception('Expecting same number of rows in img0 and img1')
+  disparities = range(int(min_disparity), int(max_disparity) + 1)
+  ncols = img0.shape[1]
+  costs = np.empty(img0.shape + (len(disparities),), np.float32)
+  area = (2 * int(window_radius) + 1)**2
+
+  if method == 'census':
+    codes0, valid0 = census_transform(img0, window_radius)
+    codes1, valid1 = census_transform(img1, window_radius)
+    num_bits = area - 1
+    for i, d in enumerate(disparities):
+      dist = _popcount(codes0 ^ _shift_cols(codes1, d, ncols, 0))
+      valid = valid0 & _shift_cols(valid1, d, ncols, False)
+      costs[:, :, i] = np.where(valid, dist / float(num_bits), np.nan)
+    return costs
+
+  if method not in ('NCC', 'SSD'):
+    raise Exception('Unrecognized method string ' + method)
+
+  a, sum_a, sum_aa = _window_stats(img0, window_radius)
+  b, sum_b, sum_bb = _window_stats(img1, window_radius)
+  if method == 'NCC':
+    var_a = sum_aa - np.square(sum_a) / area
+  for i, d in enumerate(disparities):
+    # only the cross term needs a new integral image for each disparity
+    sum_ab = _box_sum(a * _shift_cols(b, d, ncols, 0.0), window_radius)
+    sum_b_d = _shift_cols(sum_b, d, ncols, np.nan)
+    sum_bb_d = _shift_cols(sum_bb, d, ncols, np.nan)
+    if method == 'SSD':
+      cost = np.maximum(sum_aa - 2 * sum_ab + sum_bb_d, 0) / area
+    else:
+      cov = sum_ab - sum_a * sum_b_d / area
+      var_b = sum_bb_d - np.square(sum_b_d) / area
+      denom = np.sqrt(np.maximum(var_a * var_b, 0))
+      with np.errstate(divide='ignore', invalid='ignore'):
+        # textureless windows get NCC = 0
+        ncc = np.where(denom > 1e-9 * area, cov / denom, 0.0)
+      ncc[np.isnan(cov)] = np.nan
+      cost = (1 - np.clip(ncc, -1, 1)) / 2
+    costs[:, :, i] = cost
+  return costs
+
+
+def _sgm_step(prev, P1, P2):
+  """ the smoothness term of the SGM recurrence, given the previous pixel's
+  path costs (n x D) """
+  min_prev = prev.min(axis=1, keepdims=True)
+  step = np.minimum(prev, min_prev + P2)
+  np.minimum(step[:, 1:], prev[:, :-1] + P1, out=step[:, 1:])
+  np.minimum(step[:, :-1], prev[:, 1:] + P1, out=step[:, :-1])
+  step -= min_prev
+  return step
+
+
+def _aggregate_path(costs, direction, P1, P2, total):
+  """ add the path costs along direction (dy, dx) to total """
+  dy, dx = direction
+  if dy == 0:
+    # walk along the columns instead, with no shift between steps
+    costs = costs.transpose(1, 0, 2)
+    total = total.transpose(1, 0, 2)
+    dy, dx = dx, 0
+  num_steps = costs.shape[0]
+  steps = range(num_steps) if dy > 0 else range(num_steps - 1, -1, -1)
+  prev = None
+  for i in steps:
+    cur = costs[i].copy()
+    if prev is not None:
+      if dx != 0:
+        # pixels whose predecessor is outside the image start a new path,
+        # for which a zero predecessor adds nothing
+        shifted = np.zeros_like(prev)
+        if dx > 0:
+          shifted[dx:] = prev[:-dx]
+        else:
+          shifted[:dx] = prev[-dx:]
+        prev = shifted
+      cur += _sgm_step(prev, P1, P2)
+    total[i] += cur
+    prev = cur
+  return total
+
+
+def semi_global_matching(costs, P1, P2, num_paths=8):
+  """ aggregate a cost volume with semi-global matching
+
+  Parameters
+  ----------
+  costs : array_like
+      The cost volume. NaN costs are replaced by the largest valid cost.
+      Shape = (rows, cols, D)
+  P1 : float
+      The penalty for disparity changes of 1 between neighboring pixels
+  P2 : float
+      The penalty for larger disparity changes
+  num_paths : int, optional
+      The number of path directions, 4 or 8. Default: 8
+
+  Returns
+  -------
+  numpy.array
+      The float32 aggregated costs, summed over all paths.
+      Shape = (rows, cols, D)
+  """
+  if num_paths == 4:
+    directions = ((0, 1), (0, -1), (1, 0), (-1, 0))
+  elif num_paths == 8:
+    directions = ((0, 1), (0, -1), (1, 0), (-1, 0),
+                  (1, 1), (1, -1), (-1, 1), (-1, -1))
+  else:
+    raise ValueError('num_paths must be 4 or 8')
+  costs = np.asarray(costs, np.float32)
+  invalid = np.isnan(costs)
+  if invalid.any():
+    max_cost = np.nanmax(costs) if not invalid.all() else 0
+    costs = np.where(invalid, np.float32(max_cost), costs)
+  total = np.zeros(costs.shape, np.float32)
+  for direction in directions:
+    _aggregate_path(costs, direction, np.float32(P1), np.float32(P2), total)
+  return total
+
+
+def select_disparity(aggregated, costs, min_disparity, subpixel=True):
+  """ pick the disparity of lowest aggregated cost at each pixel
+
+  Parameters
+  ----------
+  aggregated : array_like
+      The aggregated costs. Shape = (rows, cols, D)
+  costs : array_like
+      The raw cost volume, used to reject pixels whose best match is invalid
+  min_disparity : int
+      The disparity of index 0
+  subpixel : bool, optional
+      Refine the disparities by fitting a parabola to the neighboring costs
+
+  Returns
+  -------
+  numpy.array
+      The float32 disparity image, NaN where there is no valid match
+  """
+  best = np.argmin(aggregated, axis=2)
+  disparity = best.astype(np.float32)
+  if subpixel and aggregated.shape[2] > 2:
+    inner = np.clip(best, 1, aggregated.shape[2] - 2)
+    c0 = np.take_along_axis(aggregated, inner[..., np.newaxis] - 1, 2)[..., 0]
+    c1 = np.take_along_axis(aggregated, inner[..., np.newaxis], 2)[..., 0]
+    c2 = np.take_along_axis(aggregated, inner[..., np.newaxis] + 1, 2)[..., 0]
+    denom = c0 - 2 * c1 + c2
+    with np.errstate(divide='ignore', invalid='ignore'):
+      offset = np.where(denom > 0, (c0 - c2) / (2 * denom), 0)
+    refine = (best == inner)
+    disparity[refine] += np.clip(offset[refine], -0.5, 0.5)
+  disparity += min_disparity
+  best_cost = np.take_along_axis(costs, best[..., np.newaxis], 2)[..., 0]
+  disparity[np.isnan(best_cost)] = np.nan
+  return disparity
+
+
+def right_disparity(aggregated, min_disparity, num_cols1):
+  """ the best integer disparity of each pixel of the second image, taken
+  from the aggregated costs of the first
+
+  Pixel x1 of the second image matches pixel x1 - d of the first, so the
+  cost of disparity d at x1 is aggregated[y, x1 - d, d].
+
+  Returns
+  -------
+  numpy.array
+      The float32 disparity image of the second image, in the same
+      convention as the first (x0 + d = x1)
+  """
+  nrows = aggregated.shape[0]
+  best_cost = np.full((nrows, num_cols1), np.inf, np.float32)
+  best = np.full((nrows, num_cols1), np.nan, np.float32)
+  for i in range(aggregated.shape[2]):
+    d = min_disparity + i
+    cost = _shift_cols(aggregated[:, :, i], -d, num_cols1, np.inf)
+    better = cost < best_cost
+    best_cost[better] = cost[better]
+    best[better] = d
+  return best
+
+
+def left_right_check(disparity0, disparity1, tolerance=1.0):
+  """ invalidate disparities that do not agree with the second image's
+
+  Parameters
+  ----------
+  disparity0 : array_like
+      The disparity image of the first image
+  disparity1 : array_like
+      The disparity image of the second image, in the same convention
+  tolerance : float, optional
+      The largest accepted difference. Default: 1
+
+  Returns
+  -------
+  numpy.array
+      disparity0 with inconsistent pixels set to NaN
+  """
+  disparity0 = np.array(disparity0, np.float32)
+  rows, cols = np.nonzero(np.isfinite(disparity0))
+  cols1 = np.round(cols + disparity0[rows, cols]).astype(np.intp)
+  inside = (cols1 >= 0) & (cols1 < disparity1.shape[1])
+  consistent = np.zeros(len(rows), bool)
+  consistent[inside] = (np.abs(disparity1[rows[inside], cols1[inside]] -
+                               disparity0[rows[inside], cols[inside]])
+                        <= tolerance)
+  disparity0[rows[~consistent], cols[~consistent]] = np.nan
+  return disparity0
+
+
+def _default_P1(img0, img1, method):
+  """ SGM penalty P1 relative to the typical cost of a wrong match """
+  if method == 'SSD':
+    # the expected squared difference of unrelated pixels
+    scale = float(np.nanvar(img0) + np.nanvar(img1))
+  else:
+    scale = 1.0
+  return 0.03 * scale
+
+
+def compute_disparity(img0, img1, min_disparity, max_disparity, window_radius=2,
+                      method='NCC', P1=None, P2=None, num_paths=8, subpixel=True,
+                      lr_tolerance=1.0, tile_rows=64, tile_overlap=16,
+                      num_threads=None):
+  """ compute a dense disparity image from a rectified image pair
+
+  The rows are processed in tiles, each extended by tile_overlap rows on
+  both sides so that the vertical SGM paths can settle before reaching the
+  rows that are kept. Tiles run in a thread pool; each holds two
+  (rows, cols, D) float32 volumes.
+
+  Parameters
+  ----------
+  img0 : array_like
+      The first rectified image. NaN marks invalid pixels.
+  img1 : array_like
+      The second rectified image. It is cropped or padded (with NaN) to the
+      number of rows of img0.
+  min_disparity : int
+      The smallest disparity. Pixel (x, y) of img0 matches (x + d, y) of img1
+  max_disparity : int
+      The largest disparity
+  window_radius : int, optional
+      The matching window radius. Default: 2
+  method : str, optional
+      The matching cost, one of {'NCC','SSD','census'}. See
+      :func:`compute_cost_volume`
+  P1 : float, optional
+      The SGM penalty for disparity changes of 1. Default: 0.03 for NCC and
+      census, scaled by the image variances for SSD
+  P2 : float, optional
+      The SGM penalty for larger disparity changes. Default: 4 * P1
+  num_paths : int, optional
+      The number of SGM paths, 4 or 8. Default: 8
+  subpixel : bool, optional
+      Refine the disparities to sub-pixel precision. Default: True
+  lr_tolerance : float, optional
+      The tolerance of the left-right consistency check, or None to skip it
+  tile_rows : int, optional
+      The number of output rows per tile
+  tile_overlap : int, optional
+      The number of extra rows processed above and below each tile
+  num_threads : int, optional
+      The number of worker threads. Default: chosen by
+      concurrent.futures.ThreadPoolExecutor
+
+  Returns
+  -------
+  numpy.array
+      The float32 disparity image of img0, NaN where there is no valid match
+  """
+  img0 = np.asarray(img0, np.float64)
+  img1 = np.asarray(img1, np.float64)
+  if img0.ndim != 2 or img1.ndim != 2:
+    raise ValueError('compute_disparity expects single channel images')
+  nrows = img0.shape[0]
+  if img1.shape[0] != nrows:
+    padded = np.full((nrows, img1.shape[1]), np.nan)
+    padded[:min(nrows, img1.shape[0])] = img1[:nrows]
+    img1 = padded
+  if P1 is None:
+    P1 = _default_P1(img0, img1, method)
+  if P2 is None:
+    P2 = 4 * P1
+  min_disparity = int(min_disparity)
+  margin = int(tile_overlap) + int(window_radius)
+
+  def process_tile(start):
+    stop = min(start + tile_rows, nrows)
+    lo = max(0, start - margin)
+    hi = min(nrows, stop + margin)
+    costs = compute_cost_volume(img0[lo:hi], img1[lo:hi], min_disparity,
+                                max_disparity, window_radius, method)
+    aggregated = semi_global_matching(costs, P1, P2, num_paths)
+    disparity = select_disparity(aggregated, costs, min_disparity, subpixel)
+    if lr_tolerance is not None:
+      disparity1 = right_disparity(aggregated, min_disparity, img1.shape[1])
+      disparity = left_right_check(disparity, disparity1, lr_tolerance)
+    return start, disparity[start - lo:stop - lo]
+
+  disparity = np.empty(img0.shape, np.float32)
+  with concurrent.futures.ThreadPoolExecutor(num_threads) as pool:
+    for start, tile in pool.map(process_tile, range(0, nrows, tile_rows)):
+      disparity[start:start + len(tile)] = tile
+  return disparity
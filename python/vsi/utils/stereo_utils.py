@@ -154,18 +154,12 @@ def rectify_calibrated_fov(camera0, camera1, img0_shape, img1_shape, img_scale=1
 
   # create image of viewing ray directions
   if check_angles:
-    print('checking angles')
-    x,y = np.meshgrid(range(0,img0_shape[1]),range(0,img0_shape[0]))
-    xypairs = [np.array((xv,yv)) for xv,yv in zip(x.flat,y.flat)]
-    rays = camera0.viewing_rays(xypairs)
-    angles = np.arccos(np.dot(rays, -plane_normal)).reshape(img0_shape[0:2])
-    angle_mask0 = angles <= np.deg2rad(90.0 - min_graze_angle_degrees)
-
-    x,y = np.meshgrid(range(0,img1_shape[1]),range(0,img1_shape[0]))
-    xypairs = [np.array((xv,yv)) for xv,yv in zip(x.flat,y.flat)]
-    rays = camera1.viewing_rays(xypairs)
-    angles = np.arccos(np.dot(rays, -plane_normal)).reshape(img1_shape)
-    angle_mask1 = angles <= np.deg2rad(90.0 - min_graze_angle_degrees)
+    # angle between ray and -normal <= 90 - min_graze  <=>  cos(angle) >= ...
+    min_cos = np.cos(np.deg2rad(90.0 - min_graze_angle_degrees))
+    rays = camera_utils.viewing_ray_grid(camera0, img0_shape)
+    angle_mask0 = np.dot(rays, -plane_normal.astype(np.float32)) >= min_cos
+    rays = camera_utils.viewing_ray_grid(camera1, img1_shape)
+    angle_mask1 = np.dot(rays, -plane_normal.astype(np.float32)) >= min_cos
   else:
     angle_mask0 = None
     angle_mask1 = None
@@ -221,9 +215,8 @@ def rectify_calibrated_fov(camera0, camera1, img0_shape, img1_shape, img_scale=1
   plane_y /= np.linalg.norm(plane_y)
 
   # scale plane_x and plane_y so that pixel size in center of image is preserved
-  plane_origin = camera0.backproject_point_plane(camera0.principal_point(), plane)
-  plane_origin_dx = camera0.backproject_point_plane(camera0.principal_point() + np.array((1,0)), plane)
-  plane_origin_dy = camera0.backproject_point_plane(camera0.principal_point() + np.array((0,1)), plane)
+  plane_origin, plane_origin_dx, plane_origin_dy = camera0.backproject_points_plane_array(
+      camera0.principal_point() + np.array(((0,0),(1,0),(0,1))), plane)
   plane_dx = np.linalg.norm(plane_origin_dx - plane_origin)
   plane_dy = np.linalg.norm(plane_origin_dy - plane_origin)
   scale_factor = (plane_dx + plane_dy)/2.0 / img_scale
@@ -235,8 +228,8 @@ def rectify_calibrated_fov(camera0, camera1, img0_shape, img1_shape, img_scale=1
   H1plane = camera1.image2plane(plane_origin, plane_x, plane_y)
 
   # now compute backprojection of images onto plane
-  c0 = camera0.backproject_point_plane(img0_corners.mean(axis=0), plane)
-  c1 = camera1.backproject_point_plane(img1_corners.mean(axis=0), plane)
+  c0 = camera0.backproject_points_plane_array(img0_corners.mean(axis=0), plane)[0]
+  c1 = camera1.backproject_points_plane_array(img1_corners.mean(axis=0), plane)[0]
   offset_3d = c0 - c1
   # we can't change y coordinate w/out violating epipolar constraint, ,but x is free to move
   offset_plane = np.array((np.dot(offset_3d, plane_x), 0 ))
@@ -282,39 +275,100 @@ def rectify_calibrated_fov(camera0, camera1, img0_shape, img1_shape, img_scale=1
   return H0final, H1final, output_shape0, output_shape1
 
 
-def disparity_to_depth(disparity_image, cam0, cam1):
+def disparity_to_depth(disparity_image, cam0, cam1, chunk_rows=256,
+                       dtype=np.float32, output=None):
   """ covert a disparity image to a set of triangulated 3-d points
 
+  The image is processed in chunks of rows. If the two cameras are a
+  rectified pair (i.e. their 2nd and 3rd projection matrix rows are equal, up
+  to scale), each point is computed in closed form. Otherwise the points are
+  triangulated with :func:`vsi.utils.camera_utils.triangulate_points`.
+
   Parameters
   ----------
   disparity_image :
-      The disparity image
+      The disparity image. Pixel (x, y) in the first image corresponds to
+      pixel (x + disparity, y) in the second. NaN marks unknown disparities.
   cam0 :
   cam1 :
+  chunk_rows : int, optional
+      The number of rows processed at once, which bounds the size of the
+      temporary arrays
+  dtype : numpy.dtype, optional
+      The dtype of the output images. Default: np.float32
+  output : array_like, optional
+      Where to write the points (e.g. a numpy.memmap for large frames):
+      either a single (H, W, 3) array, or a tuple of three (H, W) arrays
 
   Returns
   -------
   numpy.array
-      A set of triangulated 3-d points
+      The x, y and z images, or output if given. Pixels without a disparity
+      (or whose point is at infinity) are NaN.
   """
-  img_shape = disparity_image.shape
-  xvals_lin = np.array(range(0,img_shape[1]))
-  yvals_lin = np.array(range(0,img_shape[0]))
-
-  xvals,yvals = np.meshgrid(xvals_lin, yvals_lin)
-
-  pts_2d_img0 = [np.array((x,y)) for x,y in zip(xvals.reshape(-1),yvals.reshape(-1))]
-
-  # add offset of (disparity, 0) to each pixel to get its correspondence in second image
-  pts_2d_img1 = [p + np.array((disp,0)) if not np.isnan(disp) else None for p,disp in zip(pts_2d_img0, disparity_image.reshape(-1))]
-
-  # perform the triangulation for each point
-  pts_3d = [camera_utils.triangulate_point((cam0,cam1), (pt0,pt1)) if pt1 is not None else np.zeros(4) for pt0,pt1 in zip(pts_2d_img0, pts_2d_img1)]
-
-  ximg = np.array([p[0]/p[3] if p[3] else np.nan for p in pts_3d]).reshape(img_shape)
-  yimg = np.array([p[1]/p[3] if p[3] else np.nan for p in pts_3d]).reshape(img_shape)
-  zimg = np.array([p[2]/p[3] if p[3] else np.nan for p in pts_3d]).reshape(img_shape)
-
-  return ximg, yimg, zimg
-
-
+  img_shape = disparity_image.shape[0:2]
+  if output is None:
+    output = tuple(np.empty(img_shape, dtype) for _ in range(3))
+  P0 = np.asarray(cam0.P, np.float64)
+  P1 = np.asarray(cam1.P, np.float64)
+  rectified = _is_rectified_pair(P0, P1)
+
+  for start in range(0, img_shape[0], chunk_rows):
+    rows = slice(start, min(start + chunk_rows, img_shape[0]))
+    disp = np.asarray(disparity_image[rows], np.float64)
+    yvals, xvals = np.mgrid[rows, 0:img_shape[1]].astype(np.float64)
+
+    if rectified:
+      pts_h = _triangulate_rectified(P0, P1, xvals, yvals, disp)
+    else:
+      projections = np.stack((np.stack((xvals, yvals), axis=-1),
+                              np.stack((xvals + disp, yvals), axis=-1)),
+                             axis=-2).reshape(-1, 2, 2)
+      pts_h, _ = camera_utils.triangulate_points(
+          np.array((P0, P1)), projections, return_homogeneous=True)
+      pts_h = pts_h.reshape(disp.shape + (4,))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      pts = pts_h[..., 0:3] / pts_h[..., 3:4]
+    pts[~np.isfinite(pts).all(axis=-1)] = np.nan
+
+    if isinstance(output, tuple):
+      for i in range(3):
+        output[i][rows] = pts[..., i]
+    else:
+      output[rows] = pts
+
+  return output
+
+
+def _is_rectified_pair(P0, P1):
+  """ true if the 2nd and 3rd rows of the projection matrices are equal up to
+  scale, i.e. corresponding points have identical y coordinates """
+  rows0 = P0[1:3] / np.linalg.norm(P0[2, 0:3])
+  rows1 = P1[1:3] / np.linalg.norm(P1[2, 0:3])
+  atol = 1e-10 * np.abs(rows0).max()
+  return (np.allclose(rows0, rows1, rtol=1e-9, atol=atol) or
+          np.allclose(rows0, -rows1, rtol=1e-9, atol=atol))
+
+
+def _triangulate_rectified(P0, P1, xvals, yvals, disp):
+  """ closed-form triangulation for a rectified pair
+
+  The y equation of the second camera is redundant, so the (homogeneous)
+  point is the null vector of the remaining 3x4 system, computed as the
+  generalized cross product of its rows """
+  invalid = np.isnan(disp)
+  x1vals = xvals + np.where(invalid, 0, disp)
+  a = P0[0] - xvals[..., np.newaxis] * P0[2]
+  b = P0[1] - yvals[..., np.newaxis] * P0[2]
+  c = P1[0] - x1vals[..., np.newaxis] * P1[2]
+  pts_h = np.empty(disp.shape + (4,))
+  for j in range(4):
+    i0, i1, i2 = [i for i in range(4) if i != j]
+    # 3x3 determinant of columns i0, i1, i2, expanded along the first row
+    det = (a[..., i0] * (b[..., i1] * c[..., i2] - b[..., i2] * c[..., i1])
+           - a[..., i1] * (b[..., i0] * c[..., i2] - b[..., i2] * c[..., i0])
+           + a[..., i2] * (b[..., i0] * c[..., i1] - b[..., i1] * c[..., i0]))
+    pts_h[..., j] = det if j % 2 == 0 else -det
+  pts_h[invalid] = np.nan
+  return pts_h